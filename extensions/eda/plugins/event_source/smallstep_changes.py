@@ -0,0 +1,364 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+"""smallstep_changes: emit an event for each Smallstep collection, instance or workload that changed
+
+The Smallstep API does not push change notifications, so the source polls it
+incrementally. Every ``interval`` seconds it lists the collections, whose
+``updatedAt`` and ``instanceCount`` tell which ones changed. Only those have
+their instances listed and their workloads fetched. Instance metadata and
+workload changes do not show on the collection, so every collection is also
+swept in full once per ``sweep_interval``. The state seen so far is kept in
+the ``checkpoint`` file, so a restarted rulebook only emits what changed while
+it was down.
+
+Arguments:
+    api_host: Smallstep API host. Default: gateway.smallstep.com
+    api_token: API token. Default: the SMALLSTEP_API_TOKEN environment variable
+    collections: Collection slugs to watch. Default: every collection of the team
+    instances: Watch the instances of the collections. Default: true
+    workloads: Workloads to watch, as a list of dicts with collection_slug and workload_slug.
+        The API cannot list the workloads of a collection. Default: []
+    interval: Seconds between polls. Default: 60
+    sweep_interval: Seconds between full sweeps of unchanged collections. Default: 900
+    checkpoint: JSON file the seen state is kept in across restarts. Default: none, the state is kept in memory
+    initial: Emit a created event for every object on the first poll without a checkpoint. Default: false
+    page_size: Items per page of list requests. Default: 100
+    max_workers: Collections polled concurrently. Default: 8
+    timeout: Seconds before an API request times out. Default: 30
+
+Events have one ``smallstep`` key:
+    change: created, updated or deleted
+    type: collection, instance or workload
+    collection_slug: Slug of the collection
+    instance_id: ID of the instance, for instances
+    workload_slug: Slug of the workload, for workloads
+    updated_at: updatedAt of the object, when the API returns one
+    object: The object as the API returned it, except for deleted objects
+
+Example:
+    - name: Reconcile what changed in Smallstep
+      hosts: localhost
+      sources:
+        - smallstep.agent.smallstep_changes:
+            collections:
+              - hotdog-staging
+            checkpoint: /var/lib/eda/smallstep.json
+            interval: 30
+      rules:
+        - name: Re-register a changed instance
+          condition: event.smallstep.type == "instance" and event.smallstep.change != "deleted"
+          action:
+            run_playbook:
+              name: playbooks/reconcile_instance.yml
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Responses that are worth retrying on the next poll rather than giving up on
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class PollError(Exception):
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def content_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SeenState:
+    """What the source has seen of each object, loaded from and saved to ``checkpoint``
+
+    Collections are keyed by slug, instances by ``slug/id`` and workloads by
+    ``slug/workload``. Instances and collections hold their ``updatedAt``,
+    workloads a hash of their content, as the API does not timestamp them.
+    """
+
+    def __init__(self, path, api_host):
+        self.path = os.path.expanduser(path) if path else None
+        self.api_host = api_host
+        self.collections = {}
+        self.instances = {}
+        self.workloads = {}
+        self.swept = {}
+        self.loaded = False
+        if self.path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("Ignoring the unreadable checkpoint %s", self.path)
+            return
+        # A checkpoint of another API tells nothing about this one
+        if data.get("api_host") != self.api_host:
+            return
+        self.collections = data.get("collections", {})
+        self.instances = data.get("instances", {})
+        self.workloads = data.get("workloads", {})
+        self.swept = data.get("swept", {})
+        self.loaded = True
+
+    def snapshot(self):
+        return copy.deepcopy((self.collections, self.instances, self.workloads, self.swept))
+
+    def restore(self, snapshot):
+        self.collections, self.instances, self.workloads, self.swept = snapshot
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".smallstep_changes")
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {
+                    "api_host": self.api_host,
+                    "collections": self.collections,
+                    "instances": self.instances,
+                    "workloads": self.workloads,
+                    "swept": self.swept,
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+
+def event(change, object_type, collection_slug, value=None, **keys):
+    body = {"change": change, "type": object_type, "collection_slug": collection_slug}
+    body.update(keys)
+    if value is not None:
+        body["updated_at"] = value.get("updatedAt")
+        body["object"] = value
+    return {"smallstep": body}
+
+
+class ChangePoller:
+    def __init__(self, client, args, state):
+        self.client = client
+        self.state = state
+        self.collections = args.get("collections")
+        self.instances = args.get("instances", True)
+        self.workloads = args.get("workloads") or []
+        self.sweep_interval = args.get("sweep_interval", 900)
+        self.page_size = args.get("page_size", 100)
+        self.workers = asyncio.Semaphore(args.get("max_workers", 8))
+        self.requests = 0
+
+    async def _get(self, path, params=None):
+        self.requests += 1
+        try:
+            res = await self.client.get(path, params=params)
+        except httpx.HTTPError as exception:
+            raise PollError(f"GET {path} failed: {exception}")
+        if res.status_code >= 400:
+            retry_after = res.headers.get("Retry-After")
+            raise PollError(
+                f"GET {path} returned {res.status_code}: {res.text.strip()}",
+                status_code=res.status_code,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        return res
+
+    async def _pages(self, path):
+        """Every item of a list endpoint, following the ``X-Next-Cursor`` header"""
+        items = []
+        params = {"first": self.page_size}
+        while True:
+            res = await self._get(path, params)
+            items.extend(res.json())
+            cursor = res.headers.get("X-Next-Cursor")
+            if not cursor:
+                return items
+            params = {"first": self.page_size, "after": cursor}
+
+    async def poll(self):
+        """Poll the API once
+
+        A poll that fails leaves the seen state as it was, so its changes are
+        reported by the next one.
+
+        :return: the events of every change since the last poll
+        """
+        snapshot = self.state.snapshot()
+        try:
+            return await self._poll()
+        except BaseException:
+            self.state.restore(snapshot)
+            raise
+
+    async def _poll(self):
+        listed = {collection["slug"]: collection for collection in await self._pages("/collections")}
+        if self.collections is not None:
+            listed = {slug: listed[slug] for slug in self.collections if slug in listed}
+
+        events = []
+        now = time.time()
+        changed = []
+        for slug, collection in listed.items():
+            seen = self.state.collections.get(slug)
+            signature = {"updated_at": collection.get("updatedAt"), "instance_count": collection.get("instanceCount")}
+            if seen is None:
+                events.append(event("created", "collection", slug, collection))
+            elif seen["updated_at"] != signature["updated_at"]:
+                events.append(event("updated", "collection", slug, collection))
+            if seen != signature or now - self.state.swept.get(slug, 0) >= self.sweep_interval:
+                changed.append(slug)
+            self.state.collections[slug] = signature
+
+        for slug in [slug for slug in self.state.collections if slug not in listed]:
+            events.append(event("deleted", "collection", slug))
+            self._forget(slug)
+
+        results = await asyncio.gather(*(self._poll_collection(slug) for slug in changed))
+        for slug, collection_events in zip(changed, results):
+            if collection_events is None:
+                # Deleted after the collections were listed
+                events.append(event("deleted", "collection", slug))
+                self._forget(slug)
+                continue
+            events.extend(collection_events)
+            self.state.swept[slug] = now
+        return events
+
+    def _forget(self, slug):
+        prefix = slug + "/"
+        del self.state.collections[slug]
+        self.state.swept.pop(slug, None)
+        for seen in (self.state.instances, self.state.workloads):
+            for key in [key for key in seen if key.startswith(prefix)]:
+                del seen[key]
+
+    async def _poll_collection(self, slug):
+        """Events of the instances and workloads of a collection, or None when the collection is gone"""
+        async with self.workers:
+            events = []
+            if self.instances:
+                try:
+                    events.extend(await self._poll_instances(slug))
+                except PollError as exception:
+                    if exception.status_code != 404:
+                        raise
+                    return None
+            for wanted in self.workloads:
+                if wanted["collection_slug"] == slug:
+                    events.extend(await self._poll_workload(slug, wanted["workload_slug"]))
+            return events
+
+    async def _poll_instances(self, slug):
+        events = []
+        prefix = slug + "/"
+        listed = {instance["id"]: instance for instance in await self._pages(f"/collections/{slug}/items")}
+        for instance_id, instance in listed.items():
+            key = prefix + instance_id
+            seen = self.state.instances.get(key)
+            if seen is None:
+                events.append(event("created", "instance", slug, instance, instance_id=instance_id))
+            elif seen != instance.get("updatedAt"):
+                events.append(event("updated", "instance", slug, instance, instance_id=instance_id))
+            self.state.instances[key] = instance.get("updatedAt")
+        for key in [key for key in self.state.instances if key.startswith(prefix)]:
+            instance_id = key[len(prefix) :]
+            if instance_id not in listed:
+                events.append(event("deleted", "instance", slug, instance_id=instance_id))
+                del self.state.instances[key]
+        return events
+
+    async def _poll_workload(self, slug, workload_slug):
+        key = f"{slug}/{workload_slug}"
+        seen = self.state.workloads.get(key)
+        try:
+            workload = (await self._get(f"/device-collections/{slug}/workloads/{workload_slug}")).json()
+        except PollError as exception:
+            if exception.status_code != 404:
+                raise
+            if seen is None:
+                return []
+            del self.state.workloads[key]
+            return [event("deleted", "workload", slug, workload_slug=workload_slug)]
+
+        digest = content_hash(workload)
+        self.state.workloads[key] = digest
+        if seen is None:
+            return [event("created", "workload", slug, workload, workload_slug=workload_slug)]
+        if seen != digest:
+            return [event("updated", "workload", slug, workload, workload_slug=workload_slug)]
+        return []
+
+
+async def main(queue: asyncio.Queue, args: Dict[str, Any]):
+    api_host = args.get("api_host", "gateway.smallstep.com")
+    token = args.get("api_token") or os.environ.get("SMALLSTEP_API_TOKEN")
+    if not token:
+        raise ValueError("smallstep_changes needs api_token or the SMALLSTEP_API_TOKEN environment variable")
+    interval = args.get("interval", 60)
+    state = SeenState(args.get("checkpoint"), api_host)
+    # Without a checkpoint, the first poll only learns the current state, unless asked to report it
+    quiet = not state.loaded and not args.get("initial", False)
+    failures = 0
+
+    async with httpx.AsyncClient(
+        base_url=f"https://{api_host}/api",
+        headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
+        timeout=args.get("timeout", 30),
+    ) as client:
+        poller = ChangePoller(client, args, state)
+        while True:
+            delay = interval
+            try:
+                events = await poller.poll()
+            except PollError as exception:
+                # Such as a revoked token: retrying would not help, so the rulebook reports the error
+                if exception.status_code is not None and exception.status_code not in RETRY_STATUS_CODES:
+                    raise
+                failures += 1
+                # Back off while the API is failing, as every poll would fail the same way
+                delay = min(interval * 2**failures, interval * 10)
+                if exception.retry_after is not None:
+                    delay = max(delay, exception.retry_after)
+                logger.warning("Polling Smallstep failed, retrying in %ss: %s", delay, exception)
+            else:
+                failures = 0
+                if not quiet:
+                    for change in events:
+                        await queue.put(change)
+                quiet = False
+                # Saved after the events are queued, so that a crash repeats events rather than losing them
+                state.save()
+                logger.debug("Polled Smallstep with %d requests, %d changes", poller.requests, len(events))
+            poller.requests = 0
+            await asyncio.sleep(delay)
+
+
+if __name__ == "__main__":
+    # Prints the events of a local API, such as the mock API of tests/benchmark:
+    # SSL_CERT_FILE=cert.pem python smallstep_changes.py '{"api_host": "127.0.0.1:8443", "api_token": "x"}'
+    import sys
+
+    class MockQueue:
+        async def put(self, event):
+            print(json.dumps(event), flush=True)
+
+    logging.basicConfig(level=logging.DEBUG)
+    asyncio.run(main(MockQueue(), json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}))
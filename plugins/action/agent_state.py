@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+from ansible.plugins.action import ActionBase
+
+
+class ActionModule(ActionBase):
+    """Converge step-agent on a host, transferring the package only when it is needed
+
+    The ``smallstep.agent.agent_state`` module runs once without the package.
+    Only when it reports ``package_required`` is ``package_src`` copied from
+    the controller to a temporary directory on the host and the module run
+    again with it, so hosts that are up to date take a single round trip.
+    """
+
+    TRANSFERS_FILES = False
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super().run(tmp, task_vars)
+        del tmp
+
+        module_args = self._task.args.copy()
+        package_src = module_args.pop("package_src", None)
+
+        state = self._execute_module(
+            module_name="smallstep.agent.agent_state",
+            module_args=module_args,
+            task_vars=task_vars,
+        )
+        if not state.get("package_required") or state.get("failed"):
+            result.update(state)
+            return result
+
+        if package_src is None:
+            result.update(state)
+            result.update(
+                failed=True,
+                msg=f"step-agent-plugin {module_args.get('version') or ''} is not installed and no package was given",
+            )
+            return result
+
+        if self._task.check_mode:
+            result.update(state, changed=True, actions=["install"])
+            return result
+
+        source = self._find_needle("files", package_src)
+        tmpdir = self._connection._shell.tmpdir or self._make_tmp_path()
+        try:
+            package = self._connection._shell.join_path(tmpdir, source.rsplit("/", 1)[-1])
+            self._transfer_file(source, package)
+            self._fixup_perms2((tmpdir, package))
+            module_args["package"] = package
+            result.update(
+                self._execute_module(
+                    module_name="smallstep.agent.agent_state",
+                    module_args=module_args,
+                    task_vars=task_vars,
+                )
+            )
+        finally:
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+        return result
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+from ansible.plugins.action import ActionBase
+
+
+class ActionModule(ActionBase):
+    """Collect the instance of every host in the play and register them in one module run
+
+    With ``host_var`` set, the value of that variable on every host in
+    ``ansible_play_batch`` is appended to ``instances`` before the
+    ``smallstep.agent.instances`` module is executed once. Under ``serial``,
+    hosts of earlier batches are left out, as their batch registered them.
+    """
+
+    TRANSFERS_FILES = False
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super().run(tmp, task_vars)
+        del tmp
+
+        module_args = self._task.args.copy()
+        instances = list(module_args.get("instances") or [])
+
+        host_var = module_args.get("host_var")
+        if host_var:
+            hostvars = task_vars.get("hostvars", {})
+            for host in task_vars.get("ansible_play_batch", []):
+                instance = hostvars[host].get(host_var)
+                if instance:
+                    instances.append(instance)
+
+        module_args["instances"] = instances
+        result.update(
+            self._execute_module(
+                module_name="smallstep.agent.instances",
+                module_args=module_args,
+                task_vars=task_vars,
+            )
+        )
+        return result
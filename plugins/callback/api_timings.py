@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+name: api_timings
+
+short_description: Aggregate Smallstep API call timings across a play
+
+description:
+    - Collects the C(smallstep_telemetry) returned by the C(collection), C(workload) and C(instance) modules.
+    - At the end of each play it prints per-operation call counts, p50/p95/p99 latency, retries and error codes.
+    - It also sums the connections, TLS handshakes and bytes on the wire that the modules report.
+    - Optionally writes the totals of the whole run as a Prometheus textfile and as a JSON report.
+
+type: aggregate
+
+author:
+    - Smallstep Engineering
+
+requirements:
+    - enable in configuration, for example C(callbacks_enabled = smallstep.agent.api_timings)
+
+options:
+    prometheus_textfile:
+        description:
+            - Path of a Prometheus textfile (node_exporter textfile collector format) written at the end of the run.
+        env:
+        - name: SMALLSTEP_API_TIMINGS_PROMETHEUS
+        ini:
+        - section: callback_smallstep_api_timings
+          key: prometheus_textfile
+        type: path
+    json_report:
+        description:
+            - Path of a JSON report written at the end of the run.
+        env:
+        - name: SMALLSTEP_API_TIMINGS_JSON
+        ini:
+        - section: callback_smallstep_api_timings
+          key: json_report
+        type: path
+"""
+
+import json  # noqa: E402
+import math  # noqa: E402
+import os  # noqa: E402
+import tempfile  # noqa: E402
+from collections import Counter, defaultdict  # noqa: E402
+
+from ansible.plugins.callback import CallbackBase  # noqa: E402
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    rank = max(int(math.ceil(pct / 100.0 * len(values))) - 1, 0)
+    return values[rank]
+
+
+class OperationStats:
+    def __init__(self):
+        self.durations = []
+        self.errors = Counter()
+
+    def add(self, call):
+        self.durations.append(call.get("duration", 0.0))
+        if call.get("status_code") is not None:
+            self.errors[str(call["status_code"])] += 1
+        elif call.get("error"):
+            self.errors[call["error"]] += 1
+
+    def summary(self):
+        durations = sorted(self.durations)
+        return {
+            "count": len(durations),
+            "sum": round(sum(durations), 6),
+            "p50": percentile(durations, 50),
+            "p95": percentile(durations, 95),
+            "p99": percentile(durations, 99),
+            "errors": dict(self.errors),
+        }
+
+
+class PlayStats:
+    def __init__(self, name):
+        self.name = name
+        self.operations = defaultdict(OperationStats)
+        self.retries = 0
+        self.module_runs = 0
+        self.rate_limit_wait = 0.0
+        self.transport = Counter()
+
+    def add(self, telemetry, attempts):
+        self.module_runs += 1
+        self.retries += max(attempts - 1, 0)
+        self.rate_limit_wait += telemetry.get("rate_limit_wait", 0.0)
+        transport = dict(telemetry.get("transport") or {})
+        for version, count in transport.pop("http_versions", {}).items():
+            self.transport[version] += count
+        self.transport.update(transport)
+        for call in telemetry.get("calls", []):
+            self.operations[call["operation"]].add(call)
+
+    def summary(self):
+        return {
+            "play": self.name,
+            "module_runs": self.module_runs,
+            "retries": self.retries,
+            "rate_limit_wait": round(self.rate_limit_wait, 6),
+            "transport": dict(self.transport),
+            "operations": {op: stats.summary() for op, stats in sorted(self.operations.items())},
+        }
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "smallstep.agent.api_timings"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super().__init__()
+        self.plays = []
+        self.current = None
+
+    def _flush_play(self):
+        if self.current is not None and self.current.module_runs:
+            self._display_play(self.current.summary())
+
+    def _record(self, result):
+        telemetry = result._result.get("smallstep_telemetry")
+        if not telemetry or self.current is None:
+            return
+        self.current.add(telemetry, result._result.get("attempts", 1))
+
+    def _display_play(self, summary):
+        self._display.banner(f"SMALLSTEP API TIMINGS [{summary['play']}]")
+        self._display.display(
+            f"module runs: {summary['module_runs']}, retries: {summary['retries']}, "
+            f"rate limit wait: {summary['rate_limit_wait']:.1f}s"
+        )
+        transport = summary["transport"]
+        if transport:
+            self._display.display(
+                f"connections: {transport.get('connections', 0)}, "
+                f"TLS handshakes: {transport.get('tls_handshakes', 0)}, "
+                f"bytes received: {transport.get('bytes_received', 0)} "
+                f"(decoded {transport.get('bytes_decoded', 0)}), bytes sent: {transport.get('bytes_sent', 0)}"
+            )
+        if transport.get("hedges"):
+            self._display.display(f"hedges: {transport['hedges']}, won: {transport.get('hedges_won', 0)}")
+        if transport.get("coalesced"):
+            self._display.display(f"lookups coalesced: {transport['coalesced']}")
+        self._display.display(f"{'operation':<24} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  errors")
+        for op, stats in summary["operations"].items():
+            errors = ", ".join(f"{code}={n}" for code, n in sorted(stats["errors"].items())) or "-"
+            self._display.display(
+                f"{op:<24} {stats['count']:>7} {stats['p50'] * 1000:>9.1f} "
+                f"{stats['p95'] * 1000:>9.1f} {stats['p99'] * 1000:>9.1f}  {errors}"
+            )
+
+    def v2_playbook_on_play_start(self, play):
+        self._flush_play()
+        self.current = PlayStats(play.get_name().strip())
+        self.plays.append(self.current)
+
+    def v2_runner_on_ok(self, result):
+        # Loop results are recorded item by item.
+        if "results" not in result._result:
+            self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        if "results" not in result._result:
+            self._record(result)
+
+    def v2_runner_on_skipped(self, result):
+        # Modules skip items that another shard owns, after their telemetry was taken
+        if "results" not in result._result:
+            self._record(result)
+
+    def v2_runner_item_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_item_on_failed(self, result):
+        self._record(result)
+
+    def v2_runner_item_on_skipped(self, result):
+        self._record(result)
+
+    def v2_playbook_on_stats(self, stats):
+        self._flush_play()
+
+        report = [play.summary() for play in self.plays if play.module_runs]
+        json_report = self.get_option("json_report")
+        if json_report:
+            self._write(json_report, json.dumps({"plays": report}, indent=2, sort_keys=True))
+
+        prometheus_textfile = self.get_option("prometheus_textfile")
+        if prometheus_textfile:
+            self._write(prometheus_textfile, self._prometheus())
+
+    def _prometheus(self):
+        totals = defaultdict(OperationStats)
+        retries = 0
+        rate_limit_wait = 0.0
+        transport = Counter()
+        for play in self.plays:
+            retries += play.retries
+            rate_limit_wait += play.rate_limit_wait
+            transport.update(play.transport)
+            for op, stats in play.operations.items():
+                totals[op].durations.extend(stats.durations)
+                totals[op].errors.update(stats.errors)
+
+        lines = [
+            "# HELP smallstep_api_call_duration_seconds Latency of Smallstep API calls made by the collection modules.",
+            "# TYPE smallstep_api_call_duration_seconds summary",
+        ]
+        for op, stats in sorted(totals.items()):
+            summary = stats.summary()
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                lines.append(
+                    f'smallstep_api_call_duration_seconds{{operation="{op}",quantile="{quantile}"}} {summary[key]}'
+                )
+            lines.append(f'smallstep_api_call_duration_seconds_sum{{operation="{op}"}} {summary["sum"]}')
+            lines.append(f'smallstep_api_call_duration_seconds_count{{operation="{op}"}} {summary["count"]}')
+
+        lines += [
+            "# HELP smallstep_api_call_errors_total Smallstep API calls that failed, by status code or error.",
+            "# TYPE smallstep_api_call_errors_total counter",
+        ]
+        for op, stats in sorted(totals.items()):
+            for code, count in sorted(stats.errors.items()):
+                lines.append(f'smallstep_api_call_errors_total{{operation="{op}",code="{code}"}} {count}')
+
+        lines += [
+            "# HELP smallstep_api_task_retries_total Task retries of modules that call the Smallstep API.",
+            "# TYPE smallstep_api_task_retries_total counter",
+            f"smallstep_api_task_retries_total {retries}",
+            "# HELP smallstep_api_rate_limit_wait_seconds_total Time modules spent waiting on the shared rate limiter.",
+            "# TYPE smallstep_api_rate_limit_wait_seconds_total counter",
+            f"smallstep_api_rate_limit_wait_seconds_total {round(rate_limit_wait, 6)}",
+            "# HELP smallstep_api_connections_total HTTP connections the collection modules opened to the Smallstep API.",
+            "# TYPE smallstep_api_connections_total counter",
+            f"smallstep_api_connections_total {transport['connections']}",
+            "# HELP smallstep_api_tls_handshakes_total TLS handshakes with the Smallstep API.",
+            "# TYPE smallstep_api_tls_handshakes_total counter",
+            f"smallstep_api_tls_handshakes_total {transport['tls_handshakes']}",
+            "# HELP smallstep_api_bytes_total Bytes exchanged with the Smallstep API; received is on the wire, decoded after decompression.",
+            "# TYPE smallstep_api_bytes_total counter",
+        ]
+        for direction in ("sent", "received", "decoded"):
+            lines.append(f'smallstep_api_bytes_total{{direction="{direction}"}} {transport[f"bytes_{direction}"]}')
+        lines += [
+            "# HELP smallstep_api_hedges_total Lookups sent a second time, and hedges that answered first.",
+            "# TYPE smallstep_api_hedges_total counter",
+            f'smallstep_api_hedges_total{{outcome="issued"}} {transport["hedges"]}',
+            f'smallstep_api_hedges_total{{outcome="won"}} {transport["hedges_won"]}',
+            "# HELP smallstep_api_coalesced_total Lookups answered by an identical lookup that was in flight.",
+            "# TYPE smallstep_api_coalesced_total counter",
+            f"smallstep_api_coalesced_total {transport['coalesced']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _write(self, path, content):
+        # Write to a temporary file and rename so readers such as the
+        # node_exporter textfile collector never see a partial file.
+        path = os.path.expanduser(path)
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".api_timings")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        # mkstemp creates the file 0600, and the collector may run as another user
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+
+class ModuleDocFragment(object):
+    DOCUMENTATION = r"""
+options:
+    manifest:
+        description:
+            - Path to a SQLite file on the controller that records the hash of every desired item applied, together
+              with the result of applying it.
+            - When the hash of an item matches its entry, the recorded result is returned without any API request.
+            - Items are keyed by API host, API token, object type and slug or ID. Nothing is recorded in check mode.
+            - Disabled when unset.
+        env:
+        - name: SMALLSTEP_MANIFEST
+        type: path
+    manifest_sweep_interval:
+        description:
+            - Number of seconds after which an unchanged item is reconciled against the API again, to catch changes
+              made outside of Ansible.
+            - C(0) forces a full sweep.
+        env:
+        - name: SMALLSTEP_MANIFEST_SWEEP_INTERVAL
+        default: 86400
+        type: int
+"""
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+
+class ModuleDocFragment(object):
+    DOCUMENTATION = r"""
+options:
+    rate_limit:
+        description:
+            - Maximum sustained number of Smallstep API requests per second for I(api_host).
+            - The budget is a token bucket kept in a lock-protected file on the controller and shared by every
+              module process, so it holds across forks and loop items.
+            - The time spent waiting for a token is returned in C(smallstep_telemetry.rate_limit_wait).
+            - Disabled when unset.
+        env:
+        - name: SMALLSTEP_RATE_LIMIT
+        type: float
+    rate_limit_burst:
+        description:
+            - Number of requests that may be sent back to back before I(rate_limit) applies.
+        env:
+        - name: SMALLSTEP_RATE_LIMIT_BURST
+        default: 10
+        type: int
+"""
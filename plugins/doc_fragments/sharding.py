@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+
+class ModuleDocFragment(object):
+    DOCUMENTATION = r"""
+options:
+    shard_index:
+        description:
+            - Index of the shard this controller converges, from C(0) to I(shard_count) - 1.
+            - Objects are assigned to shards by a consistent hash of their collection slug, and of their workload slug
+              or instance ID, so every controller computes the same disjoint slice without coordination.
+            - Objects owned by another shard are skipped without any API request, except collections with
+              I(state=present), which are created if missing by whichever shard needs them first.
+            - The index, count and owning shard of the object are returned in C(shard).
+        env:
+        - name: SMALLSTEP_SHARD_INDEX
+        default: 0
+        type: int
+    shard_count:
+        description:
+            - Number of controllers that converge the fleet in parallel.
+            - Changing it moves only the share of objects that the added or removed shards own.
+        env:
+        - name: SMALLSTEP_SHARD_COUNT
+        default: 1
+        type: int
+"""
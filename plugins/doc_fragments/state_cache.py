@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+
+class ModuleDocFragment(object):
+    DOCUMENTATION = r"""
+options:
+    state_cache:
+        description:
+            - Path to a SQLite file on the controller used to remember the last observed Smallstep API objects.
+            - Objects are keyed by API host, team, object type and slug or ID.
+            - Entries are dropped whenever the module writes the object, so the post-write read always hits the API.
+            - Disabled when unset.
+        env:
+        - name: SMALLSTEP_STATE_CACHE
+        type: path
+    state_cache_ttl:
+        description:
+            - Number of seconds a cached object is trusted before it is read from the API again.
+        default: 300
+        type: int
+"""
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+
+class ModuleDocFragment(object):
+    DOCUMENTATION = r"""
+options:
+    http2:
+        description:
+            - Negotiate HTTP/2 with the Smallstep API, so concurrent requests of a module run are multiplexed over one
+              connection.
+            - Requires the C(h2) Python package on the controller. Without it the module warns and uses HTTP/1.1.
+            - Independent of this option, all requests of a module run share one pool of connections and ask for
+              gzip compressed responses, or br when the C(brotli) package is installed.
+            - Connections, TLS handshakes and bytes on the wire are returned in C(smallstep_telemetry.transport).
+        env:
+        - name: SMALLSTEP_HTTP2
+        default: false
+        type: bool
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection, including the TLS handshake, to the Smallstep API.
+        env:
+        - name: SMALLSTEP_CONNECT_TIMEOUT
+        default: 10
+        type: float
+    read_timeout:
+        description:
+            - Seconds to wait for each chunk of a response, or to send a request, before the request fails.
+        env:
+        - name: SMALLSTEP_READ_TIMEOUT
+        default: 60
+        type: float
+    deadline:
+        description:
+            - Total number of seconds the module run may spend, measured from its start.
+            - Every API call checks it before it starts, including the reads that follow a write, and the timeouts
+              of the request are cut down to what is left. A call that would have to wait on I(rate_limit) past the
+              deadline fails right away instead of waiting.
+            - Once it has passed, the module fails without further requests and returns the calls made so far in
+              C(smallstep_telemetry). The M(smallstep.agent.instances) module reports the remaining instances as
+              failed instead.
+            - No deadline when unset.
+        env:
+        - name: SMALLSTEP_DEADLINE
+        type: float
+    hedge:
+        description:
+            - Hedge lookups of the Smallstep API. A C(GET) request that has not been answered after the
+              I(hedge_percentile) of recent lookup latencies is sent a second time on another pooled connection, and
+              the first answer is used.
+            - Latencies and the hedge budget are shared by every module process on the controller that talks to the
+              same I(api_host). Nothing is hedged until 20 latencies are known.
+            - Writes are never hedged, and neither are requests sent through the C(smallstep.agent.smallstep) httpapi
+              connection.
+            - Hedges sent and won are returned in C(smallstep_telemetry.transport).
+        env:
+        - name: SMALLSTEP_HEDGE
+        default: false
+        type: bool
+    hedge_percentile:
+        description:
+            - Percentile of recent lookup latencies after which a lookup is hedged.
+        env:
+        - name: SMALLSTEP_HEDGE_PERCENTILE
+        default: 95
+        type: float
+    hedge_max_ratio:
+        description:
+            - Largest share of lookups that may be hedged, which caps the extra load hedging puts on the API.
+        env:
+        - name: SMALLSTEP_HEDGE_MAX_RATIO
+        default: 0.05
+        type: float
+    coalesce:
+        description:
+            - Merge identical lookups that are in flight at the same time, the team lookup of the API token, into one
+              API call whose result is shared.
+            - Lookups that decide a write, such as the collection lookup of the collection module, are not merged.
+            - This holds between the threads of a module run and between the module processes of every fork on the
+              controller, through lock files next to the rate limiter's state.
+            - Lookups that were answered this way are counted as C(coalesced) in C(smallstep_telemetry.transport).
+        env:
+        - name: SMALLSTEP_COALESCE
+        default: true
+        type: bool
+"""
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+name: smallstep
+
+short_description: HttpApi plugin for the Smallstep API
+
+description:
+    - Sends the Smallstep API requests of the C(collection), C(workload), C(instance) and C(instances) modules
+      through the C(ansible.netcommon.httpapi) persistent connection.
+    - The connection keeps a pool of authenticated HTTP connections and the team and fingerprint of the API token
+      for as long as the persistent connection lives, instead of every module run starting from zero.
+    - The API host is the C(ansible_host) of the connection. The API token is read from I(token), or from the
+      connection password when I(token) is not set.
+
+author:
+    - Smallstep Engineering
+
+requirements:
+    - ansible.netcommon
+    - httpx
+
+options:
+    token:
+        description:
+            - The Smallstep API Token used when connecting.
+        type: str
+        env:
+        - name: SMALLSTEP_API_TOKEN
+        vars:
+        - name: ansible_httpapi_smallstep_token
+        - name: smallstep_api_token
+"""
+
+import json  # noqa: E402
+
+from ansible.module_utils.connection import ConnectionError  # noqa: E402
+from ansible.plugins.httpapi import HttpApiBase  # noqa: E402
+
+HAS_HTTPX = True
+
+try:
+    import httpx
+except ImportError:
+    HAS_HTTPX = False
+
+# Headers that describe one hop of the transfer rather than the response
+# body the module sees; the body is passed on decoded.
+HOP_HEADERS = frozenset(["connection", "content-encoding", "content-length", "keep-alive", "transfer-encoding"])
+
+
+class HttpApi(HttpApiBase):
+    def __init__(self, connection):
+        super().__init__(connection)
+        self._client = None
+        self._api_info = None
+
+    def _base_url(self):
+        scheme = "https" if self.connection.get_option("use_ssl") else "http"
+        host = self.connection.get_option("host")
+        port = self.connection.get_option("port")
+        return f"{scheme}://{host}:{port}" if port else f"{scheme}://{host}"
+
+    def client(self):
+        if not HAS_HTTPX:
+            raise ConnectionError("the smallstep httpapi plugin requires httpx")
+        if self._client is None:
+            token = self.get_option("token") or self.connection.get_option("password")
+            if not token:
+                raise ConnectionError("no Smallstep API token: set ansible_httpapi_smallstep_token or the password")
+            self._client = httpx.Client(
+                base_url=self._base_url(),
+                headers={"Authorization": f"Bearer {token}"},
+                verify=self.connection.get_option("validate_certs"),
+            )
+        return self._client
+
+    def logout(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def send_request(self, data, **message_kwargs):
+        """Send one API request over the pooled client
+
+        :param data: request body as text, or None
+        :param message_kwargs: ``path``, ``method``, ``headers`` and the httpx ``timeout`` dict of the request
+        :return: tuple of (status code, response headers, response body as text)
+        """
+        timeout = message_kwargs.get("timeout")
+        response = self.client().request(
+            message_kwargs.get("method", "GET"),
+            message_kwargs["path"],
+            content=data.encode() if data else None,
+            headers=message_kwargs.get("headers"),
+            timeout=httpx.Timeout(**timeout) if timeout else httpx.USE_CLIENT_DEFAULT,
+        )
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS}
+        return response.status_code, headers, response.text
+
+    def api_info(self):
+        """Team and authority fingerprint of the API token, looked up once per connection
+
+        :return: dict with ``team`` and ``fingerprint``
+        """
+        if self._api_info is None:
+            status_code, _headers, body = self.send_request(None, path="/api/authorities")
+            if status_code != 200:
+                raise ConnectionError(f"authority lookup failed: {body}", code=status_code)
+            agent_auth = next((item for item in json.loads(body) if item["domain"].startswith("agents.")), None)
+            if agent_auth is None:
+                raise ConnectionError("the API token's team has no agents authority")
+            self._api_info = {
+                "fingerprint": agent_auth.get("fingerprint"),
+                "team": agent_auth["domain"].split(".")[1],
+            }
+        return self._api_info
@@ -1,3 +1 @@
 from __future__ import annotations
-
-from .exceptions import StepAPIException, StepException  # noqa: F401
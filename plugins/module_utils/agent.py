@@ -1,13 +1,31 @@
 # Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
 # Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
 
+import hashlib
+import threading
 import traceback
 from collections.abc import Mapping
 
+import httpx
 from ansible.module_utils.basic import env_fallback, missing_required_lib
+from ansible.module_utils.connection import Connection, ConnectionError
 from smallstep.api import StepAuthority
+from smallstep.api_client.errors import UnexpectedStatus
+from smallstep.config import VERSION as SDK_VERSION
 from smallstep.exceptions import StepException  # noqa: E402
 
+from .concurrency import AdaptiveLimit
+from .deadline import Deadline, DeadlineExceeded
+from .hedging import HedgingPolicy
+from .manifest import Manifest
+from .ratelimit import RateLimiter, RateLimitTimeout
+from .sharding import Shard
+from .singleflight import SingleFlight
+from .state_cache import StateCache
+from .telemetry import Telemetry
+from .transport import ConnectionTransport, shared_client
+from .version import version
+
 HAS_SMALLSTEP_PYTHON = True
 
 try:
@@ -21,8 +39,64 @@ class AnsibleStep:
         self.module = module
         self.represent = represent
         self.result = {"changed": False, self.represent: None}
+        self._api_info = None
+        self.state_cache = None
+        self.manifest = None
+        self.telemetry = Telemetry()
+        self.rate_limiter = None
+        self.connection = None
+        self.http_client = None
+        self.deadline = Deadline(module.params.get("deadline"))
+        self.hedging = None
+        self.singleflight = None
+        # Modules that reconcile many items in worker threads report a timed
+        # out item as failed instead of failing the whole run from a thread.
+        self.fail_fast = True
+        self._http_client_lock = threading.Lock()
         if not HAS_SMALLSTEP_PYTHON:
             module.fail_json(msg=missing_required_lib("smallstep-python"))
+        # Tasks that run over the smallstep httpapi connection plugin get a
+        # socket to the persistent connection, which holds the API token.
+        if getattr(module, "_socket_path", None):
+            self.connection = Connection(module._socket_path)
+        elif not module.params.get("api_token"):
+            module.fail_json(msg="missing required arguments: api_token")
+        if module.params.get("state_cache"):
+            self.state_cache = StateCache(
+                module.params.get("state_cache"),
+                module.params.get("api_host"),
+                module.params.get("state_cache_ttl"),
+            )
+        if module.params.get("manifest"):
+            token = module.params.get("api_token") or ""
+            self.manifest = Manifest(
+                module.params.get("manifest"),
+                module.params.get("api_host"),
+                hashlib.sha256(token.encode()).hexdigest(),
+                module.params.get("manifest_sweep_interval"),
+            )
+        try:
+            # Modules without the sharding options, such as export, own every object
+            self.shard = Shard(module.params.get("shard_index", 0), module.params.get("shard_count", 1))
+        except ValueError as exception:
+            module.fail_json(msg=str(exception))
+        if module.params.get("hedge"):
+            self.hedging = HedgingPolicy(
+                module.params.get("api_host"),
+                module.params.get("hedge_percentile"),
+                module.params.get("hedge_max_ratio"),
+            )
+        if module.params.get("coalesce"):
+            token = module.params.get("api_token") or ""
+            self.singleflight = SingleFlight(
+                f"{module.params.get('api_host')}/{hashlib.sha256(token.encode()).hexdigest()}", self.telemetry
+            )
+        if module.params.get("rate_limit"):
+            self.rate_limiter = RateLimiter(
+                module.params.get("api_host"),
+                module.params.get("rate_limit"),
+                module.params.get("rate_limit_burst"),
+            )
 
     def fail_json(self, exception, msg=None, params=None, **kwargs):
         last_traceback = traceback.format_exc()
@@ -43,7 +117,216 @@ class AnsibleStep:
         else:
             msg = exception_message
 
-        self.module.fail_json(msg=msg, exception=last_traceback, failure=failure, **kwargs)
+        if self.deadline.budget is not None:
+            kwargs["deadline"] = self.deadline.as_dict()
+        if self.hedging is not None:
+            self.hedging.flush()
+
+        self.module.fail_json(
+            msg=msg,
+            exception=last_traceback,
+            failure=failure,
+            smallstep_telemetry=self.telemetry.as_dict(),
+            **kwargs,
+        )
+
+    def _call(self, operation, func, *args, **kwargs):
+        """Call an SDK method, recording it in the module telemetry
+
+        The call is not started once the deadline has passed, or when the rate
+        limiter would only hand out its token after the deadline. A timeout
+        fails the module with the calls made so far, unless ``fail_fast`` is
+        off.
+
+        :return: the SDK method's return value
+        :raise DeadlineExceeded: without ``fail_fast``, when the deadline has passed
+        :raise httpx.TimeoutException: without ``fail_fast``, when the request timed out
+        """
+        try:
+            self.deadline.check(operation)
+            if self.rate_limiter is not None:
+                try:
+                    self.telemetry.rate_limit_wait += self.rate_limiter.acquire(self.deadline.remaining())
+                except RateLimitTimeout as exception:
+                    raise DeadlineExceeded(
+                        f"deadline of {self.deadline.budget}s exceeded waiting on the rate limit before {operation}"
+                    ) from exception
+                self.deadline.check(operation)
+            return self.telemetry.call(operation, func, *args, **kwargs)
+        except httpx.TimeoutException as exception:
+            # A timeout that was cut down to the end of the budget
+            if self.deadline.expired():
+                exceeded = DeadlineExceeded(f"deadline of {self.deadline.budget}s exceeded during {operation}")
+                if not self.fail_fast:
+                    raise exceeded from exception
+                self.fail_json(exceeded)
+            if not self.fail_fast:
+                raise
+            self.fail_json(exception, msg=f"{operation} timed out")
+        except DeadlineExceeded as exception:
+            if not self.fail_fast:
+                raise
+            self.fail_json(exception)
+
+    def _read(self, operation, key, func, *args, **kwargs):
+        """Call an SDK lookup through ``_call``, sharing one call between identical lookups in flight
+
+        ``key`` tells lookups of ``operation`` apart, such as the collection
+        slug. Only use it for lookups that many module runs make at once, and
+        never for one that decides a write: a waiting caller takes the
+        leader's answer, which a write of another fork may have made stale.
+
+        :return: the result in its ``to_dict()`` form, or a list of those
+        """
+
+        def read():
+            res = self._call(operation, func, *args, **kwargs)
+            if isinstance(res, list):
+                return [item.to_dict() for item in res]
+            return res.to_dict()
+
+        if self.singleflight is None:
+            return read()
+        return self.singleflight.do(f"{operation}/{key}", read)
+
+    def adaptive_limit(self, ceiling):
+        """In-flight limit for a bulk run, fed by every API call of the module run
+
+        :return: an ``AdaptiveLimit`` up to ``ceiling``, or None when ``adaptive_concurrency`` is off
+        """
+        if not self.module.params.get("adaptive_concurrency"):
+            return None
+        limit = AdaptiveLimit(ceiling)
+        self.telemetry.observer = limit.observe
+        return limit
+
+    def _pages(self, operation, sdk, endpoint, pagination, page_size=100, **kwargs):
+        """Iterate over the items of a paginated list endpoint, one page request at a time
+
+        ``endpoint`` is a generated SDK endpoint module, such as
+        ``list_collections``, and ``pagination`` its pagination model. Pages are
+        followed through the ``X-Next-Cursor`` header, which the SDK's own list
+        methods drop after the first page.
+
+        :raise StepException: when a page request fails
+        """
+
+        def fetch(cursor):
+            page = pagination(first=page_size) if cursor is None else pagination(first=page_size, after=cursor)
+            try:
+                res = endpoint.sync_detailed(client=sdk.client, pagination=page, **kwargs)
+            except UnexpectedStatus as e:
+                raise StepException(status_code=e.status_code, message=e.content, headers=None)
+            if res.status_code >= 400:
+                raise StepException(
+                    status_code=res.status_code,
+                    message=res.content.decode("utf-8").strip(),
+                    headers=res.headers,
+                )
+            return res
+
+        cursor = None
+        while True:
+            res = self._call(operation, fetch, cursor)
+            yield from res.parsed
+            cursor = res.headers.get("X-Next-Cursor")
+            if not cursor:
+                return
+
+    def _sdk(self, sdk_class):
+        """Instantiate an SDK class for the API this module talks to
+
+        All SDK objects of a run share one HTTP client, so connections are
+        reused between calls. Over a persistent connection, requests are handed
+        to the connection instead of opening HTTP connections from this process.
+        """
+        # The SDK insists on a token even though the connection adds its own.
+        sdk = sdk_class(
+            smallstep_api_host=self.connectargs["smallstep_api_host"],
+            smallstep_api_token=self.connectargs["smallstep_api_token"] or "httpapi",
+        )
+        with self._http_client_lock:
+            if self.http_client is None:
+                self.http_client = self._shared_client()
+        sdk.client.set_httpx_client(self.http_client)
+        return sdk
+
+    def _shared_client(self):
+        headers = {
+            "User-Agent": f"smallstep-ansible/{version} smallstep-python/{SDK_VERSION}",
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+        transport = None
+        if self.connection is None:
+            headers["Authorization"] = f"Bearer {self.connectargs['smallstep_api_token']}"
+        else:
+            transport = ConnectionTransport(self.connection)
+        timeout = httpx.Timeout(
+            self.module.params.get("read_timeout"),
+            connect=self.module.params.get("connect_timeout"),
+        )
+        try:
+            return shared_client(
+                self.connectargs["smallstep_api_host"],
+                headers,
+                self.telemetry,
+                http2=bool(self.module.params.get("http2")) and transport is None,
+                transport=transport,
+                timeout=timeout,
+                deadline=self.deadline,
+                hedging=self.hedging,
+            )
+        except ImportError:
+            self.module.warn("http2 requires the h2 package, falling back to HTTP/1.1")
+            return shared_client(
+                self.connectargs["smallstep_api_host"],
+                headers,
+                self.telemetry,
+                timeout=timeout,
+                deadline=self.deadline,
+                hedging=self.hedging,
+            )
+
+    def foreign(self, key):
+        """Whether another shard owns the object keyed ``key``
+
+        With more than one shard the ownership is returned in ``shard``.
+        """
+        if self.shard.count > 1:
+            self.result["shard"] = self.shard.as_dict(key)
+        return not self.shard.owns(key)
+
+    def desired(self, params=None):
+        """The desired item of this run: the module parameters without the connection options"""
+        base = self.base_module_args()
+        params = self.module.params if params is None else params
+        return {k: v for k, v in params.items() if k not in base}
+
+    def replay(self, object_type, object_key):
+        """Replay the last applied result if the desired item has not changed since
+
+        :return: True when the result was taken from the manifest
+        """
+        if self.manifest is None:
+            return False
+        entry = self.manifest.get(object_type, object_key, self.desired())
+        if entry is None:
+            return False
+        setattr(self, self.represent, entry["response"])
+        self._api_info = entry["api_info"]
+        return True
+
+    def record(self, object_type, object_key):
+        """Record the applied desired item and its result in the manifest"""
+        if self.manifest is None or self.module.check_mode:
+            return
+        self.manifest.put(
+            object_type,
+            object_key,
+            self.desired(),
+            {"response": getattr(self, self.represent), "api_info": self._api_info},
+        )
 
     def _mark_changed(self):
         self.result["changed"] = True
@@ -59,39 +342,149 @@ class AnsibleStep:
         return {
             "api_token": {
                 "type": "str",
-                "required": True,
-                "fallback": (env_fallback, ["SMALLSTEP_API_HOST"]),
+                "fallback": (env_fallback, ["SMALLSTEP_API_TOKEN"]),
                 "no_log": True,
             },
-            "api_host": {"type": "str", "default": "gateway.smallstep.com"},
+            "api_host": {
+                "type": "str",
+                "default": "gateway.smallstep.com",
+                "fallback": (env_fallback, ["SMALLSTEP_API_HOST"]),
+            },
+            "state_cache": {
+                "type": "path",
+                "fallback": (env_fallback, ["SMALLSTEP_STATE_CACHE"]),
+            },
+            "state_cache_ttl": {"type": "int", "default": 300},
+            "rate_limit": {
+                "type": "float",
+                "fallback": (env_fallback, ["SMALLSTEP_RATE_LIMIT"]),
+            },
+            "rate_limit_burst": {
+                "type": "int",
+                "default": 10,
+                "fallback": (env_fallback, ["SMALLSTEP_RATE_LIMIT_BURST"]),
+            },
+            "http2": {
+                "type": "bool",
+                "default": False,
+                "fallback": (env_fallback, ["SMALLSTEP_HTTP2"]),
+            },
+            "connect_timeout": {
+                "type": "float",
+                "default": 10,
+                "fallback": (env_fallback, ["SMALLSTEP_CONNECT_TIMEOUT"]),
+            },
+            "read_timeout": {
+                "type": "float",
+                "default": 60,
+                "fallback": (env_fallback, ["SMALLSTEP_READ_TIMEOUT"]),
+            },
+            "deadline": {
+                "type": "float",
+                "fallback": (env_fallback, ["SMALLSTEP_DEADLINE"]),
+            },
+            "hedge": {
+                "type": "bool",
+                "default": False,
+                "fallback": (env_fallback, ["SMALLSTEP_HEDGE"]),
+            },
+            "hedge_percentile": {
+                "type": "float",
+                "default": 95,
+                "fallback": (env_fallback, ["SMALLSTEP_HEDGE_PERCENTILE"]),
+            },
+            "hedge_max_ratio": {
+                "type": "float",
+                "default": 0.05,
+                "fallback": (env_fallback, ["SMALLSTEP_HEDGE_MAX_RATIO"]),
+            },
+            "manifest": {
+                "type": "path",
+                "fallback": (env_fallback, ["SMALLSTEP_MANIFEST"]),
+            },
+            "manifest_sweep_interval": {
+                "type": "int",
+                "default": 86400,
+                "fallback": (env_fallback, ["SMALLSTEP_MANIFEST_SWEEP_INTERVAL"]),
+            },
+            "shard_index": {
+                "type": "int",
+                "default": 0,
+                "fallback": (env_fallback, ["SMALLSTEP_SHARD_INDEX"]),
+            },
+            "shard_count": {
+                "type": "int",
+                "default": 1,
+                "fallback": (env_fallback, ["SMALLSTEP_SHARD_COUNT"]),
+            },
+            "coalesce": {
+                "type": "bool",
+                "default": True,
+                "fallback": (env_fallback, ["SMALLSTEP_COALESCE"]),
+            },
         }
 
-    @classmethod
     def api_info(self, connectargs):
-        self.api_info = {}
-        try:
-            authority = StepAuthority(**connectargs)
-            auths = authority.get_all()
+        if self._api_info is not None:
+            return self._api_info
 
-            auths_list = []
+        # The persistent connection looks the team up once for all tasks.
+        if self.connection is not None:
+            try:
+                self._api_info = self.connection.api_info()
+            except ConnectionError as exception:
+                self.fail_json(exception)
+            return self._api_info
 
-            for item in auths:
-                auths_list.append(item.to_dict())
+        # The authority lookup only depends on the token, so it is cached per
+        # token rather than per team.
+        token_key = hashlib.sha256(connectargs["smallstep_api_token"].encode()).hexdigest()
+        if self.state_cache is not None:
+            self._api_info = self.state_cache.get("", "api_info", token_key)
+            if self._api_info is not None:
+                return self._api_info
+
+        api_info = {}
+        try:
+            authority = self._sdk(StepAuthority)
+            auths_list = self._read("authority.list", "", authority.get_all)
 
             agent_auth = next(
                 (item for item in auths_list if item["domain"].startswith("agents.")),
                 None,
             )
-            self.api_info["fingerprint"] = agent_auth["fingerprint"]
-            self.api_info["team"] = agent_auth["domain"].split(".")[1]
+            api_info["fingerprint"] = agent_auth["fingerprint"]
+            api_info["team"] = agent_auth["domain"].split(".")[1]
 
         except StepException as exception:
-            self.fail_json(
-                status_code=exception.status_code,
-                headers=exception.headers,
-                message=exception.message,
-            )
-        return self.api_info
+            self.fail_json(exception)
+
+        if self.state_cache is not None:
+            self.state_cache.put("", "api_info", token_key, api_info)
+        self._api_info = api_info
+        return self._api_info
+
+    def _cache_get(self, object_type, object_key):
+        """Look up an object in the state cache, if one is configured
+
+        :return: dict or None
+        """
+        if self.state_cache is None:
+            return None
+        team = self.api_info(connectargs=self.connectargs)["team"]
+        return self.state_cache.get(team, object_type, object_key)
+
+    def _cache_put(self, object_type, object_key, representation):
+        if self.state_cache is None:
+            return
+        team = self.api_info(connectargs=self.connectargs)["team"]
+        self.state_cache.put(team, object_type, object_key, representation)
+
+    def _cache_invalidate(self, object_type, object_key):
+        if self.state_cache is None:
+            return
+        team = self.api_info(connectargs=self.connectargs)["team"]
+        self.state_cache.invalidate(team, object_type, object_key)
 
     def _prep_result(self):
         """Prep the result for all modules
@@ -103,4 +496,13 @@ class AnsibleStep:
     def get_result(self):
         if getattr(self, self.represent) is not None:
             self.result[self.represent] = self._prep_result()
+        if self.state_cache is not None:
+            self.result["state_cache"] = self.state_cache.stats()
+        if self.manifest is not None:
+            self.result["manifest"] = self.manifest.stats()
+        if self.deadline.budget is not None:
+            self.result["deadline"] = self.deadline.as_dict()
+        if self.hedging is not None:
+            self.hedging.flush()
+        self.result["smallstep_telemetry"] = self.telemetry.as_dict()
         return self.result
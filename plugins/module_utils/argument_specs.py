@@ -0,0 +1,217 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+# Argument specs of the object modules. They live here rather than in the
+# modules so that other modules, such as preflight, can validate desired state
+# against exactly the same specs.
+
+
+def collection_argument_spec():
+    return dict(
+        collection_slug=dict(type="str", required=True),
+        display_name=dict(type="str"),
+        admin_emails=dict(type="list"),
+        device_type=dict(
+            type="dict",
+            required_one_of=[("aws_vm", "azure_vm", "gcp_vm", "tpm")],
+            mutually_exclusive=[("aws_vm", "azure_vm", "gcp_vm", "tpm")],
+            options=dict(
+                aws_vm=dict(
+                    type="dict",
+                    options=dict(
+                        accounts=dict(type="list", elements="str", required=True),
+                        disable_custom_sans=dict(type="bool"),
+                    ),
+                ),
+                azure_vm=dict(
+                    type="dict",
+                    options=dict(
+                        resource_groups=dict(type="list", elements="str", required=True),
+                        tenant_id=dict(type="str", required=True),
+                        disable_custom_sans=dict(type="bool"),
+                    ),
+                ),
+                gcp_vm=dict(
+                    type="dict",
+                    options=dict(
+                        project_ids=dict(type="list", elements="str", required=True),
+                        service_accounts=dict(type="list", elements="str", required=True),
+                        disable_custom_sans=dict(type="bool"),
+                    ),
+                ),
+                tpm=dict(
+                    type="dict",
+                    options=dict(
+                        attestor_intermediates=dict(type="str"),
+                        attestor_roots=dict(type="str"),
+                        force_cn=dict(type="bool"),
+                        require_eab=dict(type="bool"),
+                    ),
+                ),
+            ),
+        ),
+        state=dict(type="str", default="present", choices=["absent", "present"]),
+    )
+
+
+COLLECTION_REQUIRED_IF = [
+    [
+        "state",
+        "present",
+        [
+            "admin_emails",
+            "device_type",
+            "display_name",
+            "collection_slug",
+        ],
+    ],
+    ["state", "absent", ["collection_slug"]],
+]
+
+
+def workload_argument_spec():
+    return dict(
+        admin_emails=dict(type="list", elements="str", required=True),
+        certificate_info=dict(
+            type="dict",
+            options=dict(
+                crt_file=dict(type="str"),
+                duration=dict(type="str"),
+                gid=dict(type="int"),
+                key_file=dict(type="str"),
+                mode=dict(type="int"),
+                root_file=dict(type="str"),
+                type=dict(
+                    type="str",
+                    required=True,
+                    choices=["X509", "SSH_USER", "SSH_HOST"],
+                ),
+                uid=dict(type="int"),
+            ),
+        ),
+        collection_slug=dict(type="str", required=True),
+        device_metadata_key_sans=dict(type="list", elements="str"),
+        display_name=dict(type="str", required=True),
+        hooks=dict(
+            type="dict",
+            options=dict(renew=dict(type="dict"), sign=dict(type="dict")),
+        ),
+        key_info=dict(
+            type="dict",
+            options=dict(
+                format=dict(
+                    type="str",
+                    choices=[
+                        "DEFAULT",
+                        "PKCS8",
+                        "OPENSSH",
+                        "DER",
+                    ],
+                ),
+                pub_file=dict(type="str"),
+                type=dict(
+                    type="str",
+                    required=True,
+                    choices=[
+                        "DEFAULT",
+                        "ECDSA_P256",
+                        "ECDSA_P384",
+                        "ECDSA_P521",
+                        "RSA_2048",
+                        "RSA_3072",
+                        "RSA_4096",
+                        "ED25519",
+                    ],
+                ),
+            ),
+        ),
+        reload_info=dict(
+            type="dict",
+            required_if=[
+                ("method", "DBUS", ("unit_name",)),
+                ("method", "SIGNAL", ("pid_file", "signal")),
+            ],
+            mutually_exclusive=[
+                ("unit_name", "pid_file"),
+                ("unit_name", "signal"),
+            ],
+            options=dict(
+                method=dict(
+                    type="str",
+                    required=True,
+                    choices=[
+                        "AUTOMATIC",
+                        "CUSTOM",
+                        "SIGNAL",
+                        "DBUS",
+                    ],
+                ),
+                pid_file=dict(type="str"),
+                signal=dict(type="int"),
+                unit_name=dict(type="str"),
+            ),
+        ),
+        static_sans=dict(type="list", elements="str"),
+        workload_slug=dict(type="str", required=True),
+        workload_type=dict(
+            type="str",
+            required=True,
+            choices=[
+                "etcd",
+                "generic",
+                "git",
+                "grafana",
+                "haproxy",
+                "httpd",
+                "kafka",
+                "mysql",
+                "nginx",
+                "nodejs",
+                "openvpn",
+                "postgres",
+                "redis",
+                "tomcat",
+                "zookeeper",
+            ],
+        ),
+        state=dict(type="str", default="present", choices=["absent", "present"]),
+    )
+
+
+WORKLOAD_REQUIRED_IF = [
+    [
+        "state",
+        "present",
+        [
+            "admin_emails",
+            "collection_slug",
+            "display_name",
+            "workload_slug",
+            "workload_type",
+        ],
+    ],
+    ["state", "absent", ["workload_slug"]],
+]
+
+
+def instance_argument_spec():
+    return dict(
+        collection_slug=dict(type="str", required=True),
+        instance_id=dict(type="str", required=True),
+        instance_metadata=dict(type="dict", default={}),
+        state=dict(type="str", default="present", choices=["absent", "present"]),
+    )
+
+
+INSTANCE_REQUIRED_IF = [
+    [
+        "state",
+        "present",
+        [
+            "instance_id",
+            "instance_metadata",
+            "collection_slug",
+        ],
+    ],
+    ["state", "absent", ["collection_slug", "instance_id"]],
+]
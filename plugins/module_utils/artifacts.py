@@ -0,0 +1,162 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from ansible.module_utils.urls import open_url
+
+CHUNK_SIZE = 1 << 16
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class VerificationError(ArtifactError):
+    pass
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_checksums(text):
+    """Map file names to SHA-256 digests from a ``sha256sum`` style checksums file"""
+    checksums = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and len(parts[0]) == 64:
+            checksums[parts[1].lstrip("*")] = parts[0].lower()
+    return checksums
+
+
+class ArtifactCache:
+    """Controller-side cache of downloaded, verified release artifacts
+
+    A release's checksums file is verified once, by its cosign signature
+    unless ``verifier`` is ``checksum``. The verdict is recorded next to it
+    together with the file's digest. Artifacts are stored under their
+    SHA-256 digest and are only accepted when they match the verified
+    checksums file. Later runs that find both on disk download and verify
+    nothing.
+
+    Layout below ``path``::
+
+        checksums/<sha256 of the checksums URL>/checksums.txt{,.sig,.pem}
+        checksums/<sha256 of the checksums URL>/verified.json
+        sha256/<artifact digest>/<artifact file name>
+    """
+
+    def __init__(self, module, path, verifier, identity_regexp=None, oidc_issuer=None):
+        self.module = module
+        self.path = os.path.expanduser(path)
+        self.verifier = verifier
+        self.identity_regexp = identity_regexp
+        self.oidc_issuer = oidc_issuer
+        self.downloads = []
+
+    def _download(self, url, dest):
+        """Download ``url`` to ``dest`` through a temporary file in the same directory"""
+        directory = os.path.dirname(dest)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".download")
+        try:
+            response = open_url(url, validate_certs=self.module.params.get("validate_certs"))
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(response, f, CHUNK_SIZE)
+            os.replace(tmp, dest)
+        except Exception as e:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise ArtifactError(f"Could not download {url}: {e}") from e
+        self.downloads.append(url)
+        return dest
+
+    def _verify_signature(self, checksums, signature, certificate):
+        if self.verifier == "checksum":
+            return
+        cosign = self.module.get_bin_path("cosign", required=True)
+        rc, _out, err = self.module.run_command(
+            [
+                cosign,
+                "verify-blob",
+                "--signature",
+                signature,
+                "--certificate",
+                certificate,
+                "--certificate-identity-regexp",
+                self.identity_regexp,
+                "--certificate-oidc-issuer",
+                self.oidc_issuer,
+                checksums,
+            ]
+        )
+        if rc != 0:
+            raise VerificationError(f"cosign could not verify {checksums}: {err.strip()}")
+
+    def checksums(self, checksums_url, signature_url=None, certificate_url=None):
+        """Verified checksums of a release, downloading and verifying them only once
+
+        :return: tuple of (dict of file name to digest, whether the cache answered)
+        """
+        directory = os.path.join(self.path, "checksums", hashlib.sha256(checksums_url.encode()).hexdigest())
+        checksums = os.path.join(directory, "checksums.txt")
+        verdict = os.path.join(directory, "verified.json")
+
+        try:
+            with open(verdict) as f:
+                recorded = json.load(f)
+            if recorded.get("verifier") == self.verifier and recorded.get("sha256") == sha256_file(checksums):
+                with open(checksums) as f:
+                    return parse_checksums(f.read()), True
+        except (OSError, ValueError):
+            pass
+
+        self._download(checksums_url, checksums)
+        signature = certificate = None
+        if self.verifier != "checksum":
+            signature = self._download(signature_url or f"{checksums_url}.sig", f"{checksums}.sig")
+            certificate = self._download(certificate_url or f"{checksums_url}.pem", f"{checksums}.pem")
+        self._verify_signature(checksums, signature, certificate)
+
+        record = {
+            "url": checksums_url,
+            "sha256": sha256_file(checksums),
+            "verifier": self.verifier,
+            "verified_at": int(time.time()),
+        }
+        with open(verdict, "w") as f:
+            json.dump(record, f)
+        with open(checksums) as f:
+            return parse_checksums(f.read()), False
+
+    def artifact(self, url, checksums):
+        """Path of the verified artifact behind ``url``, downloading it only when it is not cached
+
+        :return: tuple of (path, digest, whether the cache answered)
+        """
+        filename = os.path.basename(urlsplit(url).path)
+        digest = checksums.get(filename)
+        if digest is None:
+            raise VerificationError(f"{filename} is not listed in the checksums file")
+
+        path = os.path.join(self.path, "sha256", digest, filename)
+        if os.path.exists(path) and sha256_file(path) == digest:
+            return path, digest, True
+
+        self._download(url, path)
+        actual = sha256_file(path)
+        if actual != digest:
+            os.unlink(path)
+            raise VerificationError(f"{filename} has SHA-256 {actual}, expected {digest}")
+        return path, digest, False
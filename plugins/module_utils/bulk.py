@@ -0,0 +1,65 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from smallstep.exceptions import StepException
+
+
+class BulkRunner:
+    """Reconcile many independent items concurrently within one module run
+
+    ``func`` is called once per item from a pool of ``max_workers`` threads
+    and must return a dict describing the outcome. A failing item does not stop
+    the others: its outcome carries ``failed``, ``msg`` and, for API errors, the
+    ``status_code`` instead, merged into what ``describe`` returns for the item.
+
+    With a ``checkpoint``, items that succeed are journaled under ``key(item)``
+    as they complete, and items that a resumed run finds in the journal are
+    not applied again. Like the replays of a manifest, their outcome is
+    unchanged, with ``resumed`` set.
+
+    With a ``limit``, an ``AdaptiveLimit`` whose ceiling is ``max_workers``,
+    only as many items as it currently allows are applied at once.
+    """
+
+    def __init__(self, max_workers, checkpoint=None, key=None, limit=None):
+        self.max_workers = max(int(max_workers), 1)
+        self.checkpoint = checkpoint
+        self.key = key
+        self.limit = limit
+
+    def _limited(self, func, item):
+        if self.limit is None:
+            return func(item)
+        self.limit.acquire()
+        try:
+            return func(item)
+        finally:
+            self.limit.release()
+
+    def _apply(self, func, describe, item):
+        if self.checkpoint is not None:
+            outcome = self.checkpoint.get(self.key(item), item)
+            if outcome is not None:
+                return dict(outcome, changed=False, action="unchanged", resumed=True)
+        try:
+            outcome = self._limited(func, item)
+        except StepException as exception:
+            failure = {"failed": True, "msg": str(exception.message), "status_code": exception.status_code}
+        except Exception as exception:
+            failure = {"failed": True, "msg": str(exception), "exception": traceback.format_exc()}
+        else:
+            if self.checkpoint is not None:
+                self.checkpoint.put(self.key(item), item, outcome)
+            return outcome
+        return dict(describe(item), **failure)
+
+    def run(self, items, func, describe):
+        """Apply ``func`` to every item
+
+        :return: list of outcomes, in the order of ``items``
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda item: self._apply(func, describe, item), items))
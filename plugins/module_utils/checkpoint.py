@@ -0,0 +1,95 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import json
+import os
+import threading
+
+from .manifest import desired_hash
+
+
+class Checkpoint:
+    """Append-only journal of the items a bulk run has completed
+
+    Every item that succeeds is appended as one JSON line holding its key, the
+    hash of its desired state and its outcome, as soon as it completes. When a
+    run dies part way, a run with ``resume`` replays the outcome of every
+    journaled item whose desired state is unchanged, and only works on the
+    rest. Failed items are never journaled, so they are retried. The first
+    line scopes the journal to one API host and token. A journal of another
+    scope, or a run without ``resume``, starts over. ``complete()`` removes
+    the journal once a run has no failures left.
+    """
+
+    def __init__(self, path, api_host, scope, resume):
+        self.path = os.path.expanduser(path)
+        self.header = {"api_host": api_host, "scope": scope}
+        self.entries = {}
+        self.resumed = 0
+        self.recorded = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if resume and self._load():
+            self.journal = open(self.path, "a")
+        else:
+            self.entries = {}
+            self.journal = open(self.path, "w")
+            self._write(self.header)
+
+    def _load(self):
+        """Read the journal of an earlier run
+
+        :return: False when there is none for this scope
+        """
+        try:
+            with open(self.path) as f:
+                lines = iter(f)
+                try:
+                    if json.loads(next(lines)) != self.header:
+                        return False
+                except (StopIteration, ValueError):
+                    return False
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a run that was killed while writing it
+                        continue
+                    self.entries[entry["key"]] = entry
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _write(self, record):
+        # One line per write, flushed so that it survives the process being killed
+        self.journal.write(json.dumps(record, sort_keys=True, default=str) + "\n")
+        self.journal.flush()
+
+    def get(self, key, desired):
+        """Outcome of ``key`` if it completed with the same desired state, or None"""
+        entry = self.entries.get(key)
+        if entry is None or entry["hash"] != desired_hash(desired):
+            return None
+        with self.lock:
+            self.resumed += 1
+        return entry["outcome"]
+
+    def put(self, key, desired, outcome):
+        with self.lock:
+            self._write({"key": key, "hash": desired_hash(desired), "outcome": outcome})
+            self.recorded += 1
+
+    def complete(self):
+        """Remove the journal of a run that finished without failures"""
+        self.journal.close()
+        os.remove(self.path)
+
+    def stats(self):
+        return {"path": self.path, "resumed": self.resumed, "recorded": self.recorded}
+
+    def close(self):
+        self.journal.close()
@@ -0,0 +1,90 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import threading
+
+# Responses that mean the API is shedding load
+OVERLOAD_STATUS_CODES = frozenset([429, 502, 503, 504])
+
+
+class AdaptiveLimit:
+    """In-flight limit of a bulk run that follows what the API can take
+
+    The limit starts at ``initial`` and doubles every round of successful
+    calls until the first sign of congestion, then grows by one per round
+    (additive increase). A call answered with an overload status, or that
+    failed without a response, halves it (multiplicative decrease). A call
+    whose operation is taking ``tolerance`` times its lowest recent latency
+    cuts it by a tenth instead, before the API starts rejecting calls. After a
+    decrease, the next one waits for a round of ``limit`` calls to finish, so
+    the calls that were already in flight count as one congestion signal.
+    The limit never goes below one or above ``ceiling``.
+    """
+
+    BACKOFF = 0.5
+    LATENCY_BACKOFF = 0.9
+
+    def __init__(self, ceiling, initial=2, tolerance=2.0):
+        self.ceiling = max(int(ceiling), 1)
+        self.limit = float(min(initial, self.ceiling))
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.peak = 0
+        self.decreases = 0
+        self.slow_start = True
+        # Per operation, as lookups and writes take very different times
+        self.baseline = {}
+        self.smoothed = {}
+        self._since_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _decrease(self, factor):
+        if self.limit <= 1.0 or (self.decreases and self._since_decrease < self.limit):
+            return
+        self._since_decrease = 0
+        self.slow_start = False
+        self.decreases += 1
+        self.limit = max(self.limit * factor, 1.0)
+
+    def observe(self, call):
+        """Adjust the limit to one finished API call, a ``Telemetry`` call record"""
+        operation, latency = call["operation"], call["duration"]
+        with self._condition:
+            self._since_decrease += 1
+            if call.get("status_code") in OVERLOAD_STATUS_CODES or call.get("error"):
+                self._decrease(self.BACKOFF)
+                return
+
+            baseline = self.baseline.get(operation, latency)
+            smoothed = self.smoothed.get(operation, latency)
+            # The baseline drifts up slowly, so that one lucky call does not pin it
+            baseline = self.baseline[operation] = min(latency, baseline + (latency - baseline) * 0.01)
+            smoothed = self.smoothed[operation] = smoothed + (latency - smoothed) * 0.2
+
+            if smoothed > baseline * self.tolerance:
+                self._decrease(self.LATENCY_BACKOFF)
+            elif self.slow_start:
+                self.limit = min(self.limit + 1.0, self.ceiling)
+            else:
+                self.limit = min(self.limit + 1.0 / self.limit, self.ceiling)
+            self._condition.notify_all()
+
+    def as_dict(self):
+        return {
+            "ceiling": self.ceiling,
+            "limit": int(self.limit),
+            "peak": self.peak,
+            "decreases": self.decreases,
+        }
@@ -0,0 +1,55 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """Total time budget of a module run
+
+    Every API call checks the budget before it starts, and the timeouts of its
+    HTTP request are cut down to what is left of it. Once the budget is used
+    up, further calls fail immediately instead of starting.
+    ``budget=None`` never expires.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.start = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        """Seconds left, or None without a budget"""
+        if self.budget is None:
+            return None
+        return self.budget - self.elapsed()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self, operation):
+        """:raise DeadlineExceeded: when the budget is used up before ``operation``"""
+        if self.expired():
+            raise DeadlineExceeded(f"deadline of {self.budget}s exceeded before {operation}")
+
+    def clip(self, timeout):
+        """Cut the httpx timeout dict of a request down to the remaining budget
+
+        :raise DeadlineExceeded: when the budget is already used up
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(f"deadline of {self.budget}s exceeded")
+        return {k: remaining if v is None else min(v, remaining) for k, v in (timeout or {}).items()}
+
+    def as_dict(self):
+        return {"budget": self.budget, "elapsed": round(self.elapsed(), 6)}
@@ -0,0 +1,162 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+import httpx
+
+from .shared_state import LockedState, state_path
+
+# Methods that are safe to send twice
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD"])
+
+
+class HedgingPolicy:
+    """When to hedge a read, shared by every module process talking to one API host
+
+    The latencies of recent reads and the hedge budget live in a lock-protected
+    file on the controller, like the rate limiter's bucket. A read is hedged
+    once it has been outstanding for the ``percentile`` of the recent
+    latencies. Every read adds ``max_ratio`` to the budget and every hedge
+    takes one from it, so hedges stay below that share of the reads over
+    time. No read is hedged before ``min_samples`` latencies are known.
+    """
+
+    WINDOW = 256
+    MAX_CREDITS = 10.0
+
+    def __init__(self, api_host, percentile, max_ratio, min_samples=20):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.path = state_path("hedging", api_host)
+        self.latencies = []
+        self._uncredited = 0
+        self._delay = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Seconds after which a read is hedged, or None while too few latencies are known"""
+        with self._lock:
+            if not self._loaded:
+                with LockedState(self.path) as state:
+                    window = sorted(state.get("latencies", []))
+                if len(window) >= self.min_samples:
+                    index = min(int(len(window) * self.percentile / 100.0), len(window) - 1)
+                    self._delay = window[index]
+                self._loaded = True
+            return self._delay
+
+    def _earn(self, state):
+        # Credit the reads of this run that have not been credited yet
+        with self._lock:
+            reads, self._uncredited = self._uncredited, 0
+        credits = state.get("credits", 1.0) + self.max_ratio * reads
+        state["credits"] = min(credits, self.MAX_CREDITS)
+
+    def acquire(self):
+        """Take one hedge from the budget
+
+        :return: False when the budget is used up
+        """
+        with LockedState(self.path) as state:
+            self._earn(state)
+            if state["credits"] < 1.0:
+                return False
+            state["credits"] -= 1.0
+        return True
+
+    def record(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            self._uncredited += 1
+
+    def flush(self):
+        """Add the latencies of this run to the shared window"""
+        with self._lock:
+            latencies, self.latencies = self.latencies, []
+        if not latencies:
+            return
+        with LockedState(self.path) as state:
+            self._earn(state)
+            state["latencies"] = (state.get("latencies", []) + latencies)[-self.WINDOW :]
+
+
+class HedgingTransport(httpx.BaseTransport):
+    """httpx transport that sends a second copy of a slow read and takes whichever answers first
+
+    Both copies go through the same connection pool of ``transport``, so the
+    hedge is sent on another pooled connection, or as another stream with
+    HTTP/2. The response that loses is closed once it arrives. Hedges issued
+    and won are counted in ``telemetry.transport``.
+    """
+
+    def __init__(self, transport, policy, telemetry):
+        self.transport = transport
+        self.policy = policy
+        self.telemetry = telemetry
+
+    def _spawn(self, request):
+        # Daemon threads, so that a hung loser never holds up the module exit
+        future = Future()
+
+        def send():
+            try:
+                future.set_result(self.transport.handle_request(request))
+            except BaseException as exception:
+                future.set_exception(exception)
+
+        threading.Thread(target=send, daemon=True).start()
+        return future
+
+    @staticmethod
+    def _discard(future):
+        if future.exception() is None:
+            future.result().close()
+
+    def handle_request(self, request):
+        if request.method not in IDEMPOTENT_METHODS:
+            return self.transport.handle_request(request)
+
+        start = time.monotonic()
+        delay = self.policy.delay()
+        if delay is None:
+            response = self.transport.handle_request(request)
+            self.policy.record(time.monotonic() - start)
+            return response
+
+        primary = self._spawn(request)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.policy.acquire():
+            response = primary.result()
+            self.policy.record(time.monotonic() - start)
+            return response
+
+        self.telemetry.count("hedges")
+        hedge = self._spawn(
+            httpx.Request(request.method, request.url, headers=request.headers, extensions=request.extensions)
+        )
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is not None:
+                break
+        else:
+            # Both failed: report the original request's error
+            return primary.result()
+
+        for future in (primary, hedge):
+            if future is not winner:
+                future.add_done_callback(self._discard)
+        if winner is hedge:
+            self.telemetry.count("hedges_won")
+        self.policy.record(time.monotonic() - start)
+        return winner.result()
+
+    def close(self):
+        self.policy.flush()
+        self.transport.close()
@@ -0,0 +1,86 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import hashlib
+import json
+import time
+
+from .shared_state import SQLiteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS applied (
+    api_host TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    object_type TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    desired_hash TEXT NOT NULL,
+    result TEXT NOT NULL,
+    applied_at REAL NOT NULL,
+    PRIMARY KEY (api_host, scope, object_type, object_key)
+)
+"""
+
+
+def desired_hash(desired):
+    """Stable hash of a desired item, independent of key order and process"""
+    return hashlib.sha256(json.dumps(desired, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Manifest(SQLiteStore):
+    """Controller-side SQLite record of the desired items that were last applied
+
+    Each entry holds the hash of the desired item and the module result of
+    applying it, keyed by API host, token scope, object type and object key.
+    While the desired hash is unchanged and the entry is younger than
+    ``sweep_interval`` seconds, the stored result is replayed without asking
+    the API. Older entries are reconciled again, which catches changes made
+    outside of Ansible. Like the state cache, the file is shared by parallel
+    forks.
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path, api_host, scope, sweep_interval):
+        super().__init__(path)
+        self.api_host = api_host
+        self.scope = scope
+        self.sweep_interval = sweep_interval
+
+    def get(self, object_type, object_key, desired):
+        """Return the stored result if ``desired`` is what was last applied, within the sweep interval
+
+        :return: dict or None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT desired_hash, result, applied_at FROM applied "
+                "WHERE api_host = ? AND scope = ? AND object_type = ? AND object_key = ?",
+                (self.api_host, self.scope, object_type, object_key),
+            ).fetchone()
+
+            if row is None or row[0] != desired_hash(desired) or time.time() - row[2] > self.sweep_interval:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+        return json.loads(row[1])
+
+    def put(self, object_type, object_key, desired, result):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO applied "
+                "(api_host, scope, object_type, object_key, desired_hash, result, applied_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.api_host,
+                    self.scope,
+                    object_type,
+                    object_key,
+                    desired_hash(desired),
+                    json.dumps(result, sort_keys=True, default=str),
+                    time.time(),
+                ),
+            )
+
+    def stats(self):
+        return {"path": self.path, "sweep_interval": self.sweep_interval, "hits": self.hits, "misses": self.misses}
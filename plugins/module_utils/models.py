@@ -0,0 +1,201 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import re
+import sys
+
+# API field names and their module argument names. Most fields follow the
+# usual camelCase/snake_case conversion; the ones with acronyms do not, which
+# is why a generic decamelize() turns staticSANs into static_sa_ns.
+CAMEL_TO_SNAKE = {
+    "accounts": "accounts",
+    "adminEmails": "admin_emails",
+    "after": "after",
+    "attestorIntermediates": "attestor_intermediates",
+    "attestorRoots": "attestor_roots",
+    "audience": "audience",
+    "before": "before",
+    "certificateInfo": "certificate_info",
+    "createdAt": "created_at",
+    "crtFile": "crt_file",
+    "data": "data",
+    "deviceMetadataKeySANs": "device_metadata_key_sans",
+    "deviceType": "device_type",
+    "deviceTypeConfiguration": "device_type_configuration",
+    "disableCustomSANs": "disable_custom_sans",
+    "displayName": "display_name",
+    "duration": "duration",
+    "forceCN": "force_cn",
+    "format": "format",
+    "gid": "gid",
+    "hooks": "hooks",
+    "id": "id",
+    "keyFile": "key_file",
+    "keyInfo": "key_info",
+    "method": "method",
+    "mode": "mode",
+    "onError": "on_error",
+    "pidFile": "pid_file",
+    "projectIDs": "project_ids",
+    "pubFile": "pub_file",
+    "reloadInfo": "reload_info",
+    "renew": "renew",
+    "requireEAB": "require_eab",
+    "resourceGroups": "resource_groups",
+    "rootFile": "root_file",
+    "serviceAccounts": "service_accounts",
+    "shell": "shell",
+    "sign": "sign",
+    "signal": "signal",
+    "slug": "slug",
+    "staticSANs": "static_sans",
+    "tenantID": "tenant_id",
+    "type": "type",
+    "uid": "uid",
+    "unitName": "unit_name",
+    "updatedAt": "updated_at",
+    "workloadType": "workload_type",
+}
+SNAKE_TO_CAMEL = {snake: camel for camel, snake in CAMEL_TO_SNAKE.items()}
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def snake_key(key):
+    """Module argument name of an API field, learning unknown fields on first use"""
+    snake = CAMEL_TO_SNAKE.get(key)
+    if snake is None:
+        snake = sys.intern(_CAMEL_BOUNDARY.sub("_", key).lower())
+        CAMEL_TO_SNAKE[key] = snake
+    return snake
+
+
+def snake_dict(value):
+    """Recursively rename the keys of an API response to module argument names"""
+    if isinstance(value, dict):
+        return {snake_key(k): snake_dict(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [snake_dict(v) for v in value]
+    return value
+
+
+def freeze(value):
+    """Hashable form of a nested structure, with None values dropped from dicts"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items() if v is not None))
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Model:
+    """Base for the slotted API object models
+
+    Subclasses list their module argument names in ``__slots__``. Values are
+    kept in module argument form so desired state (module params) and observed
+    state (API responses) compare directly. Equality and hashing go through a
+    frozen tuple of all fields that is computed once per object.
+    """
+
+    __slots__ = ("_frozen",)
+    INTERNED = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            value = fields.get(name)
+            if name in self.INTERNED:
+                value = intern(value)
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "_frozen", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    @classmethod
+    def from_api(cls, response):
+        """Build a model from an SDK ``to_dict()`` response"""
+        return cls(**{snake_key(k): snake_dict(v) for k, v in response.items()})
+
+    @classmethod
+    def from_params(cls, params):
+        """Build a model from module parameters"""
+        return cls(**params)
+
+    def frozen(self):
+        if self._frozen is None:
+            object.__setattr__(self, "_frozen", tuple(freeze(getattr(self, name)) for name in self.__slots__))
+        return self._frozen
+
+    def to_params(self):
+        """Module argument form, without unset fields"""
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.frozen() == other.frozen()
+
+    def __hash__(self):
+        return hash(self.frozen())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_params()!r})"
+
+
+class Collection(Model):
+    __slots__ = ("slug", "display_name", "device_type", "device_type_configuration")
+    INTERNED = ("slug", "device_type")
+
+
+class Workload(Model):
+    """Workload fields that the workload module manages
+
+    ``slug`` and ``admin_emails`` are not part of the model: the slug is the
+    identity rather than state, and admin emails are never returned by the API.
+    """
+
+    __slots__ = (
+        "certificate_info",
+        "device_metadata_key_sans",
+        "display_name",
+        "hooks",
+        "key_info",
+        "reload_info",
+        "static_sans",
+        "workload_type",
+    )
+    INTERNED = ("workload_type",)
+
+    def __init__(self, **fields):
+        super().__init__(**fields)
+        if self.device_metadata_key_sans is not None:
+            object.__setattr__(self, "device_metadata_key_sans", [intern(k) for k in self.device_metadata_key_sans])
+
+
+class Instance(Model):
+    """A collection instance and its metadata
+
+    The API adds ``smallstep:host:id`` to the metadata of enrolled hosts; it is
+    not part of the desired state and is left out of the model.
+    """
+
+    __slots__ = ("id", "data")
+    INTERNED = ("id",)
+
+    def __init__(self, **fields):
+        super().__init__(**fields)
+        data = self.data or {}
+        object.__setattr__(self, "data", {intern(k): v for k, v in data.items() if k != "smallstep:host:id"})
+
+    @classmethod
+    def from_api(cls, response):
+        # Instance data is user-defined, so its keys are kept verbatim.
+        return cls(id=response.get("id"), data=response.get("data"))
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(id=params.get("instance_id"), data=params.get("instance_metadata"))
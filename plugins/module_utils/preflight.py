@@ -0,0 +1,128 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+from ansible.module_utils.errors import UnsupportedError
+
+from .argument_specs import (
+    COLLECTION_REQUIRED_IF,
+    INSTANCE_REQUIRED_IF,
+    WORKLOAD_REQUIRED_IF,
+    collection_argument_spec,
+    instance_argument_spec,
+    workload_argument_spec,
+)
+
+
+class DesiredStateValidator:
+    """Validate the complete desired state of a team without calling the API
+
+    Every entry is checked against the argument spec of the module that will
+    apply it. Duplicate slugs, SANs claimed by more than one workload and
+    references to undeclared collections are found with hash indexes built in
+    a single pass over the input.
+    """
+
+    def __init__(self, known_collections=None, san_scope="global"):
+        self.known_collections = set(known_collections or [])
+        self.san_scope = san_scope
+        self.errors = []
+        self.warnings = []
+        self.validators = {
+            "collection": ArgumentSpecValidator(collection_argument_spec(), required_if=COLLECTION_REQUIRED_IF),
+            "workload": ArgumentSpecValidator(workload_argument_spec(), required_if=WORKLOAD_REQUIRED_IF),
+            "instance": ArgumentSpecValidator(instance_argument_spec(), required_if=INSTANCE_REQUIRED_IF),
+        }
+
+    def _error(self, kind, path, message):
+        self.errors.append({"kind": kind, "path": path, "msg": message})
+
+    def _validate_spec(self, object_type, path, item):
+        if not isinstance(item, dict):
+            self._error("type", path, f"expected a dict, got {type(item).__name__}")
+            return None
+
+        result = self.validators[object_type].validate(item)
+        valid = True
+        for error in result.errors:
+            # The roles only pass known keys to the modules, so extra keys are
+            # harmless and reported as warnings.
+            if isinstance(error, UnsupportedError):
+                self.warnings.append(f"{path} has unsupported parameters: {error}")
+            else:
+                self._error("argument_spec", path, str(error))
+                valid = False
+        return result.validated_parameters if valid else None
+
+    def validate(self, collections=None, workloads=None, instances=None):
+        collection_index = {}
+        present_collections = set(self.known_collections)
+        for i, item in enumerate(collections or []):
+            path = f"collections[{i}]"
+            params = self._validate_spec("collection", path, item)
+            if params is None:
+                continue
+            slug = params["collection_slug"]
+            if slug in collection_index:
+                self._error(
+                    "duplicate_slug", path, f"collection {slug} is already declared at {collection_index[slug]}"
+                )
+                continue
+            collection_index[slug] = path
+            if params["state"] == "present":
+                present_collections.add(slug)
+
+        workload_index = {}
+        san_index = {}
+        for i, item in enumerate(workloads or []):
+            path = f"workloads[{i}]"
+            params = self._validate_spec("workload", path, item)
+            if params is None:
+                continue
+            key = (params["collection_slug"], params["workload_slug"])
+            if key in workload_index:
+                self._error(
+                    "duplicate_slug",
+                    path,
+                    f"workload {key[1]} in collection {key[0]} is already declared at {workload_index[key]}",
+                )
+                continue
+            workload_index[key] = path
+            if params["state"] != "present":
+                continue
+            self._check_collection_reference(path, params["collection_slug"], present_collections)
+
+            for san in params.get("static_sans") or []:
+                san_key = san.lower() if self.san_scope == "global" else (params["collection_slug"], san.lower())
+                owner = san_index.setdefault(san_key, path)
+                if owner != path:
+                    self._error("duplicate_san", path, f"static SAN {san} is already used by {owner}")
+
+        instance_index = {}
+        for i, item in enumerate(instances or []):
+            path = f"instances[{i}]"
+            params = self._validate_spec("instance", path, item)
+            if params is None:
+                continue
+            key = (params["collection_slug"], params["instance_id"])
+            if key in instance_index:
+                self._error(
+                    "duplicate_slug",
+                    path,
+                    f"instance {key[1]} in collection {key[0]} is already declared at {instance_index[key]}",
+                )
+                continue
+            instance_index[key] = path
+            if params["state"] == "present":
+                self._check_collection_reference(path, params["collection_slug"], present_collections)
+
+        return {
+            "collections": len(collection_index),
+            "workloads": len(workload_index),
+            "instances": len(instance_index),
+            "static_sans": len(san_index),
+        }
+
+    def _check_collection_reference(self, path, slug, present_collections):
+        if slug not in present_collections:
+            self._error("dangling_reference", path, f"collection {slug} is not declared with state present")
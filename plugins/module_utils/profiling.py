@@ -0,0 +1,126 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from ansible.module_utils import basic
+
+PROFILE_DIR_ENV = "SMALLSTEP_PROFILE_DIR"
+PROFILE_FORMAT_ENV = "SMALLSTEP_PROFILE_FORMAT"
+
+SAMPLE_INTERVAL = 0.001
+
+# Module parameters that identify the item a module run is working on, in
+# order of preference.
+ITEM_PARAMS = ("workload_slug", "instance_id", "collection_slug")
+
+
+def profiled(module_name):
+    """Run the decorated module entry point under a profiler when requested
+
+    Profiling is enabled by pointing ``SMALLSTEP_PROFILE_DIR`` at a directory on
+    the controller. ``SMALLSTEP_PROFILE_FORMAT`` selects ``pstats`` (cProfile,
+    the default) or ``collapsed`` (sampled stacks for flame graph tools). When
+    the variable is unset the entry point is called directly.
+    """
+
+    def decorator(main):
+        @functools.wraps(main)
+        def wrapper():
+            directory = os.environ.get(PROFILE_DIR_ENV)
+            if not directory:
+                return main()
+            fmt = os.environ.get(PROFILE_FORMAT_ENV, "pstats")
+            return _run_profiled(main, _profile_path(directory, module_name, fmt), fmt)
+
+        return wrapper
+
+    return decorator
+
+
+def _profile_path(directory, module_name, fmt):
+    item = "unknown"
+    try:
+        params = basic._load_params()
+        item = next((str(params[k]) for k in ITEM_PARAMS if params.get(k)), item)
+    except Exception:
+        pass
+    item = re.sub(r"[^A-Za-z0-9_.-]+", "_", item)
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+    extension = "folded" if fmt == "collapsed" else "pstats"
+    directory = os.path.expanduser(directory)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{module_name}-{item}-{timestamp}-{os.getpid()}.{extension}")
+
+
+def _run_profiled(main, path, fmt):
+    if fmt == "collapsed":
+        profiler = StackSampler()
+    else:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+    profiler.enable()
+    try:
+        return main()
+    finally:
+        # exit_json() and fail_json() leave through SystemExit, so the profile
+        # has to be written on the way out.
+        profiler.disable()
+        if fmt == "collapsed":
+            profiler.dump(path)
+        else:
+            profiler.dump_stats(path)
+
+
+class StackSampler:
+    """Sample the calling thread's stack and write it in collapsed format
+
+    Each output line is a semicolon separated stack followed by the number of
+    samples it was seen in, as consumed by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+        self._switch_interval = None
+
+    def enable(self):
+        # The sampler thread only runs when the main thread releases the GIL,
+        # so shorten the switch interval to match the sampling interval.
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(self.interval)
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,47 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import time
+
+from .shared_state import LockedState, state_path
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token bucket shared by every module process talking to one API host
+
+    The bucket lives in a lock-protected file on the controller, so all forks
+    of a play draw from the same budget. A caller that finds the bucket empty
+    takes its token anyway, leaving the bucket in debt, and sleeps until the
+    debt it is responsible for has been refilled. This keeps the critical
+    section to one read and one write and serves callers in arrival order.
+    """
+
+    def __init__(self, api_host, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self.path = state_path("ratelimit", api_host)
+
+    def acquire(self, max_wait=None):
+        """Take one token, sleeping until it is available
+
+        :return: the number of seconds spent waiting
+        :raise RateLimitTimeout: when the token is only available after ``max_wait`` seconds, without waiting
+        """
+        with LockedState(self.path) as state:
+            now = time.time()
+            elapsed = max(now - state.get("updated", now), 0.0)
+            tokens = min(self.burst, state.get("tokens", self.burst) + elapsed * self.rate) - 1
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+            if max_wait is not None and wait > max_wait:
+                # Leave the bucket as it was, for the callers that can wait
+                raise RateLimitTimeout(f"the rate limit needs a wait of {wait:.1f}s")
+            state["tokens"] = tokens
+            state["updated"] = now
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
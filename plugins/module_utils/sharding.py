@@ -0,0 +1,52 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import hashlib
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash of a 64 bit key into one of ``buckets`` buckets
+
+    Growing from n to n + 1 buckets only moves 1/(n + 1) of the keys, all of
+    them into the new bucket.
+    """
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_key(collection_slug, object_id=None):
+    """Key an object is partitioned by
+
+    Collections are keyed by their slug, workloads and instances by the slug
+    of their collection and their own workload slug or instance ID.
+    """
+    return collection_slug if object_id is None else f"{collection_slug}/{object_id}"
+
+
+class Shard:
+    """One of ``count`` controllers that converge disjoint slices of the fleet
+
+    Every controller computes the same owner for a key, so a fleet can be
+    split between CI runners with no coordination beyond ``index`` and
+    ``count``.
+    """
+
+    def __init__(self, index, count):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"shard_index must be between 0 and shard_count - 1, got {index} of {count}")
+        self.index = index
+        self.count = count
+
+    def owner(self, key):
+        digest = hashlib.sha256(key.encode()).digest()
+        return jump_hash(int.from_bytes(digest[:8], "big"), self.count)
+
+    def owns(self, key):
+        return self.count == 1 or self.owner(key) == self.index
+
+    def as_dict(self, key):
+        return {"index": self.index, "count": self.count, "owner": self.owner(key)}
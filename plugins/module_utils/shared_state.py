@@ -0,0 +1,93 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+STATE_DIR_ENV = "SMALLSTEP_STATE_DIR"
+
+
+def state_dir():
+    """Directory on the controller shared by every module process of a user"""
+    directory = os.environ.get(STATE_DIR_ENV) or os.path.join(tempfile.gettempdir(), f"smallstep-agent-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+
+def state_path(name, *key):
+    digest = hashlib.sha256("\0".join(key).encode()).hexdigest()[:16]
+    return os.path.join(state_dir(), f"{name}-{digest}.json")
+
+
+class LockedState:
+    """A small JSON document shared between concurrent module processes
+
+    Entering the context takes an exclusive ``flock`` on the file and yields
+    its content as a dict; the dict is written back when the context exits.
+    Keep the work done under the lock short, every fork waits on it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.state = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        raw = b""
+        while True:
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                break
+            raw += chunk
+        try:
+            self.state = json.loads(raw) if raw else {}
+        except ValueError:
+            self.state = {}
+        return self.state
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                data = json.dumps(self.state).encode()
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                os.ftruncate(self.fd, 0)
+                os.write(self.fd, data)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+
+
+class SQLiteStore:
+    """A SQLite file on the controller shared by parallel forks and worker threads
+
+    Module processes running in parallel forks open the same file, so the
+    database runs in WAL mode with a generous busy timeout. Within a process
+    the connection is shared by worker threads behind ``lock``. ``SCHEMA`` is
+    created on open if the file does not have it yet.
+    """
+
+    SCHEMA = None
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,128 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import fcntl
+import json
+import os
+import threading
+import time
+
+from smallstep.exceptions import StepException
+
+from .shared_state import state_path
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """Merge identical reads that are in flight at the same time into one API call
+
+    Threads of a module run that ask for a key while it is being read wait
+    for that read and share its result. Across the module processes of the
+    controller, the read holds an exclusive ``flock`` on a file of the key
+    and leaves its result in it. A process that had to wait for the lock
+    takes that result when the read finished after it started waiting, and
+    reads the key itself otherwise. Values must be JSON serializable.
+    ``StepException`` errors are shared like values. Any other error is not,
+    so whoever waited reads again. Shared results are counted as
+    ``coalesced`` in ``telemetry.transport``.
+    """
+
+    def __init__(self, scope, telemetry):
+        self.scope = scope
+        self.telemetry = telemetry
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Return ``func()``, or the result of the identical read in flight"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            self.telemetry.count("coalesced")
+            return flight.result()
+
+        try:
+            flight.value = self._across_processes(key, func)
+        except BaseException as exception:
+            flight.error = exception
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result()
+
+    def _across_processes(self, key, func):
+        started = time.time()
+        fd = os.open(state_path("singleflight", self.scope, key), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is reading the key: wait for it and take its result
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                record = self._load(fd)
+                if record.get("finished", 0) >= started:
+                    self.telemetry.count("coalesced")
+                    if "value" in record:
+                        return record["value"]
+                    raise StepException(
+                        status_code=record["status_code"], message=record["message"], headers=record.get("headers")
+                    )
+
+            try:
+                value = func()
+            except StepException as exception:
+                self._store(
+                    fd,
+                    {
+                        "status_code": exception.status_code,
+                        "message": exception.message,
+                        "headers": exception.headers,
+                        "finished": time.time(),
+                    },
+                )
+                raise
+            self._store(fd, {"value": value, "finished": time.time()})
+            return value
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    @staticmethod
+    def _load(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        raw = b""
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            raw += chunk
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _store(fd, record):
+        try:
+            data = json.dumps(record, default=str).encode()
+        except (TypeError, ValueError):
+            return
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, data)
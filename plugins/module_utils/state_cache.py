@@ -0,0 +1,83 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import json
+import time
+
+from .shared_state import SQLiteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    api_host TEXT NOT NULL,
+    team TEXT NOT NULL,
+    object_type TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    representation TEXT NOT NULL,
+    updated_at TEXT,
+    observed_at REAL NOT NULL,
+    PRIMARY KEY (api_host, team, object_type, object_key)
+)
+"""
+
+
+class StateCache(SQLiteStore):
+    """Controller-side SQLite store of the last observed Smallstep API objects.
+
+    Entries are keyed by API host, team, object type and object key (slug or
+    ID) and are trusted for ``ttl`` seconds after they were last observed.
+    Module processes running in parallel forks share the same file.
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path, api_host, ttl):
+        super().__init__(path)
+        self.api_host = api_host
+        self.ttl = ttl
+
+    def get(self, team, object_type, object_key):
+        """Return the cached representation if it is still within the TTL
+
+        :return: dict or None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT representation, observed_at FROM objects "
+                "WHERE api_host = ? AND team = ? AND object_type = ? AND object_key = ?",
+                (self.api_host, team, object_type, object_key),
+            ).fetchone()
+
+            if row is None or time.time() - row[1] > self.ttl:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, team, object_type, object_key, representation):
+        updated_at = representation.get("updatedAt") if isinstance(representation, dict) else None
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO objects "
+                "(api_host, team, object_type, object_key, representation, updated_at, observed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.api_host,
+                    team,
+                    object_type,
+                    object_key,
+                    json.dumps(representation, sort_keys=True, default=str),
+                    updated_at,
+                    time.time(),
+                ),
+            )
+
+    def invalidate(self, team, object_type, object_key):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM objects WHERE api_host = ? AND team = ? AND object_type = ? AND object_key = ?",
+                (self.api_host, team, object_type, object_key),
+            )
+
+    def stats(self):
+        return {"path": self.path, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,73 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import threading
+import time
+from collections import Counter
+
+from smallstep.exceptions import StepException
+
+
+class Telemetry:
+    """Per-run record of the Smallstep API calls a module made
+
+    The record is returned in the ``smallstep_telemetry`` result key, where the
+    ``smallstep.agent.api_timings`` callback plugin picks it up. An
+    ``observer`` is handed every call record as soon as the call finishes.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.rate_limit_wait = 0.0
+        self.transport = Counter()
+        self.http_versions = Counter()
+        self.observer = None
+        self._lock = threading.Lock()
+
+    def trace(self, event_name, info):
+        """httpcore trace hook counting the connections and TLS handshakes a request needed"""
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.transport["connections"] += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.transport["tls_handshakes"] += 1
+
+    def record_response(self, response):
+        """Count the bytes of an HTTP exchange, compressed on the wire and decoded"""
+        response.read()
+        with self._lock:
+            self.transport["bytes_sent"] += len(response.request.content)
+            self.transport["bytes_received"] += response.num_bytes_downloaded
+            self.transport["bytes_decoded"] += len(response.content)
+            self.http_versions[response.http_version] += 1
+
+    def count(self, key, n=1):
+        """Add ``n`` to a transport counter"""
+        with self._lock:
+            self.transport[key] += n
+
+    def call(self, operation, func, *args, **kwargs):
+        """Invoke ``func`` and record its latency and outcome under ``operation``"""
+        record = {"operation": operation, "status_code": None}
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        except StepException as exception:
+            record["status_code"] = exception.status_code
+            raise
+        except Exception as exception:
+            record["error"] = type(exception).__name__
+            raise
+        finally:
+            record["duration"] = round(time.monotonic() - start, 6)
+            self.calls.append(record)
+            if self.observer is not None:
+                self.observer(record)
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "rate_limit_wait": round(self.rate_limit_wait, 6),
+            "transport": dict(self.transport, http_versions=dict(self.http_versions)),
+        }
@@ -0,0 +1,84 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import httpx
+
+from .hedging import HedgingTransport
+
+# Request headers the persistent connection should see; it adds its own
+# authorization and connection management.
+FORWARDED_HEADERS = ("accept", "content-type", "user-agent")
+
+
+class ConnectionTransport(httpx.BaseTransport):
+    """httpx transport that sends SDK requests through the smallstep httpapi plugin
+
+    ``connection`` is an ``ansible.module_utils.connection.Connection`` to the
+    persistent ``ansible.netcommon.httpapi`` connection of the task. Only the
+    path and query of a request are forwarded; the connection owns the API
+    host, the token and the pool of HTTP connections.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def handle_request(self, request):
+        body = request.read()
+        status_code, headers, text = self.connection.send_request(
+            body.decode() if body else None,
+            path=request.url.raw_path.decode("ascii"),
+            method=request.method,
+            headers={k: v for k, v in request.headers.items() if k.lower() in FORWARDED_HEADERS},
+            timeout=request.extensions.get("timeout"),
+        )
+        return httpx.Response(status_code, headers=headers, content=text.encode(), request=request)
+
+
+class SharedClient(httpx.Client):
+    """httpx client shared by every SDK object of a module run
+
+    The SDK wraps each request in ``with client:``, which would close a plain
+    ``httpx.Client`` and its connection pool after one request. Entering and
+    leaving this client is a no-op, so connections, TLS sessions and, with
+    HTTP/2, the multiplexed stream of the run are reused until ``close()``.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+
+def shared_client(
+    base_url, headers, telemetry, http2=False, transport=None, timeout=None, deadline=None, hedging=None
+):
+    """Build the shared client of a module run
+
+    Responses are decompressed by httpx, which advertises gzip and deflate,
+    and br when brotli is installed. The bytes on the wire, the decoded
+    bytes, new connections and TLS handshakes are counted in ``telemetry``.
+    Like the SDK's own clients, requests have no timeout by default. With a
+    ``deadline``, the timeouts of every request are cut down to what is left
+    of it. With a ``hedging`` policy, slow reads are hedged on the pool of
+    the client; requests handed to another ``transport`` are not.
+
+    :raise ImportError: when ``http2`` is requested without the h2 package
+    """
+
+    def trace_request(request):
+        request.extensions["trace"] = telemetry.trace
+        if deadline is not None:
+            request.extensions["timeout"] = deadline.clip(request.extensions.get("timeout"))
+
+    if hedging is not None and transport is None:
+        transport = HedgingTransport(httpx.HTTPTransport(http2=http2), hedging, telemetry)
+
+    return SharedClient(
+        base_url=base_url,
+        headers=headers,
+        http2=http2,
+        transport=transport,
+        timeout=timeout,
+        event_hooks={"request": [trace_request], "response": [telemetry.record_response]},
+    )
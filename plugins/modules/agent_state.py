@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+module: agent_state
+
+short_description: Converge the step-agent package, configuration and service of a host in one run
+
+description:
+    - Checks the installed C(step-agent-plugin) version, the hash of the agent configuration and the state of the
+      systemd unit in a single module run on the host, and applies only the actions that are needed.
+    - systemd is only reloaded when it reports changed unit files, and the service is only reloaded or restarted
+      when the package or the configuration changed.
+    - When the installed version does not match I(version) and no I(package) is given, nothing is changed and
+      C(package_required) is returned. The action plugin of the same name then transfers I(package_src) from the
+      controller and runs the module again, so hosts that are up to date take a single round trip.
+
+author:
+    - Smallstep Engineering
+
+requirements:
+    - systemd
+    - dpkg and apt-get, or rpm and dnf or yum
+
+options:
+    version:
+        description:
+            - The C(step-agent-plugin) version that must be installed, with or without a leading C(v).
+            - Any installed version is accepted when unset.
+        type: str
+    package:
+        description:
+            - Path on the host, or URL, of the package to install when the installed version does not match.
+            - Or the package name and version, such as C(step-agent-plugin=0.10.0) for apt or
+              C(step-agent-plugin-0.10.0) for dnf, to install from a configured repository.
+        type: str
+    package_src:
+        description:
+            - Path on the controller of the package to install when the installed version does not match.
+            - Handled by the action plugin, which only transfers the package to hosts that need it.
+        type: path
+    config:
+        description:
+            - Content of the agent configuration, usually rendered from C(agent.yaml.j2).
+            - The file is left alone when unset.
+        type: str
+    config_path:
+        description:
+            - Path of the agent configuration.
+        default: /etc/step-agent/agent.yaml
+        type: path
+    owner:
+        description:
+            - Owner of the agent configuration.
+        default: step-agent
+        type: str
+    group:
+        description:
+            - Group of the agent configuration.
+        default: step-agent
+        type: str
+    mode:
+        description:
+            - Mode of the agent configuration.
+        default: "0644"
+        type: raw
+    service:
+        description:
+            - Name of the systemd unit of the agent. The unit is left alone when empty.
+        default: step-agent
+        type: str
+"""
+
+EXAMPLES = """
+- name: Converge step-agent
+  smallstep.agent.agent_state:
+    version: v0.10.0
+    package_src: "{{ step_agent_artifact.path }}"
+    config: "{{ lookup('ansible.builtin.template', 'agent.yaml.j2') }}"
+  become: True
+"""
+
+RETURN = """
+actions:
+    description: Actions that were applied, or that would be applied in check mode, in order.
+    returned: always
+    type: list
+    elements: str
+    sample: [install, config, daemon-reload, reload-or-restart]
+installed_version:
+    description: The installed C(step-agent-plugin) version before the run, or null.
+    returned: always
+    type: str
+    sample: 0.10.0
+package_required:
+    description: Whether the installed version does not match I(version) and no I(package) was given.
+    returned: always
+    type: bool
+config_sha256:
+    description: SHA-256 digest of I(config).
+    returned: when I(config) is set
+    type: str
+"""
+
+import hashlib  # noqa: E402
+import os  # noqa: E402
+import tempfile  # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+from ansible.module_utils.urls import fetch_file  # noqa: E402
+
+PACKAGE = "step-agent-plugin"
+
+
+class AgentState:
+    def __init__(self, module):
+        self.module = module
+        self.actions = []
+        self.dpkg = module.get_bin_path("dpkg-query")
+
+    def _run(self, args):
+        rc, out, err = self.module.run_command(args)
+        if rc != 0:
+            self.module.fail_json(msg=f"{' '.join(args)} failed: {err.strip() or out.strip()}", actions=self.actions)
+        return out
+
+    def _apply(self, action, args):
+        self.actions.append(action)
+        if not self.module.check_mode:
+            self._run(args)
+
+    def installed_version(self):
+        if self.dpkg:
+            args = [self.dpkg, "-W", "-f=${Version}", PACKAGE]
+        else:
+            args = [self.module.get_bin_path("rpm", required=True), "-q", "--qf", "%{VERSION}", PACKAGE]
+        rc, out, _err = self.module.run_command(args)
+        return out.strip() if rc == 0 and out.strip() else None
+
+    def install(self, package):
+        if "://" in package and not self.module.check_mode:
+            package = fetch_file(self.module, package)
+        if self.dpkg:
+            args = [self.module.get_bin_path("apt-get", required=True), "install", "-y", package]
+        else:
+            manager = self.module.get_bin_path("dnf") or self.module.get_bin_path("yum", required=True)
+            args = [manager, "install", "-y", package]
+            if package.endswith(".rpm"):
+                # The package file is not GPG signed; the install role verifies it against the signed release checksums.
+                args.insert(-1, "--nogpgcheck")
+        self._apply("install", args)
+
+    def write_config(self, content):
+        """Write the configuration when its digest differs, and fix its ownership and mode
+
+        :return: SHA-256 digest of ``content``
+        """
+        path = self.module.params.get("config_path")
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        current = None
+        if os.path.exists(path):
+            current = self.module.sha256(path)
+
+        if current != digest:
+            self.actions.append("config")
+            if not self.module.check_mode:
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".agent.yaml")
+                with os.fdopen(fd, "w") as f:
+                    f.write(content)
+                self.module.atomic_move(tmp, path)
+
+        if os.path.exists(path):
+            file_args = self.module.load_file_common_arguments(
+                {
+                    "path": path,
+                    "owner": self.module.params.get("owner"),
+                    "group": self.module.params.get("group"),
+                    "mode": self.module.params.get("mode"),
+                }
+            )
+            if self.module.set_fs_attributes_if_different(file_args, False) and "config" not in self.actions:
+                self.actions.append("config")
+        return digest
+
+    def unit_state(self, service):
+        out = self._run(
+            [
+                self.module.get_bin_path("systemctl", required=True),
+                "show",
+                service,
+                "--property=NeedDaemonReload,UnitFileState,ActiveState",
+            ]
+        )
+        return dict(line.split("=", 1) for line in out.splitlines() if "=" in line)
+
+    def converge_service(self, service, reload):
+        systemctl = self.module.get_bin_path("systemctl", required=True)
+        state = self.unit_state(service)
+        if state.get("NeedDaemonReload") == "yes":
+            self._apply("daemon-reload", [systemctl, "daemon-reload"])
+        if state.get("UnitFileState") != "enabled":
+            self._apply("enable", [systemctl, "enable", service])
+        if state.get("ActiveState") != "active":
+            self._apply("start", [systemctl, "start", service])
+        elif reload:
+            self._apply("reload-or-restart", [systemctl, "reload-or-restart", service])
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            version=dict(type="str"),
+            package=dict(type="str"),
+            package_src=dict(type="path"),
+            config=dict(type="str"),
+            config_path=dict(type="path", default="/etc/step-agent/agent.yaml"),
+            owner=dict(type="str", default="step-agent"),
+            group=dict(type="str", default="step-agent"),
+            mode=dict(type="raw", default="0644"),
+            service=dict(type="str", default="step-agent"),
+        ),
+        supports_check_mode=True,
+    )
+
+    agent = AgentState(module)
+    result = {"changed": False, "actions": agent.actions, "package_required": False}
+
+    installed = agent.installed_version()
+    result["installed_version"] = installed
+    desired = (module.params.get("version") or "").lstrip("v")
+    if installed is None or (desired and installed != desired):
+        package = module.params.get("package")
+        if package is None:
+            result["package_required"] = True
+            module.exit_json(**result)
+        agent.install(package)
+
+    if module.params.get("config") is not None:
+        result["config_sha256"] = agent.write_config(module.params.get("config"))
+
+    if module.params.get("service"):
+        agent.converge_service(module.params.get("service"), reload=bool(agent.actions))
+
+    result["changed"] = bool(agent.actions)
+    module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
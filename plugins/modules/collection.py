@@ -16,13 +16,20 @@ description:
 author:
     - Joe Doss (@jdoss)
 
+extends_documentation_fragment:
+    - smallstep.agent.state_cache
+    - smallstep.agent.manifest
+    - smallstep.agent.rate_limit
+    - smallstep.agent.transport
+    - smallstep.agent.sharding
+
 options:
     api_token:
         description:
         - The Smallstep API Token used when connecting.
-        - Required.
+        - Required unless the task runs over the C(ansible.netcommon.httpapi) connection with the C(smallstep.agent.smallstep) plugin, which holds the token.
         env:
-        - name: SMALLSTEP_API_host
+        - name: SMALLSTEP_API_TOKEN
         type: str
     api_host:
         description: The Smallstep host used when connecting.
@@ -236,6 +243,10 @@ from smallstep import api as step  # noqa: E402
 from smallstep.exceptions import StepException  # noqa: E402
 
 from ..module_utils.agent import AnsibleStep  # noqa: E402
+from ..module_utils.argument_specs import COLLECTION_REQUIRED_IF, collection_argument_spec  # noqa: E402
+from ..module_utils.models import Collection  # noqa: E402
+from ..module_utils.profiling import profiled  # noqa: E402
+from ..module_utils.sharding import shard_key  # noqa: E402
 
 
 class AnsibleStepCollection(AnsibleStep):
@@ -262,27 +273,38 @@ class AnsibleStepCollection(AnsibleStep):
 
     def _get_collection(self):
         self.module.fail_on_missing_params(required_params=["collection_slug"])
+        cached = self._cache_get("collection", self.module.params.get("collection_slug"))
+        if cached is not None:
+            self.smallstep_collection = cached
+            return
+
         try:
             if self.module.params.get("collection_slug") is not None:
-                collection = step.StepDeviceCollection(**self.connectargs)
-                res = collection.get(collection_slug=self.module.params.get("collection_slug")).to_dict()
+                collection = self._sdk(step.StepDeviceCollection)
+                # Not coalesced: whether to create the collection is decided on this lookup, and a fork
+                # that shared a leader's 404 would create it against stale state.
+                res = self._call(
+                    "collection.get", collection.get, collection_slug=self.module.params.get("collection_slug")
+                ).to_dict()
                 self.smallstep_collection = res
+                self._cache_put("collection", self.module.params.get("collection_slug"), res)
 
         except StepException as exception:
             if exception.status_code == 404:
                 self.smallstep_collection = None
+                self._cache_invalidate("collection", self.module.params.get("collection_slug"))
                 return
             if exception.status_code == 409:
                 self.smallstep_collection = res
                 return
             else:
-                self.fail_json(
-                    status_code=exception.status_code,
-                    headers=exception.headers,
-                    message=exception.message,
-                )
+                self.fail_json(exception)
 
     def _create_collection(self):
+        """Create the collection
+
+        :return: False when another shard or controller created it first
+        """
         self.module.fail_on_missing_params(required_params=["collection_slug", "display_name", "device_type"])
 
         params = {
@@ -298,8 +320,10 @@ class AnsibleStepCollection(AnsibleStep):
 
         if not self.module.check_mode:
             try:
-                collection = step.StepDeviceCollection(**self.connectargs)
-                collection.create(
+                collection = self._sdk(step.StepDeviceCollection)
+                self._call(
+                    "collection.create",
+                    collection.create,
                     collection_slug=params["collection_slug"],
                     collection_name=params["display_name"],
                     admin_emails=admin_emails,
@@ -307,42 +331,49 @@ class AnsibleStepCollection(AnsibleStep):
                     **device_type_config,
                 ).to_dict()
                 self._mark_changed()
+                self._cache_invalidate("collection", self.module.params.get("collection_slug"))
                 self._get_collection()
             except StepException as exception:
-                self.fail_json(
-                    status_code=exception.status_code,
-                    headers=exception.headers,
-                    message=exception.message,
-                )
+                if exception.status_code != 409:
+                    self.fail_json(exception)
+                self._cache_invalidate("collection", self.module.params.get("collection_slug"))
+                self._get_collection()
+                return False
+        return True
 
     def _update_collection(self):
         self.module.fail_on_missing_params(required_params=["display_name", "collection_slug"])
         name = self.module.params.get("display_name")
-        if name is not None and self.smallstep_collection["displayName"] != name:
+        if name is not None and Collection.from_api(self.smallstep_collection).display_name != name:
             if not self.module.check_mode:
                 try:
-                    current = step.StepDeviceCollection(**self.connectargs)
-                    data = current.get(collection_slug=self.module.params.get("collection_slug")).to_dict()
-                    collection = step.StepDeviceCollection(**self.connectargs)
-                    collection.update(
+                    current = self._sdk(step.StepDeviceCollection)
+                    data = self._call(
+                        "collection.get", current.get, collection_slug=self.module.params.get("collection_slug")
+                    ).to_dict()
+                    collection = self._sdk(step.StepDeviceCollection)
+                    self._call(
+                        "collection.update",
+                        collection.update,
                         collection_slug=self.module.params.get("collection_slug"),
                         collection_name=self.module.params.get("display_name"),
                         collection_data=data,
                     )
                     self._mark_changed()
+                    self._cache_invalidate("collection", self.module.params.get("collection_slug"))
                     self._get_collection()
                 except StepException as exception:
-                    self.fail_json(
-                        status_code=exception.status_code,
-                        headers=exception.headers,
-                        message=exception.message,
-                    )
+                    self.fail_json(exception)
+
+    def check_collection(self, update=True):
+        """Create the collection if it is missing, and update it when ``update``
 
-    def check_collection(self):
+        Shards that do not own the collection only make sure that it exists.
+        """
         self._get_collection()
-        if self.smallstep_collection is None:
-            self._create_collection()
-        else:
+        if self.smallstep_collection is None and self._create_collection():
+            return
+        if update and self.smallstep_collection is not None:
             self._update_collection()
 
     def destroy_collection(self):
@@ -351,9 +382,14 @@ class AnsibleStepCollection(AnsibleStep):
         if self.smallstep_collection is not None:
             if not self.module.check_mode:
                 try:
-                    collection = step.StepDeviceCollection(**self.connectargs)
-                    collection.destroy(collection_slug=self.module.params.get("collection_slug"))
+                    collection = self._sdk(step.StepDeviceCollection)
+                    self._call(
+                        "collection.destroy",
+                        collection.destroy,
+                        collection_slug=self.module.params.get("collection_slug"),
+                    )
                     self._mark_changed()
+                    self._cache_invalidate("collection", self.module.params.get("collection_slug"))
                     self._get_collection()
                 except StepException as exception:
                     self.fail_json(exception)
@@ -362,81 +398,39 @@ class AnsibleStepCollection(AnsibleStep):
     def define_module(cls):
         return AnsibleModule(
             argument_spec=dict(
-                collection_slug=dict(type="str", required=True),
-                display_name=dict(type="str"),
-                admin_emails=dict(type="list"),
-                device_type=dict(
-                    type="dict",
-                    required_one_of=[("aws_vm", "azure_vm", "gcp_vm", "tpm")],
-                    mutually_exclusive=[("aws_vm", "azure_vm", "gcp_vm", "tpm")],
-                    options=dict(
-                        aws_vm=dict(
-                            type="dict",
-                            options=dict(
-                                accounts=dict(type="list", elements="str", required=True),
-                                disable_custom_sans=dict(type="bool"),
-                            ),
-                        ),
-                        azure_vm=dict(
-                            type="dict",
-                            options=dict(
-                                resource_groups=dict(type="list", elements="str", required=True),
-                                tenant_id=dict(type="str", required=True),
-                                disable_custom_sans=dict(type="bool"),
-                            ),
-                        ),
-                        gcp_vm=dict(
-                            type="dict",
-                            options=dict(
-                                project_ids=dict(type="list", elements="str", required=True),
-                                service_accounts=dict(type="list", elements="str", required=True),
-                                disable_custom_sans=dict(type="bool"),
-                            ),
-                        ),
-                        tpm=dict(
-                            type="dict",
-                            options=dict(
-                                attestor_intermediates=dict(type="str"),
-                                attestor_roots=dict(type="str"),
-                                force_cn=dict(type="bool"),
-                                require_eab=dict(type="bool"),
-                            ),
-                        ),
-                    ),
-                ),
-                state=dict(type="str", default="present", choices=["absent", "present"]),
+                **collection_argument_spec(),
                 **super().base_module_args(),
             ),
-            required_if=[
-                [
-                    "state",
-                    "present",
-                    [
-                        "admin_emails",
-                        "device_type",
-                        "display_name",
-                        "collection_slug",
-                    ],
-                ],
-                ["state", "absent", ["collection_slug"]],
-            ],
+            required_if=COLLECTION_REQUIRED_IF,
             supports_check_mode=True,
         )
 
 
+@profiled("collection")
 def main():
     module = AnsibleStepCollection.define_module()
 
     module.params["device_type"] = {k: v for k, v in module.params["device_type"].items() if v is not None}
 
     agent = AnsibleStepCollection(module)
+    slug = module.params.get("collection_slug")
+    foreign = agent.foreign(shard_key(slug))
     state = module.params.get("state")
+    if state == "absent" and foreign:
+        module.exit_json(skipped=True, msg="owned by another shard", **agent.get_result())
+    if agent.replay("collection", slug):
+        module.exit_json(**agent.get_result())
+
     if state == "absent":
         agent.destroy_collection()
     elif state == "present":
-        agent.check_collection()
+        agent.check_collection(update=not foreign)
 
-    module.exit_json(**agent.get_result())
+    result = agent.get_result()
+    # Only the owner has applied the whole desired collection.
+    if not foreign:
+        agent.record("collection", slug)
+    module.exit_json(**result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,468 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+module: export
+
+short_description: Export existing Smallstep collections, workloads and instances as role variables
+
+description:
+    - Pages through the collections of a team and their instances, and writes them to files in the shape of the
+      C(smallstep_collections), C(smallstep_workloads) and C(smallstep_collection_instances) variables of the
+      M(smallstep.agent.configure) role.
+    - Values are normalized to the module arguments, so converging the exported variables finds nothing to change.
+    - Collections are exported concurrently. Each collection streams its items to a part file on disk as pages
+      arrive, and the parts are joined in collection order, so memory use does not grow with the size of the team
+      and the output is stable from run to run.
+    - Files are only replaced when their content changed.
+    - The API cannot list workloads, so only the workloads given in I(workloads) are exported. The API does not
+      return the admin emails of a workload either; the admin emails of its collection are used instead.
+    - Collections that are not device collections cannot be managed by M(smallstep.agent.collection). They are
+      left out of C(smallstep_collections) and returned in C(unmanaged_collections), but their instances are
+      exported.
+
+author:
+    - Smallstep Engineering
+
+extends_documentation_fragment:
+    - smallstep.agent.state_cache
+    - smallstep.agent.rate_limit
+    - smallstep.agent.transport
+
+options:
+    api_token:
+        description:
+        - The Smallstep API Token used when connecting.
+        - Required unless the task runs over the C(ansible.netcommon.httpapi) connection with the C(smallstep.agent.smallstep) plugin, which holds the token.
+        env:
+        - name: SMALLSTEP_API_TOKEN
+        type: str
+    api_host:
+        description: The Smallstep host used when connecting.
+        env:
+        - name: SMALLSTEP_API_HOST
+        type: str
+    dest:
+        description:
+            - Directory the files are written to. It is created if it does not exist.
+        required: true
+        type: path
+    format:
+        description:
+            - C(yaml) writes one variables file per variable, usable with C(vars_files) or in C(group_vars).
+            - C(jsonl) writes one JSON object per line, for processing with other tools.
+        choices: [ yaml, jsonl ]
+        default: yaml
+        type: str
+    collections:
+        description:
+            - Slugs of the collections to export. All collections of the team when unset.
+        type: list
+        elements: str
+    workloads:
+        description:
+            - Workloads to export from the exported collections.
+        type: list
+        elements: dict
+        default: []
+        suboptions:
+            collection_slug:
+                description:
+                    - The slug of the collection.
+                required: true
+                type: str
+            workload_slug:
+                description:
+                    - The slug of the workload.
+                required: true
+                type: str
+    instances:
+        description:
+            - Whether to export the instances of the collections.
+        default: true
+        type: bool
+    page_size:
+        description:
+            - Number of items requested per page.
+        default: 100
+        type: int
+    max_workers:
+        description:
+            - Number of collections exported concurrently, or the most with I(adaptive_concurrency).
+        default: 8
+        type: int
+    adaptive_concurrency:
+        description:
+            - Adjust the number of collections in flight to the API while the run goes, from the latency and status
+              code of every API call, instead of keeping I(max_workers) busy.
+            - The limit grows while calls are fast and answered, is halved on C(429), C(502), C(503), C(504) and
+              failed connections, and shrinks when latency climbs to twice its recent low. It never exceeds
+              I(max_workers).
+        env:
+        - name: SMALLSTEP_ADAPTIVE_CONCURRENCY
+        default: false
+        type: bool
+"""
+
+EXAMPLES = """
+- name: Export the team's collections and instances into group_vars
+  smallstep.agent.export:
+    dest: "{{ inventory_dir }}/group_vars/all"
+    workloads:
+      - collection_slug: hotdog-staging
+        workload_slug: nginx
+  delegate_to: localhost
+  run_once: True
+"""
+
+RETURN = """
+files:
+    description: The files of each variable, the number of items in them and whether they changed.
+    returned: success
+    type: dict
+    sample:
+      smallstep_collections:
+        path: group_vars/all/smallstep_collections.yml
+        count: 12
+        changed: true
+      smallstep_workloads:
+        path: group_vars/all/smallstep_workloads.yml
+        count: 1
+        changed: false
+unmanaged_collections:
+    description: Slugs of the collections that are not device collections.
+    returned: success
+    type: list
+    elements: str
+concurrency:
+    description:
+        - The in-flight limit that I(adaptive_concurrency) converged on, its ceiling, the most collections that were
+          in flight at once, and the number of times the limit was decreased.
+    returned: when I(adaptive_concurrency) is set
+    type: dict
+    sample:
+      ceiling: 8
+      limit: 5
+      peak: 6
+      decreases: 1
+team:
+    description: The Smallstep team of the API token.
+    returned: success
+    type: str
+"""
+
+import hashlib  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import shutil  # noqa: E402
+import tempfile  # noqa: E402
+
+import yaml  # noqa: E402
+from ansible.module_utils.basic import AnsibleModule, env_fallback  # noqa: E402
+from smallstep import api as step  # noqa: E402
+from smallstep.api_client.api.collections import list_collection_instances, list_collections  # noqa: E402
+from smallstep.api_client.models.list_collection_instances_pagination import (  # noqa: E402
+    ListCollectionInstancesPagination,
+)
+from smallstep.api_client.models.list_collections_pagination import ListCollectionsPagination  # noqa: E402
+from smallstep.exceptions import StepException  # noqa: E402
+
+from ..module_utils.agent import AnsibleStep  # noqa: E402
+from ..module_utils.argument_specs import collection_argument_spec, workload_argument_spec  # noqa: E402
+from ..module_utils.bulk import BulkRunner  # noqa: E402
+from ..module_utils.models import Instance, snake_dict  # noqa: E402
+from ..module_utils.profiling import profiled  # noqa: E402
+
+# An export reads every object and applies nothing, so there is no manifest to replay or shard to split
+UNUSED_BASE_ARGS = ("manifest", "manifest_sweep_interval", "shard_index", "shard_count")
+
+# Variables of the configure role, in the order their files are written
+VARIABLES = ("smallstep_collections", "smallstep_workloads", "smallstep_collection_instances")
+
+
+def shape(value, options):
+    """Keep the keys of an API object that are module arguments, in argument spec order, without None values"""
+    shaped = {}
+    for name, spec in options.items():
+        if value.get(name) is None:
+            continue
+        if spec.get("type") == "dict" and "options" in spec and isinstance(value[name], dict):
+            shaped[name] = shape(value[name], spec["options"])
+        else:
+            shaped[name] = value[name]
+    return shaped
+
+
+def collection_params(response):
+    """Arguments of the collection module for a device collection response"""
+    response = snake_dict(response)
+    device_type = response["device_type"].replace("-", "_")
+    device_type_options = collection_argument_spec()["device_type"]["options"][device_type]["options"]
+    return {
+        "collection_slug": response["slug"],
+        "display_name": response["display_name"],
+        "admin_emails": response.get("admin_emails") or [],
+        "device_type": {device_type: shape(response["device_type_configuration"], device_type_options)},
+        "state": "present",
+    }
+
+
+def workload_params(collection_slug, admin_emails, response):
+    """Arguments of the workload module for a workload response"""
+    response = snake_dict(response)
+    params = {"collection_slug": collection_slug, "workload_slug": response["slug"]}
+    params.update(shape(dict(response, admin_emails=admin_emails), workload_argument_spec()))
+    params["state"] = "present"
+    return params
+
+
+def instance_params(collection_slug, response):
+    """Arguments of the instance module for an instance response"""
+    instance = Instance.from_api(response)
+    return {
+        "collection_slug": collection_slug,
+        "instance_id": instance.id,
+        "instance_metadata": instance.data,
+        "state": "present",
+    }
+
+
+class ExportFile:
+    """Streams the items of one variable to a file, through per-collection part files
+
+    Workers append serialized items to their own part file in ``workdir``.
+    ``commit`` joins the parts in collection order into the destination, and
+    only replaces it when the SHA-256 of the new content differs.
+    """
+
+    def __init__(self, variable, dest, fmt, workdir):
+        self.variable = variable
+        self.fmt = fmt
+        self.workdir = workdir
+        self.path = os.path.join(dest, variable + (".yml" if fmt == "yaml" else ".jsonl"))
+        self.counts = {}
+
+    def _part(self, index):
+        return os.path.join(self.workdir, f"{self.variable}-{index:08d}")
+
+    def append(self, index, items):
+        """Write a batch of items of the collection at ``index``"""
+        if not items:
+            return
+        with open(self._part(index), "a") as f:
+            if self.fmt == "yaml":
+                f.write(yaml.safe_dump(items, default_flow_style=False, sort_keys=False, allow_unicode=True))
+            else:
+                for item in items:
+                    f.write(json.dumps(item, sort_keys=False) + "\n")
+        self.counts[index] = self.counts.get(index, 0) + len(items)
+
+    def count(self):
+        return sum(self.counts.values())
+
+    def commit(self, check_mode):
+        """Join the parts and replace the destination when its content changed
+
+        :return: whether the destination changed
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.workdir, prefix=self.variable)
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as out:
+
+            def write(data):
+                digest.update(data)
+                out.write(data)
+
+            if self.fmt == "yaml":
+                write(f"{self.variable}:{'' if self.count() else ' []'}\n".encode())
+            for index in sorted(self.counts):
+                with open(self._part(index), "rb") as part:
+                    for chunk in iter(lambda: part.read(65536), b""):
+                        write(chunk)
+
+        current = hashlib.sha256()
+        try:
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    current.update(chunk)
+        except FileNotFoundError:
+            current = None
+        if current is not None and current.digest() == digest.digest():
+            return False
+        if not check_mode:
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        return True
+
+
+class AnsibleStepExport(AnsibleStep):
+    def __init__(self, module):
+        super().__init__(module, "files")
+        self.files = None
+        self.outputs = None
+        self.unmanaged = []
+
+        self.api_host = self.module.params.get("api_host")
+        self.connectargs = {
+            "smallstep_api_host": f"https://{self.api_host}/api",
+            "smallstep_api_token": self.module.params.get("api_token"),
+        }
+
+    def collection_slugs(self):
+        if self.module.params.get("collections") is not None:
+            return self.module.params.get("collections")
+        collections = self._sdk(step.StepCollection)
+        return [
+            collection.slug
+            for collection in self._pages(
+                "collection.list",
+                collections,
+                list_collections,
+                ListCollectionsPagination,
+                self.module.params.get("page_size"),
+            )
+        ]
+
+    @staticmethod
+    def describe(item):
+        return {"collection_slug": item[1]}
+
+    def export_collection(self, item):
+        index, slug = item
+        collections, workloads, instances = self.outputs
+        admin_emails = []
+
+        device_collection = self._sdk(step.StepDeviceCollection)
+        try:
+            response = self._call("collection.get", device_collection.get, collection_slug=slug).to_dict()
+        except StepException as exception:
+            if exception.status_code != 404:
+                raise
+            self.unmanaged.append(slug)
+        else:
+            params = collection_params(response)
+            admin_emails = params["admin_emails"]
+            collections.append(index, [params])
+
+        workload = self._sdk(step.StepWorkload)
+        for wanted in self.module.params.get("workloads"):
+            if wanted["collection_slug"] != slug:
+                continue
+            try:
+                response = self._call(
+                    "workload.get", workload.get, workload_slug=wanted["workload_slug"], collection_slug=slug
+                ).to_dict()
+            except StepException as exception:
+                if exception.status_code != 404:
+                    raise
+                continue
+            workloads.append(index, [workload_params(slug, admin_emails, response)])
+
+        if self.module.params.get("instances"):
+            collection = self._sdk(step.StepCollection)
+            batch = []
+            for instance in self._pages(
+                "instance.list",
+                collection,
+                list_collection_instances,
+                ListCollectionInstancesPagination,
+                self.module.params.get("page_size"),
+                collection_slug=slug,
+            ):
+                batch.append(instance_params(slug, instance.to_dict()))
+                if len(batch) >= self.module.params.get("page_size"):
+                    instances.append(index, batch)
+                    batch = []
+            instances.append(index, batch)
+
+        return {"collection_slug": slug}
+
+    def export(self):
+        dest = self.module.params.get("dest")
+        os.makedirs(dest, exist_ok=True)
+        self.api_info(connectargs=self.connectargs)
+        slugs = self.collection_slugs()
+
+        workdir = tempfile.mkdtemp(dir=dest, prefix=".export")
+        try:
+            self.outputs = [
+                ExportFile(variable, dest, self.module.params.get("format"), workdir) for variable in VARIABLES
+            ]
+            limit = self.adaptive_limit(self.module.params.get("max_workers"))
+            runner = BulkRunner(self.module.params.get("max_workers"), limit=limit)
+            self.fail_fast = False
+            try:
+                outcomes = runner.run(list(enumerate(slugs)), self.export_collection, self.describe)
+            finally:
+                self.fail_fast = True
+            if limit is not None:
+                self.result["concurrency"] = limit.as_dict()
+            failed = [outcome for outcome in outcomes if outcome.get("failed")]
+            if failed:
+                self.module.fail_json(
+                    msg=f"{len(failed)} of {len(slugs)} collections failed to export",
+                    collections=failed,
+                    **self.get_result(),
+                )
+
+            self.files = {}
+            for output in self.outputs:
+                changed = output.commit(self.module.check_mode)
+                self.files[output.variable] = {"path": output.path, "count": output.count(), "changed": changed}
+                if changed:
+                    self._mark_changed()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _prep_result(self):
+        return self.files
+
+    def get_result(self):
+        result = super().get_result()
+        result["unmanaged_collections"] = sorted(self.unmanaged)
+        result["team"] = self.api_info(connectargs=self.connectargs)["team"]
+        return result
+
+    @classmethod
+    def define_module(cls):
+        return AnsibleModule(
+            argument_spec=dict(
+                dest=dict(type="path", required=True),
+                format=dict(type="str", default="yaml", choices=["yaml", "jsonl"]),
+                collections=dict(type="list", elements="str"),
+                workloads=dict(
+                    type="list",
+                    elements="dict",
+                    default=[],
+                    options=dict(
+                        collection_slug=dict(type="str", required=True),
+                        workload_slug=dict(type="str", required=True),
+                    ),
+                ),
+                instances=dict(type="bool", default=True),
+                page_size=dict(type="int", default=100),
+                max_workers=dict(type="int", default=8),
+                adaptive_concurrency=dict(
+                    type="bool", default=False, fallback=(env_fallback, ["SMALLSTEP_ADAPTIVE_CONCURRENCY"])
+                ),
+                **{k: v for k, v in super().base_module_args().items() if k not in UNUSED_BASE_ARGS},
+            ),
+            supports_check_mode=True,
+        )
+
+
+@profiled("export")
+def main():
+    module = AnsibleStepExport.define_module()
+
+    agent = AnsibleStepExport(module)
+    agent.export()
+    module.exit_json(**agent.get_result())
+
+
+if __name__ == "__main__":
+    main()
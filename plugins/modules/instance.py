@@ -16,11 +16,18 @@ description:
 author:
     - Joe Doss (@jdoss)
 
+extends_documentation_fragment:
+    - smallstep.agent.state_cache
+    - smallstep.agent.manifest
+    - smallstep.agent.rate_limit
+    - smallstep.agent.transport
+    - smallstep.agent.sharding
+
 options:
     api_token:
         description:
         - The Smallstep API Token used when connecting.
-        - Required.
+        - Required unless the task runs over the C(ansible.netcommon.httpapi) connection with the C(smallstep.agent.smallstep) plugin, which holds the token.
         env:
         - name: SMALLSTEP_API_TOKEN
         type: str
@@ -108,6 +115,10 @@ from smallstep import api as step  # noqa: E402
 from smallstep.exceptions import StepException  # noqa: E402
 
 from ..module_utils.agent import AnsibleStep  # noqa: E402
+from ..module_utils.argument_specs import INSTANCE_REQUIRED_IF, instance_argument_spec  # noqa: E402
+from ..module_utils.models import Instance  # noqa: E402
+from ..module_utils.profiling import profiled  # noqa: E402
+from ..module_utils.sharding import shard_key  # noqa: E402
 
 
 class AnsibleStepInstance(AnsibleStep):
@@ -132,30 +143,38 @@ class AnsibleStepInstance(AnsibleStep):
             "response": self.smallstep_instance,
         }
 
+    def _cache_key(self):
+        return f"{self.module.params.get('collection_slug')}/{self.module.params.get('instance_id')}"
+
     def _get_instance(self):
         self.module.fail_on_missing_params(required_params=["collection_slug", "instance_id"])
+        cached = self._cache_get("instance", self._cache_key())
+        if cached is not None:
+            self.smallstep_instance = cached
+            return
+
         try:
             if self.module.params.get("collection_slug") and self.module.params.get("instance_id") is not None:
-                instance = step.StepCollection(**self.connectargs)
-                res = instance.get_instance(
+                instance = self._sdk(step.StepCollection)
+                res = self._call(
+                    "instance.get",
+                    instance.get_instance,
                     collection_slug=self.module.params.get("collection_slug"),
                     instance_id=self.module.params.get("instance_id"),
                 ).to_dict()
                 self.smallstep_instance = res
+                self._cache_put("instance", self._cache_key(), res)
 
         except StepException as exception:
             if exception.status_code == 404:
                 self.smallstep_instance = None
+                self._cache_invalidate("instance", self._cache_key())
                 return
             if exception.status_code == 409:
                 self.smallstep_instance = res
                 return
             else:
-                self.fail_json(
-                    status_code=exception.status_code,
-                    headers=exception.headers,
-                    message=exception.message,
-                )
+                self.fail_json(exception)
 
     def _create_instance(self):
         self.module.fail_on_missing_params(required_params=["collection_slug", "instance_metadata", "instance_id"])
@@ -168,45 +187,42 @@ class AnsibleStepInstance(AnsibleStep):
 
         if not self.module.check_mode:
             try:
-                instance = step.StepCollection(**self.connectargs)
-                instance.create_instance(
+                instance = self._sdk(step.StepCollection)
+                self._call(
+                    "instance.create",
+                    instance.create_instance,
                     collection_slug=params["collection_slug"],
                     instance_metadata=params["instance_metadata"],
                     instance_id=params["instance_id"],
                 ).to_dict()
                 self._mark_changed()
+                self._cache_invalidate("instance", self._cache_key())
                 self._get_instance()
             except StepException as exception:
-                self.fail_json(
-                    status_code=exception.status_code,
-                    headers=exception.headers,
-                    message=exception.message,
-                )
+                self.fail_json(exception)
 
     def _update_instance(self):
         self.module.fail_on_missing_params(required_params=["instance_metadata", "collection_slug"])
 
         new_data = self.module.params.get("instance_metadata")
-        old_data = self.smallstep_instance["data"]
-        old_data.pop("smallstep:host:id", None)
+        current = Instance.from_api(self.smallstep_instance)
 
-        if new_data is not None and old_data != new_data:
+        if new_data is not None and current != Instance.from_params(self.module.params):
             if not self.module.check_mode:
                 try:
-                    instance = step.StepCollection(**self.connectargs)
-                    instance.update_instance(
+                    instance = self._sdk(step.StepCollection)
+                    self._call(
+                        "instance.update",
+                        instance.update_instance,
                         collection_slug=self.module.params.get("collection_slug"),
                         instance_id=self.module.params.get("instance_id"),
                         instance_metadata=new_data,
                     )
                     self._mark_changed()
+                    self._cache_invalidate("instance", self._cache_key())
                     self._get_instance()
                 except StepException as exception:
-                    self.fail_json(
-                        status_code=exception.status_code,
-                        headers=exception.headers,
-                        message=exception.message,
-                    )
+                    self.fail_json(exception)
 
     def check_instance(self):
         self._get_instance()
@@ -221,57 +237,50 @@ class AnsibleStepInstance(AnsibleStep):
         if self.smallstep_instance is not None:
             if not self.module.check_mode:
                 try:
-                    instance = step.StepCollection(**self.connectargs)
-                    instance.destroy_instance(
+                    instance = self._sdk(step.StepCollection)
+                    self._call(
+                        "instance.destroy",
+                        instance.destroy_instance,
                         collection_slug=self.module.params.get("collection_slug"),
                         instance_id=self.module.params.get("instance_id"),
                     )
                     self._mark_changed()
+                    self._cache_invalidate("instance", self._cache_key())
                     self._get_instance()
                 except StepException as exception:
-                    self.fail_json(
-                        status_code=exception.status_code,
-                        headers=exception.headers,
-                        message=exception.message,
-                    )
+                    self.fail_json(exception)
 
     @classmethod
     def define_module(cls):
         return AnsibleModule(
             argument_spec=dict(
-                collection_slug=dict(type="str", required=True),
-                instance_id=dict(type="str", required=True),
-                instance_metadata=dict(type="dict", default={}),
-                state=dict(type="str", default="present", choices=["absent", "present"]),
+                **instance_argument_spec(),
                 **super().base_module_args(),
             ),
-            required_if=[
-                [
-                    "state",
-                    "present",
-                    [
-                        "instance_id",
-                        "instance_metadata",
-                        "collection_slug",
-                    ],
-                ],
-                ["state", "absent", ["collection_slug", "instance_id"]],
-            ],
+            required_if=INSTANCE_REQUIRED_IF,
             supports_check_mode=True,
         )
 
 
+@profiled("instance")
 def main():
     module = AnsibleStepInstance.define_module()
 
     agent = AnsibleStepInstance(module)
+    if agent.foreign(shard_key(module.params.get("collection_slug"), module.params.get("instance_id"))):
+        module.exit_json(skipped=True, msg="owned by another shard", **agent.get_result())
+    if agent.replay("instance", agent._cache_key()):
+        module.exit_json(**agent.get_result())
+
     state = module.params.get("state")
     if state == "absent":
         agent.destroy_instance()
     elif state == "present":
         agent.check_instance()
 
-    module.exit_json(**agent.get_result())
+    result = agent.get_result()
+    agent.record("instance", agent._cache_key())
+    module.exit_json(**result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,419 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+module: instances
+
+short_description: Manage many Smallstep collection instances in one run
+
+description:
+    - Reconciles a list of Smallstep collection instances concurrently in a single module run.
+    - Failed instances are reported together once every instance has been processed.
+    - The action plugin of the same name collects the instances of every host in the play from a host
+      variable, so registration cost scales with API concurrency instead of a serial per-host loop.
+
+author:
+    - Smallstep Engineering
+
+extends_documentation_fragment:
+    - smallstep.agent.state_cache
+    - smallstep.agent.manifest
+    - smallstep.agent.rate_limit
+    - smallstep.agent.transport
+    - smallstep.agent.sharding
+
+options:
+    api_token:
+        description:
+        - The Smallstep API Token used when connecting.
+        - Required unless the task runs over the C(ansible.netcommon.httpapi) connection with the C(smallstep.agent.smallstep) plugin, which holds the token.
+        env:
+        - name: SMALLSTEP_API_TOKEN
+        type: str
+    api_host:
+        description: The Smallstep host used when connecting.
+        env:
+        - name: SMALLSTEP_API_HOST
+        type: str
+    instances:
+        description:
+            - The collection instances to manage.
+        type: list
+        elements: dict
+        default: []
+        suboptions:
+            collection_slug:
+                description:
+                    - The slug of the collection.
+                required: true
+                type: str
+            instance_id:
+                description:
+                    - The ID of the instance.
+                required: true
+                type: str
+            instance_metadata:
+                description:
+                    - The instance data.
+                type: dict
+                default: {}
+            state:
+                description:
+                    - State of the instance.
+                default: present
+                choices: [ absent, present ]
+                type: str
+    host_var:
+        description:
+            - Name of a host variable holding one instance in the format of I(instances).
+            - The action plugin adds the value of this variable for every host in C(ansible_play_batch), the hosts of the
+              current C(serial) batch, to I(instances).
+            - Hosts where the variable is undefined are skipped.
+        type: str
+    max_workers:
+        description:
+            - Number of instances reconciled concurrently, or the most with I(adaptive_concurrency).
+        default: 8
+        type: int
+    adaptive_concurrency:
+        description:
+            - Adjust the number of instances in flight to the API while the run goes, from the latency and status
+              code of every API call, instead of keeping I(max_workers) busy.
+            - The limit grows while calls are fast and answered, is halved on C(429), C(502), C(503), C(504) and
+              failed connections, and shrinks when latency climbs to twice its recent low. It never exceeds
+              I(max_workers).
+        env:
+        - name: SMALLSTEP_ADAPTIVE_CONCURRENCY
+        default: false
+        type: bool
+    checkpoint:
+        description:
+            - Path of a journal on the controller where each instance is recorded as soon as it has been reconciled,
+              together with the hash of its desired state.
+            - The journal is removed when every instance succeeded. When instances fail, or the run is interrupted,
+              it is kept for I(resume).
+            - Use one journal per task. Not used in check mode.
+        env:
+        - name: SMALLSTEP_CHECKPOINT
+        type: path
+    resume:
+        description:
+            - Skip the instances that the I(checkpoint) journal of an earlier run shows as completed with the same
+              desired state, and reconcile only the rest. They are returned as unchanged, with C(resumed) set.
+            - Without it, an existing journal is discarded and the run starts over.
+        env:
+        - name: SMALLSTEP_RESUME
+        default: false
+        type: bool
+"""
+
+EXAMPLES = """
+- name: Derive the Smallstep collection instance of each host from its facts
+  ansible.builtin.set_fact:
+    smallstep_host_instance:
+      collection_slug: hotdog-staging
+      instance_id: "{{ ansible_machine_id }}"
+      instance_metadata:
+        name: "{{ ansible_hostname }}"
+
+- name: Register the Smallstep collection instances of all hosts in one call
+  smallstep.agent.instances:
+    host_var: smallstep_host_instance
+    api_token: "eyJUzI1NiI..."
+  delegate_to: localhost
+  run_once: True
+"""
+
+RETURN = """
+instances:
+    description:
+        - Outcome for each instance, in the order of I(instances).
+        - C(replayed) marks instances that were skipped because the manifest shows them as already applied.
+        - C(resumed) marks instances that were skipped because the I(checkpoint) journal shows them as completed.
+    returned: Always
+    type: list
+    elements: dict
+    sample:
+      - collection_slug: hotdog-staging
+        instance_id: i-0d69ab001748ab4444
+        action: created
+        changed: true
+      - collection_slug: hotdog-staging
+        instance_id: i-0d69ab001748ab5555
+        action: unchanged
+        changed: false
+        replayed: true
+shard:
+    description:
+        - The shard of this run and the number of instances that were skipped because another shard owns them.
+        - Only instances owned by this shard are reconciled and listed in I(instances).
+    returned: success
+    type: dict
+    sample:
+      index: 0
+      count: 4
+      skipped: 372
+checkpoint:
+    description: The path of the I(checkpoint) journal, and the number of instances resumed from it and recorded in it.
+    returned: when I(checkpoint) is set, outside of check mode
+    type: dict
+    sample:
+      path: /home/ansible/.cache/smallstep/instances.journal
+      resumed: 6000
+      recorded: 3000
+concurrency:
+    description:
+        - The in-flight limit that I(adaptive_concurrency) converged on, its ceiling, the most instances that were
+          in flight at once, and the number of times the limit was decreased.
+    returned: when I(adaptive_concurrency) is set
+    type: dict
+    sample:
+      ceiling: 32
+      limit: 14
+      peak: 21
+      decreases: 3
+team:
+    description: The Smallstep team of the API token.
+    returned: success
+    type: str
+fingerprint:
+    description: The fingerprint of the team's agents authority.
+    returned: success
+    type: str
+"""
+
+# noqa: E402
+import hashlib  # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback  # noqa: E402
+from smallstep import api as step  # noqa: E402
+from smallstep.exceptions import StepException  # noqa: E402
+
+from ..module_utils.agent import AnsibleStep  # noqa: E402
+from ..module_utils.bulk import BulkRunner  # noqa: E402
+from ..module_utils.checkpoint import Checkpoint  # noqa: E402
+from ..module_utils.models import Instance  # noqa: E402
+from ..module_utils.profiling import profiled  # noqa: E402
+from ..module_utils.sharding import shard_key  # noqa: E402
+
+
+class AnsibleStepInstances(AnsibleStep):
+    def __init__(self, module):
+        super().__init__(module, "instances")
+        self.instances = None
+        self.checkpoint = None
+
+        self.api_host = self.module.params.get("api_host")
+        self.connectargs = {
+            "smallstep_api_host": f"https://{self.api_host}/api",
+            "smallstep_api_token": self.module.params.get("api_token"),
+        }
+        if module.params.get("checkpoint") and not module.check_mode:
+            token = module.params.get("api_token") or ""
+            self.checkpoint = Checkpoint(
+                module.params.get("checkpoint"),
+                self.api_host,
+                hashlib.sha256(token.encode()).hexdigest(),
+                module.params.get("resume"),
+            )
+
+    def _get_instance(self, collection_slug, instance_id):
+        key = f"{collection_slug}/{instance_id}"
+        cached = self._cache_get("instance", key)
+        if cached is not None:
+            return cached
+
+        try:
+            instance = self._sdk(step.StepCollection)
+            res = self._call(
+                "instance.get",
+                instance.get_instance,
+                collection_slug=collection_slug,
+                instance_id=instance_id,
+            ).to_dict()
+        except StepException as exception:
+            if exception.status_code == 404:
+                self._cache_invalidate("instance", key)
+                return None
+            raise
+        self._cache_put("instance", key, res)
+        return res
+
+    @staticmethod
+    def describe(item):
+        return {"collection_slug": item["collection_slug"], "instance_id": item["instance_id"]}
+
+    def reconcile(self, item):
+        collection_slug = item["collection_slug"]
+        instance_id = item["instance_id"]
+        key = f"{collection_slug}/{instance_id}"
+        outcome = dict(self.describe(item), changed=False)
+
+        current = self._get_instance(collection_slug, instance_id)
+        instance = self._sdk(step.StepCollection)
+
+        if item["state"] == "absent":
+            outcome["action"] = "unchanged"
+            if current is not None:
+                if not self.module.check_mode:
+                    self._call(
+                        "instance.destroy",
+                        instance.destroy_instance,
+                        collection_slug=collection_slug,
+                        instance_id=instance_id,
+                    )
+                    self._cache_invalidate("instance", key)
+                outcome.update(changed=True, action="deleted")
+            return outcome
+
+        new_data = item["instance_metadata"]
+        if current is None:
+            if not self.module.check_mode:
+                self._call(
+                    "instance.create",
+                    instance.create_instance,
+                    collection_slug=collection_slug,
+                    instance_metadata=new_data,
+                    instance_id=instance_id,
+                )
+                self._cache_invalidate("instance", key)
+            outcome.update(changed=True, action="created")
+            return outcome
+
+        if Instance.from_api(current) != Instance.from_params(item):
+            if not self.module.check_mode:
+                self._call(
+                    "instance.update",
+                    instance.update_instance,
+                    collection_slug=collection_slug,
+                    instance_id=instance_id,
+                    instance_metadata=new_data,
+                )
+                self._cache_invalidate("instance", key)
+            outcome.update(changed=True, action="updated")
+            return outcome
+
+        outcome["action"] = "unchanged"
+        return outcome
+
+    def _replay(self, item):
+        """Outcome of an item whose desired state was applied before, or None"""
+        if self.manifest is None:
+            return None
+        entry = self.manifest.get("instance", f"{item['collection_slug']}/{item['instance_id']}", item)
+        if entry is None:
+            return None
+        if self._api_info is None:
+            self._api_info = entry["api_info"]
+        return dict(self.describe(item), changed=False, action="unchanged", replayed=True)
+
+    def _record(self, items, outcomes):
+        if self.manifest is None or self.module.check_mode:
+            return
+        for item, outcome in zip(items, outcomes):
+            if not outcome.get("failed"):
+                key = f"{item['collection_slug']}/{item['instance_id']}"
+                self.manifest.put("instance", key, item, {"api_info": self._api_info})
+
+    def reconcile_all(self):
+        items = []
+        for item in self.module.params.get("instances"):
+            if self.shard.owns(shard_key(item["collection_slug"], item["instance_id"])):
+                items.append(item)
+        self.result["shard"] = {
+            "index": self.shard.index,
+            "count": self.shard.count,
+            "skipped": len(self.module.params.get("instances")) - len(items),
+        }
+
+        self.instances = [self._replay(item) for item in items]
+        pending = [item for item, outcome in zip(items, self.instances) if outcome is None]
+        if pending:
+            # Resolve the team once up front instead of racing for it in every
+            # worker thread.
+            self.api_info(connectargs=self.connectargs)
+
+            limit = self.adaptive_limit(self.module.params.get("max_workers"))
+            runner = BulkRunner(
+                self.module.params.get("max_workers"),
+                checkpoint=self.checkpoint,
+                key=lambda item: f"{item['collection_slug']}/{item['instance_id']}",
+                limit=limit,
+            )
+            self.fail_fast = False
+            try:
+                outcomes = runner.run(pending, self.reconcile, self.describe)
+            finally:
+                self.fail_fast = True
+            if limit is not None:
+                self.result["concurrency"] = limit.as_dict()
+            self._record(pending, outcomes)
+            applied = iter(outcomes)
+            self.instances = [outcome or next(applied) for outcome in self.instances]
+        if any(outcome.get("changed") for outcome in self.instances):
+            self._mark_changed()
+        if self.checkpoint is not None:
+            self.result["checkpoint"] = self.checkpoint.stats()
+            if any(outcome.get("failed") for outcome in self.instances):
+                self.checkpoint.close()
+            else:
+                self.checkpoint.complete()
+
+    def get_result(self):
+        result = super().get_result()
+        api_info = self.api_info(connectargs=self.connectargs)
+        result["team"] = api_info["team"]
+        result["fingerprint"] = api_info["fingerprint"]
+        return result
+
+    def _prep_result(self):
+        return self.instances
+
+    @classmethod
+    def define_module(cls):
+        return AnsibleModule(
+            argument_spec=dict(
+                instances=dict(
+                    type="list",
+                    elements="dict",
+                    default=[],
+                    options=dict(
+                        collection_slug=dict(type="str", required=True),
+                        instance_id=dict(type="str", required=True),
+                        instance_metadata=dict(type="dict", default={}),
+                        state=dict(type="str", default="present", choices=["absent", "present"]),
+                    ),
+                ),
+                host_var=dict(type="str"),
+                max_workers=dict(type="int", default=8),
+                adaptive_concurrency=dict(
+                    type="bool", default=False, fallback=(env_fallback, ["SMALLSTEP_ADAPTIVE_CONCURRENCY"])
+                ),
+                checkpoint=dict(type="path", fallback=(env_fallback, ["SMALLSTEP_CHECKPOINT"])),
+                resume=dict(type="bool", default=False, fallback=(env_fallback, ["SMALLSTEP_RESUME"])),
+                **super().base_module_args(),
+            ),
+            supports_check_mode=True,
+        )
+
+
+@profiled("instances")
+def main():
+    module = AnsibleStepInstances.define_module()
+
+    agent = AnsibleStepInstances(module)
+    agent.reconcile_all()
+
+    result = agent.get_result()
+    failed = [outcome for outcome in result["instances"] if outcome.get("failed")]
+    if failed:
+        module.fail_json(msg=f"{len(failed)} of {len(result['instances'])} instances failed", **result)
+    module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+module: package_mirror
+
+short_description: Build apt and yum repository metadata for a local step-agent-plugin mirror
+
+description:
+    - Adds packages, usually verified copies from the M(smallstep.agent.verified_artifact) cache, to a mirror
+      directory and regenerates its repository metadata when the set of packages changed.
+    - C(.deb) packages go to a flat apt repository under C(deb/), which hosts use with
+      C(deb [trusted=yes] <url>/deb ./), or without C(trusted=yes) when I(signing_key) is set.
+    - C(.rpm) packages go to a yum repository under C(rpm/), which hosts use with C(baseurl=<url>/rpm).
+    - Packages are stored by SHA-256 digest, so every version added to the mirror stays installable until
+      I(prune) removes it.
+    - Serve I(path) with any static web server.
+
+author:
+    - Smallstep Engineering
+
+requirements:
+    - dpkg-scanpackages or apt-ftparchive, for C(.deb) packages
+    - createrepo_c or createrepo, for C(.rpm) packages
+    - gpg, when I(signing_key) is set
+
+options:
+    path:
+        description:
+            - Root directory of the mirror.
+        required: true
+        type: path
+    packages:
+        description:
+            - Paths of C(.deb) and C(.rpm) packages to add to the mirror.
+        required: true
+        type: list
+        elements: path
+    prune:
+        description:
+            - Remove packages from the mirror that are not in I(packages).
+        default: false
+        type: bool
+    signing_key:
+        description:
+            - GPG key ID to sign the repository metadata with, C(InRelease) and C(Release.gpg) for apt and
+              C(repomd.xml.asc) for yum.
+            - The metadata is not signed when unset.
+        type: str
+"""
+
+EXAMPLES = """
+- name: Build the step-agent-plugin mirror from the verified packages
+  smallstep.agent.package_mirror:
+    path: /srv/mirror/step-agent
+    packages: "{{ step_agent_verified_artifacts.results | map(attribute='path') | list }}"
+  delegate_to: localhost
+  run_once: True
+"""
+
+RETURN = """
+deb:
+    description: Packages of the apt repository, relative to C(deb/).
+    returned: success
+    type: list
+    elements: str
+    sample: [pool/9f86d0.../step-agent-plugin_amd64.deb]
+rpm:
+    description: Packages of the yum repository, relative to C(rpm/).
+    returned: success
+    type: list
+    elements: str
+regenerated:
+    description: Repository formats whose metadata was regenerated.
+    returned: success
+    type: list
+    elements: str
+    sample: [deb]
+"""
+
+import email.utils  # noqa: E402
+import gzip  # noqa: E402
+import hashlib  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import shutil  # noqa: E402
+import tempfile  # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+
+from ..module_utils.artifacts import sha256_file  # noqa: E402
+
+FORMATS = ("deb", "rpm")
+STATE_FILE = "mirror.json"
+
+
+class PackageMirror:
+    def __init__(self, module):
+        self.module = module
+        self.path = module.params.get("path")
+        self.signing_key = module.params.get("signing_key")
+        self.changed = False
+
+    def write(self, path, data):
+        # Hosts may be reading the metadata while it is rebuilt
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".mirror")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    def _run(self, args, cwd):
+        rc, out, err = self.module.run_command(args, cwd=cwd)
+        if rc != 0:
+            self.module.fail_json(msg=f"{' '.join(args)} failed: {err.strip() or out.strip()}")
+        return out
+
+    def _sign(self, cwd, args):
+        if self.signing_key:
+            gpg = self.module.get_bin_path("gpg", required=True)
+            self._run([gpg, "--batch", "--yes", "--local-user", self.signing_key] + args, cwd)
+
+    def pool(self, fmt):
+        """Packages of a repository, relative to its directory, sorted"""
+        root = os.path.join(self.path, fmt)
+        found = []
+        for directory, _dirs, files in os.walk(os.path.join(root, "pool")):
+            for name in files:
+                if name.endswith("." + fmt):
+                    found.append(os.path.relpath(os.path.join(directory, name), root))
+        return sorted(found)
+
+    def add(self, package):
+        """Store a package under its digest
+
+        :return: format of the package, and its path relative to the repository directory
+        """
+        fmt = package.rsplit(".", 1)[-1]
+        if fmt not in FORMATS:
+            self.module.fail_json(msg=f"{package} is neither a .deb nor a .rpm package")
+        relative = os.path.join("pool", sha256_file(package), os.path.basename(package))
+        dest = os.path.join(self.path, fmt, relative)
+        if not os.path.exists(dest):
+            self.changed = True
+            if not self.module.check_mode:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                try:
+                    os.link(package, dest)
+                except OSError:
+                    shutil.copy2(package, dest)
+                os.chmod(dest, 0o644)
+        return fmt, relative
+
+    def prune(self, keep):
+        for fmt in FORMATS:
+            for relative in self.pool(fmt):
+                if (fmt, relative) in keep:
+                    continue
+                self.changed = True
+                if not self.module.check_mode:
+                    path = os.path.join(self.path, fmt, relative)
+                    os.remove(path)
+                    os.rmdir(os.path.dirname(path))
+
+    def index_deb(self):
+        root = os.path.join(self.path, "deb")
+        scanner = self.module.get_bin_path("dpkg-scanpackages")
+        if scanner:
+            packages = self._run([scanner, "--multiversion", "pool", "/dev/null"], root)
+        else:
+            packages = self._run([self.module.get_bin_path("apt-ftparchive", required=True), "packages", "pool"], root)
+        packages = packages.encode()
+        compressed = gzip.compress(packages, mtime=0)
+        self.write(os.path.join(root, "Packages"), packages)
+        self.write(os.path.join(root, "Packages.gz"), compressed)
+
+        release = [
+            "Origin: step-agent-plugin mirror",
+            "Label: step-agent-plugin",
+            f"Date: {email.utils.formatdate(usegmt=True)}",
+            "SHA256:",
+        ]
+        for name, data in (("Packages", packages), ("Packages.gz", compressed)):
+            release.append(f" {hashlib.sha256(data).hexdigest()} {len(data)} {name}")
+        self.write(os.path.join(root, "Release"), ("\n".join(release) + "\n").encode())
+        self._sign(root, ["--clearsign", "--output", "InRelease", "Release"])
+        self._sign(root, ["--armor", "--detach-sign", "--output", "Release.gpg", "Release"])
+
+    def index_rpm(self):
+        root = os.path.join(self.path, "rpm")
+        createrepo = self.module.get_bin_path("createrepo_c") or self.module.get_bin_path("createrepo", required=True)
+        self._run([createrepo, "--update", "."], root)
+        self._sign(root, ["--armor", "--detach-sign", "--output", "repodata/repomd.xml.asc", "repodata/repomd.xml"])
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            path=dict(type="path", required=True),
+            packages=dict(type="list", elements="path", required=True),
+            prune=dict(type="bool", default=False),
+            signing_key=dict(type="str"),
+        ),
+        supports_check_mode=True,
+    )
+
+    mirror = PackageMirror(module)
+    try:
+        keep = {mirror.add(package) for package in module.params.get("packages")}
+        if module.params.get("prune"):
+            mirror.prune(keep)
+    except OSError as e:
+        module.fail_json(msg=str(e))
+
+    state_path = os.path.join(mirror.path, STATE_FILE)
+    try:
+        with open(state_path) as f:
+            indexed = json.load(f)
+    except (OSError, ValueError):
+        indexed = {}
+
+    # In check mode the pool has not been written, so predict it from the packages
+    pools = {}
+    for fmt in FORMATS:
+        pool = set(mirror.pool(fmt))
+        if module.check_mode:
+            pool |= {relative for f, relative in keep if f == fmt}
+            if module.params.get("prune"):
+                pool = {relative for f, relative in keep if f == fmt}
+        pools[fmt] = sorted(pool)
+
+    wanted = dict(pools, signing_key=mirror.signing_key)
+    regenerated = [
+        fmt
+        for fmt in FORMATS
+        if pools[fmt] != indexed.get(fmt, []) or (pools[fmt] and mirror.signing_key != indexed.get("signing_key"))
+    ]
+    if regenerated and not module.check_mode:
+        for fmt in regenerated:
+            getattr(mirror, f"index_{fmt}")()
+        mirror.write(state_path, json.dumps(wanted, indent=2, sort_keys=True).encode())
+
+    module.exit_json(changed=mirror.changed or bool(regenerated), regenerated=regenerated, **pools)
+
+
+if __name__ == "__main__":
+    main()
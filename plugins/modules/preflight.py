@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+module: preflight
+
+short_description: Validate Smallstep desired state before touching the API
+
+description:
+    - Validates every collection, workload and instance entry against the argument spec of the module that applies it.
+    - Detects duplicate collection, workload and instance slugs, static SANs claimed by more than one workload and
+      workloads or instances that reference a collection which is not declared with I(state=present).
+    - Runs entirely locally in a single pass and never calls the Smallstep API.
+
+author:
+    - Smallstep Engineering
+
+requirements:
+    - ansible-core >= 2.11
+
+options:
+    collections:
+        description:
+            - Desired collections, in the format of C(smallstep_collections).
+        type: list
+        elements: raw
+        default: []
+    workloads:
+        description:
+            - Desired workloads, in the format of C(smallstep_workloads).
+        type: list
+        elements: raw
+        default: []
+    instances:
+        description:
+            - Desired collection instances, in the format of C(smallstep_collection_instances).
+        type: list
+        elements: raw
+        default: []
+    known_collections:
+        description:
+            - Slugs of collections that exist but are managed outside of I(collections).
+            - References to them are not reported as dangling.
+        type: list
+        elements: str
+        default: []
+    san_scope:
+        description:
+            - Whether a static SAN must be unique across all workloads or only within a collection.
+        choices: [ collection, global ]
+        default: global
+        type: str
+    fail_on_error:
+        description:
+            - Fail the task when any error is found.
+        default: true
+        type: bool
+"""
+
+EXAMPLES = """
+- name: Validate the desired Smallstep state
+  smallstep.agent.preflight:
+    collections: "{{ smallstep_collections }}"
+    workloads: "{{ smallstep_workloads }}"
+    instances: "{{ smallstep_collection_instances }}"
+  delegate_to: localhost
+  run_once: True
+"""
+
+RETURN = """
+errors:
+    description: Problems found in the desired state.
+    returned: always
+    type: list
+    elements: dict
+    sample:
+      - kind: duplicate_san
+        path: workloads[3]
+        msg: static SAN redis.hotdog.app is already used by workloads[1]
+counts:
+    description: Number of distinct collections, workloads, instances and static SANs that were validated.
+    returned: always
+    type: dict
+    sample:
+      collections: 1
+      workloads: 2
+      instances: 3
+      static_sans: 6
+"""
+
+# noqa: E402
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+
+from ..module_utils.preflight import DesiredStateValidator  # noqa: E402
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            collections=dict(type="list", elements="raw", default=[]),
+            workloads=dict(type="list", elements="raw", default=[]),
+            instances=dict(type="list", elements="raw", default=[]),
+            known_collections=dict(type="list", elements="str", default=[]),
+            san_scope=dict(type="str", default="global", choices=["collection", "global"]),
+            fail_on_error=dict(type="bool", default=True),
+        ),
+        supports_check_mode=True,
+    )
+
+    validator = DesiredStateValidator(
+        known_collections=module.params.get("known_collections"),
+        san_scope=module.params.get("san_scope"),
+    )
+    counts = validator.validate(
+        collections=module.params.get("collections"),
+        workloads=module.params.get("workloads"),
+        instances=module.params.get("instances"),
+    )
+    for warning in validator.warnings:
+        module.warn(warning)
+
+    result = {"changed": False, "errors": validator.errors, "counts": counts}
+    if validator.errors and module.params.get("fail_on_error"):
+        module.fail_json(msg=f"Found {len(validator.errors)} problem(s) in the desired state", **result)
+    module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
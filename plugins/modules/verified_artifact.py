@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+module: verified_artifact
+
+short_description: Download and verify a release artifact once into a local cache
+
+description:
+    - Downloads a release artifact, such as a C(step-agent-plugin) package, into a cache keyed by its SHA-256 digest.
+    - The artifact must match its entry in the release checksums file. The checksums file itself is verified with
+      C(cosign verify-blob) against its Sigstore signature and certificate, unless I(verifier=checksum).
+    - The verified checksums file and the artifact are reused by later runs, which then download and verify nothing.
+    - Meant to run on the controller, once per artifact, so that hosts only receive pre-verified copies.
+
+author:
+    - Smallstep Engineering
+
+requirements:
+    - cosign, unless I(verifier=checksum)
+
+options:
+    url:
+        description:
+            - URL of the artifact.
+        required: true
+        type: str
+    checksums_url:
+        description:
+            - URL of the release checksums file, in C(sha256sum) format, that lists the artifact's file name.
+        required: true
+        type: str
+    signature_url:
+        description:
+            - URL of the Sigstore signature of the checksums file.
+            - Defaults to I(checksums_url) with a C(.sig) suffix.
+        type: str
+    certificate_url:
+        description:
+            - URL of the Sigstore signing certificate of the checksums file.
+            - Defaults to I(checksums_url) with a C(.pem) suffix.
+        type: str
+    verifier:
+        description:
+            - How the checksums file is verified.
+            - C(checksum) trusts the checksums file as served and only checks the artifact against it.
+        choices: [ cosign, checksum ]
+        default: cosign
+        type: str
+    certificate_identity_regexp:
+        description:
+            - Identity that the signing certificate must have been issued to.
+        default: ^https://github.com/smallstep/
+        type: str
+    certificate_oidc_issuer:
+        description:
+            - OIDC issuer of the signing identity.
+        default: https://token.actions.githubusercontent.com
+        type: str
+    cache_dir:
+        description:
+            - Directory of the artifact cache.
+        default: ~/.cache/smallstep/artifacts
+        type: path
+    validate_certs:
+        description:
+            - Whether to validate the TLS certificates of the download URLs.
+        default: true
+        type: bool
+"""
+
+EXAMPLES = """
+- name: Verify the step-agent-plugin package once on the controller
+  smallstep.agent.verified_artifact:
+    url: https://dl.smallstep.com/step-agent-plugin/v0.1.0/step-agent-plugin_amd64.deb
+    checksums_url: https://dl.smallstep.com/step-agent-plugin/v0.1.0/checksums.txt
+  delegate_to: localhost
+  run_once: True
+  register: step_agent_artifact
+"""
+
+RETURN = """
+path:
+    description: Path of the verified artifact in the cache.
+    returned: success
+    type: str
+    sample: /home/ansible/.cache/smallstep/artifacts/sha256/9f86d0.../step-agent-plugin_amd64.deb
+digest:
+    description: SHA-256 digest of the artifact.
+    returned: success
+    type: str
+filename:
+    description: File name of the artifact.
+    returned: success
+    type: str
+    sample: step-agent-plugin_amd64.deb
+cache_hit:
+    description: Whether the artifact and its verified checksums file were both already cached.
+    returned: success
+    type: bool
+downloads:
+    description: URLs that were downloaded by this run.
+    returned: success
+    type: list
+    elements: str
+"""
+
+import os  # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+from ansible.module_utils.common.text.converters import to_native  # noqa: E402
+
+from ..module_utils.artifacts import ArtifactCache, ArtifactError  # noqa: E402
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            url=dict(type="str", required=True),
+            checksums_url=dict(type="str", required=True),
+            signature_url=dict(type="str"),
+            certificate_url=dict(type="str"),
+            verifier=dict(type="str", default="cosign", choices=["cosign", "checksum"]),
+            certificate_identity_regexp=dict(type="str", default="^https://github.com/smallstep/"),
+            certificate_oidc_issuer=dict(type="str", default="https://token.actions.githubusercontent.com"),
+            cache_dir=dict(type="path", default="~/.cache/smallstep/artifacts"),
+            validate_certs=dict(type="bool", default=True),
+        ),
+        supports_check_mode=True,
+    )
+
+    cache = ArtifactCache(
+        module,
+        module.params.get("cache_dir"),
+        module.params.get("verifier"),
+        identity_regexp=module.params.get("certificate_identity_regexp"),
+        oidc_issuer=module.params.get("certificate_oidc_issuer"),
+    )
+    # The cache lives on the controller and a verified artifact is needed to
+    # predict the install, so it is filled in check mode as well.
+    try:
+        checksums, checksums_hit = cache.checksums(
+            module.params.get("checksums_url"),
+            signature_url=module.params.get("signature_url"),
+            certificate_url=module.params.get("certificate_url"),
+        )
+        path, digest, artifact_hit = cache.artifact(module.params.get("url"), checksums)
+    except (ArtifactError, OSError) as e:
+        module.fail_json(msg=to_native(e), downloads=cache.downloads)
+
+    module.exit_json(
+        changed=bool(cache.downloads),
+        path=path,
+        digest=digest,
+        filename=os.path.basename(path),
+        cache_hit=checksums_hit and artifact_hit,
+        downloads=cache.downloads,
+    )
+
+
+if __name__ == "__main__":
+    main()
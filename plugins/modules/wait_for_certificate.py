@@ -0,0 +1,367 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+module: wait_for_certificate
+
+short_description: Wait until step-agent has issued a workload certificate, and report how long enrollment took
+
+description:
+    - Waits on the host until the certificate at I(path), and the key at I(key_path) when set, exist and the
+      certificate is valid, then returns its SANs and expiry.
+    - Changes to the files are watched with inotify, so the module returns as soon as step-agent writes them. Where
+      inotify is not available, the files are polled with exponential backoff.
+    - A certificate that is missing one of I(sans), or that expires within I(min_validity), is waited on as well,
+      so a renewal that replaces it is picked up.
+    - The time from the start of the I(service) unit to the certificate being written is returned in
+      C(enrollment_seconds), to track enrollment latency across the fleet.
+    - In check mode, the files are checked once and the module does not wait or fail, because step-agent was not
+      installed or started.
+
+author:
+    - Smallstep Engineering
+
+requirements:
+    - The cryptography Python library, or the openssl command line tool 1.1.1 or later
+    - systemd, for C(enrollment_seconds)
+
+options:
+    path:
+        description:
+            - Path of the certificate, the C(certificate_info.crt_file) of the workload.
+        required: true
+        type: path
+    key_path:
+        description:
+            - Path of the private key, the C(certificate_info.key_file) of the workload.
+        type: path
+    sans:
+        description:
+            - Subject alternative names, DNS names or IP addresses, that the certificate must contain.
+        default: []
+        type: list
+        elements: str
+    min_validity:
+        description:
+            - Seconds for which the certificate must remain valid.
+        default: 0
+        type: int
+    timeout:
+        description:
+            - Seconds to wait before failing.
+        default: 300
+        type: int
+    service:
+        description:
+            - Name of the systemd unit of the agent, whose start time C(enrollment_seconds) is measured from.
+            - C(enrollment_seconds) is not measured when empty.
+        default: step-agent
+        type: str
+"""
+
+EXAMPLES = """
+- name: Wait for the Redis certificate
+  smallstep.agent.wait_for_certificate:
+    path: /etc/redis/tls/redis.crt
+    key_path: /etc/redis/tls/redis.key
+    sans:
+      - staging.redis.hotdog.app
+    min_validity: 3600
+  register: redis_certificate
+
+- name: Report the enrollment latency
+  ansible.builtin.debug:
+    msg: "Issued {{ redis_certificate.enrollment_seconds }}s after step-agent started"
+"""
+
+RETURN = """
+sans:
+    description: Subject alternative names of the certificate.
+    returned: success
+    type: list
+    elements: str
+    sample: [staging.redis.hotdog.app, 10.0.1.17]
+not_after:
+    description: Expiry of the certificate, in UTC.
+    returned: success
+    type: str
+    sample: "2023-11-02T17:04:11Z"
+issued:
+    description: Time the certificate was written, in UTC.
+    returned: success
+    type: str
+    sample: "2023-11-01T17:04:12Z"
+enrollment_seconds:
+    description:
+        - Seconds from the start of I(service) to the certificate being written.
+        - Null when I(service) is empty or not active, or when the certificate was written before the service
+          started, such as on a rerun.
+    returned: success
+    type: float
+    sample: 4.82
+waited:
+    description: Seconds the module waited.
+    returned: always
+    type: float
+watch:
+    description: How the files were watched, C(inotify) or C(poll), or null in check mode.
+    returned: always
+    type: str
+"""
+
+import ctypes  # noqa: E402
+import ctypes.util  # noqa: E402
+import datetime  # noqa: E402
+import ipaddress  # noqa: E402
+import os  # noqa: E402
+import select  # noqa: E402
+import time  # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib  # noqa: E402
+
+HAS_CRYPTOGRAPHY = True
+
+try:
+    from cryptography import x509
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+
+# inotify(7) events that mean a file in a watched directory was written, moved in or changed
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+WATCH_EVENTS = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+MIN_POLL = 0.1
+MAX_POLL = 5.0
+
+
+class Watcher:
+    """Wake up when a file in the directories of some paths changes
+
+    Each path is watched through its nearest existing directory, so paths
+    whose directories step-agent has not created yet are picked up as well.
+    Without inotify, ``wait`` sleeps with exponential backoff instead.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.fd = None
+        self.delay = MIN_POLL
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self.fd = fd
+
+    @property
+    def mode(self):
+        return "poll" if self.fd is None else "inotify"
+
+    def _watch(self):
+        for path in self.paths:
+            directory = os.path.dirname(path)
+            while directory and not os.path.isdir(directory):
+                directory = os.path.dirname(directory)
+            # Adding a watch that exists already only updates its mask
+            self.libc.inotify_add_watch(self.fd, (directory or "/").encode(), WATCH_EVENTS)
+
+    def wait(self, timeout):
+        if self.fd is None:
+            time.sleep(min(self.delay, timeout))
+            self.delay = min(self.delay * 2, MAX_POLL)
+            return
+        self._watch()
+        # Wake up now and then even with inotify, for changes it does not report such as a mount appearing
+        ready, _, _ = select.select([self.fd], [], [], min(timeout, MAX_POLL))
+        if ready:
+            # Let the writer finish, then drain every queued event
+            time.sleep(0.05)
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+def utc(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class CertificateCheck:
+    def __init__(self, module):
+        self.module = module
+        self.openssl = None
+        if not HAS_CRYPTOGRAPHY:
+            self.openssl = module.get_bin_path("openssl")
+            if self.openssl is None:
+                module.fail_json(msg=missing_required_lib("cryptography"))
+
+    def inspect(self, path):
+        """SANs and expiry of a PEM certificate
+
+        :return: (sans, not_after as a UNIX timestamp), or None while the file is not a complete certificate
+        """
+        if HAS_CRYPTOGRAPHY:
+            try:
+                with open(path, "rb") as f:
+                    certificate = x509.load_pem_x509_certificate(f.read())
+            except (OSError, ValueError):
+                return None
+            try:
+                names = certificate.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+            except x509.ExtensionNotFound:
+                names = []
+            sans = [str(name.value) for name in names if isinstance(name, (x509.DNSName, x509.IPAddress))]
+            not_after = getattr(certificate, "not_valid_after_utc", None)
+            if not_after is None:
+                not_after = certificate.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+            not_after = not_after.timestamp()
+            return sans, not_after
+
+        rc, out, _err = self.module.run_command(
+            [self.openssl, "x509", "-in", path, "-noout", "-enddate", "-ext", "subjectAltName"]
+        )
+        if rc != 0:
+            return None
+        sans = []
+        not_after = None
+        for line in out.splitlines():
+            line = line.strip()
+            if line.startswith("notAfter="):
+                parsed = datetime.datetime.strptime(line.split("=", 1)[1].replace(" GMT", ""), "%b %d %H:%M:%S %Y")
+                not_after = parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+            else:
+                for name in line.split(", "):
+                    for prefix in ("DNS:", "IP Address:"):
+                        if name.startswith(prefix):
+                            sans.append(name[len(prefix) :])
+        if not_after is None:
+            return None
+        return sans, not_after
+
+    def problem(self, path, key_path, sans, min_validity):
+        """What the certificate still lacks
+
+        :return: (reason or None, details of the certificate or None)
+        """
+        if not os.path.exists(path):
+            return f"{path} does not exist", None
+        if key_path and not os.path.exists(key_path):
+            return f"{key_path} does not exist", None
+        inspected = self.inspect(path)
+        if inspected is None:
+            return f"{path} is not a PEM certificate", None
+        found, not_after = inspected
+        details = {"sans": found, "not_after": utc(not_after)}
+
+        normalized = set()
+        for name in found:
+            try:
+                normalized.add(str(ipaddress.ip_address(name)))
+            except ValueError:
+                normalized.add(name.lower())
+        missing = []
+        for name in sans:
+            try:
+                name = str(ipaddress.ip_address(name))
+            except ValueError:
+                name = name.lower()
+            if name not in normalized:
+                missing.append(name)
+        if missing:
+            return f"{path} lacks the SANs {', '.join(missing)}", details
+        if not_after - time.time() < min_validity:
+            return f"{path} expires at {details['not_after']}, within {min_validity}s", details
+        return None, details
+
+
+def service_started(module, service):
+    """Time the unit entered the active state, on the monotonic clock, or None"""
+    systemctl = module.get_bin_path("systemctl")
+    if not service or systemctl is None:
+        return None
+    rc, out, _err = module.run_command([systemctl, "show", service, "--property=ActiveEnterTimestampMonotonic"])
+    if rc != 0:
+        return None
+    value = out.strip().split("=", 1)[-1]
+    if not value.isdigit() or int(value) == 0:
+        return None
+    return int(value) / 1000000.0
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            path=dict(type="path", required=True),
+            key_path=dict(type="path"),
+            sans=dict(type="list", elements="str", default=[]),
+            min_validity=dict(type="int", default=0),
+            timeout=dict(type="int", default=300),
+            service=dict(type="str", default="step-agent"),
+        ),
+        supports_check_mode=True,
+    )
+
+    path = module.params.get("path")
+    key_path = module.params.get("key_path")
+    check = CertificateCheck(module)
+
+    # In check mode step-agent was not installed or started, so look once instead of waiting for it
+    if module.check_mode:
+        reason, details = check.problem(path, key_path, module.params.get("sans"), module.params.get("min_validity"))
+        result = {"changed": False, "watch": None, "waited": 0.0}
+        if details is not None:
+            result.update(details)
+        if reason is not None:
+            result["msg"] = f"Not waited for in check mode: {reason}"
+        module.exit_json(**result)
+
+    watcher = Watcher([p for p in (path, key_path) if p])
+    result = {"changed": False, "watch": watcher.mode}
+
+    start = time.monotonic()
+    deadline = start + module.params.get("timeout")
+    try:
+        while True:
+            reason, details = check.problem(
+                path, key_path, module.params.get("sans"), module.params.get("min_validity")
+            )
+            remaining = deadline - time.monotonic()
+            if reason is None or remaining <= 0:
+                break
+            watcher.wait(remaining)
+    finally:
+        watcher.close()
+
+    result["waited"] = round(time.monotonic() - start, 3)
+    if details is not None:
+        result.update(details)
+    if reason is not None:
+        module.fail_json(msg=f"Timed out after {module.params.get('timeout')}s: {reason}", **result)
+
+    # The write time, moved from the wall clock to the monotonic clock systemd reports the start on
+    written = os.stat(path).st_mtime
+    result["issued"] = utc(written)
+    written_monotonic = time.monotonic() - (time.time() - written)
+    started = service_started(module, module.params.get("service"))
+    result["enrollment_seconds"] = None
+    if started is not None and written_monotonic >= started:
+        result["enrollment_seconds"] = round(written_monotonic - started, 3)
+
+    module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
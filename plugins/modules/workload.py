@@ -16,11 +16,18 @@ description:
 author:
     - Joe Doss (@jdoss)
 
+extends_documentation_fragment:
+    - smallstep.agent.state_cache
+    - smallstep.agent.manifest
+    - smallstep.agent.rate_limit
+    - smallstep.agent.transport
+    - smallstep.agent.sharding
+
 options:
     api_token:
         description:
         - The Smallstep API Token used when connecting.
-        - Required.
+        - Required unless the task runs over the C(ansible.netcommon.httpapi) connection with the C(smallstep.agent.smallstep) plugin, which holds the token.
         env:
         - name: SMALLSTEP_API_TOKEN
         type: str
@@ -282,15 +289,16 @@ smallstep_workload:
     """
 
 # noqa: E402
-import json  # noqa: E402
-
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 from ansible.module_utils.common.text.converters import to_native  # noqa: E402
-from humps import decamelize  # noqa: E402
 from smallstep import api as step  # noqa: E402
 from smallstep.exceptions import StepException  # noqa: E402
 
 from ..module_utils.agent import AnsibleStep  # noqa: E402
+from ..module_utils.argument_specs import WORKLOAD_REQUIRED_IF, workload_argument_spec  # noqa: E402
+from ..module_utils.models import Workload  # noqa: E402
+from ..module_utils.profiling import profiled  # noqa: E402
+from ..module_utils.sharding import shard_key  # noqa: E402
 
 
 class AnsibleStepWorkload(AnsibleStep):
@@ -317,19 +325,31 @@ class AnsibleStepWorkload(AnsibleStep):
             "response": self.smallstep_workload,
         }
 
+    def _cache_key(self):
+        return f"{self.module.params.get('collection_slug')}/{self.module.params.get('workload_slug')}"
+
     def _get_workload(self):
         self.module.fail_on_missing_params(required_params=["workload_slug", "collection_slug"])
+        cached = self._cache_get("workload", self._cache_key())
+        if cached is not None:
+            self.smallstep_workload = cached
+            return
+
         try:
-            workload = step.StepWorkload(**self.connectargs)
-            res = workload.get(
+            workload = self._sdk(step.StepWorkload)
+            res = self._call(
+                "workload.get",
+                workload.get,
                 collection_slug=self.module.params.get("collection_slug"),
                 workload_slug=self.module.params.get("workload_slug"),
             ).to_dict()
             self.smallstep_workload = res
+            self._cache_put("workload", self._cache_key(), res)
 
         except StepException as exception:
             if exception.status_code == 404:
                 self.smallstep_workload = None
+                self._cache_invalidate("workload", self._cache_key())
                 return
             else:
                 self.fail_json(exception.message)
@@ -371,8 +391,10 @@ class AnsibleStepWorkload(AnsibleStep):
 
         if not self.module.check_mode:
             try:
-                workload = step.StepWorkload(**self.connectargs)
-                workload.create(
+                workload = self._sdk(step.StepWorkload)
+                self._call(
+                    "workload.create",
+                    workload.create,
                     collection_slug=params["collection_slug"],
                     display_name=params["display_name"],
                     workload_slug=params["workload_slug"],
@@ -380,6 +402,7 @@ class AnsibleStepWorkload(AnsibleStep):
                     **optparams,
                 ).to_dict()
                 self._mark_changed()
+                self._cache_invalidate("workload", self._cache_key())
                 self._get_workload()
             except StepException as exception:
                 self.fail_json(exception.message)
@@ -398,19 +421,15 @@ class AnsibleStepWorkload(AnsibleStep):
             "display_name": self.module.params.get("display_name"),
         }
 
-        workload_params = decamelize(self.smallstep_workload)
-        workload_params["device_metadata_key_sans"] = workload_params.pop("device_metadata_key_sa_ns", None)
-        workload_params["static_sans"] = workload_params.pop("static_sa_ns", None)
-        workload_params.pop("slug", None)
+        current = Workload.from_api(self.smallstep_workload)
 
         module_params = self.filter_none(self.module.params)
         mod_params_remove = (
             "admin_emails",
-            "api_host",
-            "api_token",
             "collection_slug",
             "state",
             "workload_slug",
+            *self.base_module_args(),
         )
         for k in mod_params_remove:
             module_params.pop(k, None)
@@ -418,21 +437,24 @@ class AnsibleStepWorkload(AnsibleStep):
         if self.module.params.get("certificate_info") is None:
             module_params["certificate_info"] = {"duration": "24h0m0s", "type": "X509"}
 
-        if json.dumps(workload_params, sort_keys=True) != json.dumps(module_params, sort_keys=True):
+        if current != Workload.from_params(module_params):
             modargs = module_params
             modargs.pop("workload_type")
             modargs.pop("display_name")
             if not self.module.check_mode:
                 try:
-                    workload = step.StepWorkload(**self.connectargs)
-                    workload.update(
+                    workload = self._sdk(step.StepWorkload)
+                    self._call(
+                        "workload.update",
+                        workload.update,
                         workload_slug=params["workload_slug"],
                         collection_slug=params["collection_slug"],
-                        workload_type=workload_params["workload_type"],
+                        workload_type=current.workload_type,
                         display_name=params["display_name"],
                         **modargs,
                     ).to_dict()
                     self._mark_changed()
+                    self._cache_invalidate("workload", self._cache_key())
                     self._get_workload()
                 except StepException as exception:
                     self.fail_json(exception.message)
@@ -450,12 +472,15 @@ class AnsibleStepWorkload(AnsibleStep):
         if self.smallstep_workload is not None:
             if not self.module.check_mode:
                 try:
-                    workload = step.StepWorkload(**self.connectargs)
-                    workload.destroy(
+                    workload = self._sdk(step.StepWorkload)
+                    self._call(
+                        "workload.destroy",
+                        workload.destroy,
                         collection_slug=self.module.params.get("collection_slug"),
                         workload_slug=self.module.params.get("workload_slug"),
                     )
                     self._mark_changed()
+                    self._cache_invalidate("workload", self._cache_key())
                     self._get_workload()
                 except StepException as exception:
                     self.fail_json(exception)
@@ -464,141 +489,33 @@ class AnsibleStepWorkload(AnsibleStep):
     def define_module(cls):
         return AnsibleModule(
             argument_spec=dict(
-                admin_emails=dict(type="list", elements="str", required=True),
-                certificate_info=dict(
-                    type="dict",
-                    options=dict(
-                        crt_file=dict(type="str"),
-                        duration=dict(type="str"),
-                        gid=dict(type="int"),
-                        key_file=dict(type="str"),
-                        mode=dict(type="int"),
-                        root_file=dict(type="str"),
-                        type=dict(
-                            type="str",
-                            required=True,
-                            choices=["X509", "SSH_USER", "SSH_HOST"],
-                        ),
-                        uid=dict(type="int"),
-                    ),
-                ),
-                collection_slug=dict(type="str", required=True),
-                device_metadata_key_sans=dict(type="list", elements="str"),
-                display_name=dict(type="str", required=True),
-                hooks=dict(
-                    type="dict",
-                    options=dict(renew=dict(type="dict"), sign=dict(type="dict")),
-                ),
-                key_info=dict(
-                    type="dict",
-                    options=dict(
-                        format=dict(
-                            type="str",
-                            choices=[
-                                "DEFAULT",
-                                "PKCS8",
-                                "OPENSSH",
-                                "DER",
-                            ],
-                        ),
-                        pub_file=dict(type="str"),
-                        type=dict(
-                            type="str",
-                            required=True,
-                            choices=[
-                                "DEFAULT",
-                                "ECDSA_P256",
-                                "ECDSA_P384",
-                                "ECDSA_P521",
-                                "RSA_2048",
-                                "RSA_3072",
-                                "RSA_4096",
-                                "ED25519",
-                            ],
-                        ),
-                    ),
-                ),
-                reload_info=dict(
-                    type="dict",
-                    required_if=[
-                        ("method", "DBUS", ("unit_name",)),
-                        ("method", "SIGNAL", ("pid_file", "signal")),
-                    ],
-                    mutually_exclusive=[
-                        ("unit_name", "pid_file"),
-                        ("unit_name", "signal"),
-                    ],
-                    options=dict(
-                        method=dict(
-                            type="str",
-                            required=True,
-                            choices=[
-                                "AUTOMATIC",
-                                "CUSTOM",
-                                "SIGNAL",
-                                "DBUS",
-                            ],
-                        ),
-                        pid_file=dict(type="str"),
-                        signal=dict(type="int"),
-                        unit_name=dict(type="str"),
-                    ),
-                ),
-                static_sans=dict(type="list", elements="str"),
-                workload_slug=dict(type="str", required=True),
-                workload_type=dict(
-                    type="str",
-                    required=True,
-                    choices=[
-                        "etcd",
-                        "generic",
-                        "git",
-                        "grafana",
-                        "haproxy",
-                        "httpd",
-                        "kafka",
-                        "mysql",
-                        "nginx",
-                        "nodejs",
-                        "openvpn",
-                        "postgres",
-                        "redis",
-                        "tomcat",
-                        "zookeeper",
-                    ],
-                ),
-                state=dict(type="str", default="present", choices=["absent", "present"]),
+                **workload_argument_spec(),
                 **super().base_module_args(),
             ),
-            required_if=[
-                [
-                    "state",
-                    "present",
-                    [
-                        "admin_emails",
-                        "collection_slug",
-                        "display_name",
-                        "workload_slug",
-                        "workload_type",
-                    ],
-                ],
-                ["state", "absent", ["workload_slug"]],
-            ],
+            required_if=WORKLOAD_REQUIRED_IF,
             supports_check_mode=True,
         )
 
 
+@profiled("workload")
 def main():
     module = AnsibleStepWorkload.define_module()
 
     agent = AnsibleStepWorkload(module)
+    if agent.foreign(shard_key(module.params.get("collection_slug"), module.params.get("workload_slug"))):
+        module.exit_json(skipped=True, msg="owned by another shard", **agent.get_result())
+    if agent.replay("workload", agent._cache_key()):
+        module.exit_json(**agent.get_result())
+
     state = module.params.get("state")
     if state == "absent":
         agent.destroy_workload()
     elif state == "present":
         agent.check_workload()
 
-    module.exit_json(**agent.get_result())
+    result = agent.get_result()
+    agent.record("workload", agent._cache_key())
+    module.exit_json(**result)
 
 
 if __name__ == "__main__":
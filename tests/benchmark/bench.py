@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+"""Scale benchmark of the install and configure roles against local stand-ins
+
+Generates synthetic desired state, starts the mock Smallstep API (over TLS,
+with a throwaway certificate) and a package server, then runs each phase as a
+separate ansible-playbook process. For every phase it records wall time, the
+API requests the mock served, peak controller RSS and per-task timings, and
+writes everything to one JSON file so runs can be compared.
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import generate
+import mock_api
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(HERE))
+PACKAGE_VERSION = "0.0.0"
+DEB_ARCH = {"x86_64": "amd64", "aarch64": "arm64"}
+
+
+def make_cli_stand_in(collections_path):
+    """Empty stand-in for the smallstep.cli.install role, which both roles depend on
+
+    The real role downloads the step CLI from GitHub, which is neither local
+    nor what this benchmark measures.
+    """
+    tasks = os.path.join(collections_path, "ansible_collections", "smallstep", "cli", "roles", "install", "tasks")
+    os.makedirs(tasks, exist_ok=True)
+    with open(os.path.join(tasks, "main.yml"), "w") as f:
+        f.write("---\n[]\n")
+
+
+def make_certificate(workdir):
+    """Self-signed certificate for 127.0.0.1, which the modules trust through SSL_CERT_FILE"""
+    cert = os.path.join(workdir, "api.crt")
+    key = os.path.join(workdir, "api.key")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1,DNS:localhost",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def make_packages(workdir, arch):
+    """Build a dummy step-agent-plugin Deb package, if dpkg-deb is available
+
+    :return: the package directory served over HTTP
+    """
+    packages = os.path.join(workdir, "packages")
+    os.makedirs(packages, exist_ok=True)
+    if shutil.which("dpkg-deb") is None:
+        return packages
+
+    root = os.path.join(workdir, "deb-root")
+    os.makedirs(os.path.join(root, "DEBIAN"), exist_ok=True)
+    os.makedirs(os.path.join(root, "usr", "share", "doc", "step-agent-plugin"), exist_ok=True)
+    with open(os.path.join(root, "DEBIAN", "control"), "w") as f:
+        f.write(
+            "Package: step-agent-plugin\n"
+            f"Version: {PACKAGE_VERSION}\n"
+            f"Architecture: {arch}\n"
+            "Maintainer: Smallstep Engineering <techadmin@smallstep.com>\n"
+            "Description: Benchmark stand-in for step-agent-plugin\n"
+        )
+    with open(os.path.join(root, "usr", "share", "doc", "step-agent-plugin", "README"), "w") as f:
+        f.write("Benchmark stand-in\n")
+    package = os.path.join(packages, f"step-agent-plugin_{arch}.deb")
+    subprocess.run(["dpkg-deb", "--build", root, package], check=True, capture_output=True)
+    with open(package, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with open(os.path.join(packages, "checksums.txt"), "w") as f:
+        f.write(f"{digest}  {os.path.basename(package)}\n")
+    return packages
+
+
+def serve_packages(directory):
+    handler = functools.partial(QuietFileHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="packages", daemon=True).start()
+    return server
+
+
+class QuietFileHandler(SimpleHTTPRequestHandler):
+    downloads = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        QuietFileHandler.downloads += 1
+        super().do_GET()
+
+
+def api_stats(server):
+    state = server.RequestHandlerClass.state
+    with state.lock:
+        return {"requests": dict(state.requests), "statuses": dict(state.statuses)}
+
+
+def stats_delta(before, after):
+    delta = {}
+    for key in ("requests", "statuses"):
+        delta[key] = {
+            str(name): count - before[key].get(name, 0)
+            for name, count in after[key].items()
+            if count - before[key].get(name, 0)
+        }
+    delta["total"] = sum(delta["requests"].values())
+    return delta
+
+
+def process_tree_rss(pid):
+    """RSS in bytes of ``pid`` and of the whole tree below it, read from /proc
+
+    :return: tuple of (rss of pid, rss of the tree)
+    """
+    children = {}
+    rss = {}
+    page = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # Fields after the command name: state, ppid, ..., rss is the 22nd.
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return rss.get(pid, 0), total
+
+
+def run_phase(name, command, env, interval=0.2):
+    """Run one ansible-playbook invocation and sample controller memory while it runs"""
+    peak_main = peak_tree = 0
+    start = time.monotonic()
+    with open(env["BENCH_LOG"], "w") as log:
+        process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT, cwd=HERE)
+        while process.poll() is None:
+            if sys.platform.startswith("linux"):
+                main, tree = process_tree_rss(process.pid)
+                peak_main = max(peak_main, main)
+                peak_tree = max(peak_tree, tree)
+            time.sleep(interval)
+    return {
+        "phase": name,
+        "returncode": process.returncode,
+        "wall_time": round(time.monotonic() - start, 3),
+        "controller_rss_peak": peak_main,
+        "controller_tree_rss_peak": peak_tree,
+        "log": env["BENCH_LOG"],
+    }
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=50, help="number of inventory hosts")
+    parser.add_argument("--collections", type=int, default=1)
+    parser.add_argument("--workloads", type=int, default=10)
+    parser.add_argument(
+        "--instances", type=int, default=100, help="instances listed in smallstep_collection_instances"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["loop", "hosts"],
+        default="loop",
+        help="register instances through the per-item loop, or derive one per host and register them in bulk",
+    )
+    parser.add_argument("--phases", default="install,configure", help="comma separated phases to run")
+    parser.add_argument("--configure-runs", type=int, default=2, help="configure runs; the first one is cold")
+    parser.add_argument("--forks", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to every API request")
+    parser.add_argument("--connection", default="local")
+    parser.add_argument("--python", default="/usr/bin/python3", help="interpreter of the benchmark hosts")
+    parser.add_argument("--install-apply", action="store_true", help="really install the package instead of --check")
+    parser.add_argument("--state-cache", action="store_true", help="enable the controller-side state cache")
+    parser.add_argument("--workdir", help="keep generated files here instead of a temporary directory")
+    parser.add_argument("--output", default="bench-results.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="smallstep-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    inventory, state = generate.write(
+        workdir,
+        args.hosts,
+        args.collections,
+        args.workloads,
+        args.instances if args.mode == "loop" else 0,
+        args.connection,
+        args.python,
+    )
+
+    collections_path = os.path.join(workdir, "collections")
+    link = os.path.join(collections_path, "ansible_collections", "smallstep", "agent")
+    os.makedirs(os.path.dirname(link), exist_ok=True)
+    if not os.path.islink(link):
+        os.symlink(REPO, link)
+    make_cli_stand_in(collections_path)
+
+    cert, key = make_certificate(workdir)
+    api = mock_api.serve(certfile=cert, keyfile=key, latency=args.latency / 1000.0)
+    arch = DEB_ARCH.get(platform.machine(), platform.machine())
+    packages = serve_packages(make_packages(workdir, arch))
+
+    bench_vars = {
+        "smallstep_api_host": f"127.0.0.1:{api.server_port}",
+        "smallstep_api_token": "bench-token",
+        "smallstep_agent_version": f"v{PACKAGE_VERSION}",
+        "smallstep_agent_download_url": f"http://127.0.0.1:{packages.server_port}/step-agent-plugin_{arch}.deb",
+        # The dummy package is not signed, so it is only checked against checksums.txt
+        "smallstep_agent_verify": True,
+        "smallstep_agent_verifier": "checksum",
+        "smallstep_agent_artifact_cache_dir": os.path.join(workdir, "artifacts"),
+        "smallstep_register_hosts": args.mode == "hosts",
+        "smallstep_host_collection_slug": "bench-0000",
+        "smallstep_host_instance_metadata": {"name": "{{ inventory_hostname }}"},
+    }
+    if args.state_cache:
+        bench_vars["smallstep_state_cache"] = os.path.join(workdir, "state.sqlite")
+    vars_file = os.path.join(workdir, "bench-vars.json")
+    with open(vars_file, "w") as f:
+        json.dump(bench_vars, f)
+
+    base_env = dict(
+        os.environ,
+        SSL_CERT_FILE=cert,
+        ANSIBLE_COLLECTIONS_PATH=os.pathsep.join(
+            filter(None, [collections_path, os.environ.get("ANSIBLE_COLLECTIONS_PATH")])
+        ),
+        ANSIBLE_CALLBACK_PLUGINS=os.path.join(HERE, "callback_plugins"),
+        ANSIBLE_CALLBACKS_ENABLED="smallstep.agent.api_timings,bench_timings",
+        ANSIBLE_FORKS=str(args.forks),
+        ANSIBLE_HOST_KEY_CHECKING="False",
+        ANSIBLE_RETRY_FILES_ENABLED="False",
+    )
+
+    phases = []
+    for phase in args.phases.split(","):
+        if phase == "install":
+            phases.append(("install", "install.yml", [] if args.install_apply else ["--check"]))
+        elif phase == "configure":
+            for run in range(args.configure_runs):
+                label = "configure-cold" if run == 0 else f"configure-warm-{run}"
+                # The install role already ran in its own phase, and the agent
+                # service cannot run on benchmark hosts.
+                phases.append((label, "configure.yml", ["--skip-tags", "smallstep_install,smallstep_agent_service"]))
+        else:
+            sys.exit(f"unknown phase: {phase}")
+
+    results = {
+        "parameters": vars(args),
+        "workdir": workdir,
+        "phases": [],
+    }
+    for label, playbook, extra in phases:
+        env = dict(
+            base_env,
+            BENCH_LOG=os.path.join(workdir, f"{label}.log"),
+            BENCH_TIMINGS_FILE=os.path.join(workdir, f"{label}-tasks.json"),
+            SMALLSTEP_API_TIMINGS_JSON=os.path.join(workdir, f"{label}-api.json"),
+        )
+        command = [
+            "ansible-playbook",
+            "-i",
+            inventory,
+            "-e",
+            f"@{state}",
+            "-e",
+            f"@{vars_file}",
+            os.path.join(HERE, "playbooks", playbook),
+            *extra,
+        ]
+        before = api_stats(api)
+        downloads = QuietFileHandler.downloads
+        result = run_phase(label, command, env)
+        result["api"] = stats_delta(before, api_stats(api))
+        result["package_downloads"] = QuietFileHandler.downloads - downloads
+        result["tasks"] = (read_json(env["BENCH_TIMINGS_FILE"]) or {}).get("tasks", [])
+        result["api_timings"] = read_json(env["SMALLSTEP_API_TIMINGS_JSON"])
+        results["phases"].append(result)
+        print(
+            f"{label:<18} rc={result['returncode']} wall={result['wall_time']:>8.2f}s"
+            f" api_requests={result['api']['total']:>6} downloads={result['package_downloads']:>4}"
+            f" rss={result['controller_rss_peak'] // 2**20}MiB tree_rss={result['controller_tree_rss_peak'] // 2**20}MiB"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"results written to {args.output}, logs in {workdir}")
+    return 0 if all(phase["returncode"] == 0 for phase in results["phases"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+DOCUMENTATION = """
+---
+name: bench_timings
+
+short_description: Per-task wall time of a benchmark run
+
+description:
+    - Records the wall time of every task, from its start until the next task or the end of the play starts.
+    - Writes the timings of the whole run as JSON to C(BENCH_TIMINGS_FILE) when the playbook finishes.
+
+type: aggregate
+
+options:
+    output:
+        description: Path of the JSON file written at the end of the run.
+        env:
+        - name: BENCH_TIMINGS_FILE
+        type: path
+"""
+
+import json  # noqa: E402
+import time  # noqa: E402
+
+from ansible.plugins.callback import CallbackBase  # noqa: E402
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "bench_timings"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super().__init__()
+        self.tasks = []
+        self.current = None
+
+    def _close(self):
+        if self.current is not None:
+            self.current["duration"] = round(time.monotonic() - self.current.pop("start"), 6)
+            self.tasks.append(self.current)
+            self.current = None
+
+    def v2_playbook_on_play_start(self, play):
+        self._close()
+        self.play = play.get_name()
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._close()
+        self.current = {"play": self.play, "task": task.get_name(), "action": task.action, "start": time.monotonic()}
+
+    v2_playbook_on_handler_task_start = v2_playbook_on_task_start
+
+    def v2_playbook_on_stats(self, stats):
+        self._close()
+        output = self.get_option("output")
+        if output:
+            with open(output, "w") as f:
+                json.dump({"tasks": self.tasks}, f, indent=1)
@@ -0,0 +1,121 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+"""Synthetic desired state and inventory for the benchmark
+
+The output is deterministic for a given set of sizes, so runs of different
+branches against the same sizes are comparable.
+"""
+
+import argparse
+import json
+import os
+
+WORKLOAD_TYPES = ["generic", "nginx", "redis", "postgres", "etcd"]
+
+
+def _at_least_one(count):
+    return max(int(count), 1)
+
+
+def collections(count):
+    return [
+        {
+            "collection_slug": f"bench-{c:04d}",
+            "display_name": f"Benchmark collection {c}",
+            "admin_emails": ["bench@example.com"],
+            "device_type": {"aws_vm": {"accounts": [f"{100000000000 + c}"], "disable_custom_sans": False}},
+            "state": "present",
+        }
+        for c in range(_at_least_one(count))
+    ]
+
+
+def workloads(count, collection_count):
+    result = []
+    for w in range(int(count)):
+        collection = w % _at_least_one(collection_count)
+        workload_type = WORKLOAD_TYPES[w % len(WORKLOAD_TYPES)]
+        result.append(
+            {
+                "admin_emails": ["bench@example.com"],
+                "collection_slug": f"bench-{collection:04d}",
+                "device_metadata_key_sans": ["name"],
+                "display_name": f"Benchmark {workload_type} {w}",
+                "reload_info": {"method": "DBUS", "unit_name": f"{workload_type}.service"},
+                "static_sans": [f"w{w}.bench.example.com"],
+                "workload_slug": f"bench-{workload_type}-{w:05d}",
+                "workload_type": workload_type,
+                "state": "present",
+            }
+        )
+    return result
+
+
+def instances(count, collection_count):
+    return [
+        {
+            "collection_slug": f"bench-{i % _at_least_one(collection_count):04d}",
+            "instance_id": f"i-{i:017x}",
+            "instance_metadata": {"name": f"bench-instance-{i}", "role": WORKLOAD_TYPES[i % len(WORKLOAD_TYPES)]},
+            "state": "present",
+        }
+        for i in range(int(count))
+    ]
+
+
+def inventory(hosts, connection="local", python="/usr/bin/python3"):
+    """INI inventory of ``hosts`` hosts in the ``bench`` group
+
+    Every host gets its own ``smallstep_host_instance_id`` since hosts that
+    share a machine (local connections, containers) also share the facts
+    the role would otherwise derive the ID from.
+    """
+    lines = ["[bench]"]
+    for h in range(int(hosts)):
+        name = f"bench-{h:04d}"
+        lines.append(
+            f"{name} ansible_connection={connection} ansible_python_interpreter={python}"
+            f" smallstep_host_instance_id={name}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write(workdir, hosts, collection_count, workload_count, instance_count, connection="local", python=None):
+    """Write ``inventory.ini`` and ``state.json`` to ``workdir``
+
+    :return: tuple of the inventory and state file paths
+    """
+    os.makedirs(workdir, exist_ok=True)
+    inventory_path = os.path.join(workdir, "inventory.ini")
+    state_path = os.path.join(workdir, "state.json")
+    with open(inventory_path, "w") as f:
+        f.write(inventory(hosts, connection, python or "/usr/bin/python3"))
+    state = {
+        "smallstep_collections": collections(collection_count),
+        "smallstep_workloads": workloads(workload_count, collection_count),
+        "smallstep_collection_instances": instances(instance_count, collection_count),
+    }
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=1)
+    return inventory_path, state_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("workdir")
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--collections", type=int, default=1)
+    parser.add_argument("--workloads", type=int, default=10)
+    parser.add_argument("--instances", type=int, default=100)
+    parser.add_argument("--connection", default="local")
+    parser.add_argument("--python", default="/usr/bin/python3")
+    args = parser.parse_args()
+    for path in write(
+        args.workdir, args.hosts, args.collections, args.workloads, args.instances, args.connection, args.python
+    ):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+"""In-memory stand-in for the parts of the Smallstep API the collection uses
+
+Objects live in dicts keyed by slug or ID, so the server itself stays flat
+while the modules are benchmarked. Every request is counted per route and
+the counters are served as JSON from ``GET /_stats``. ``latency`` adds a fixed
+delay to every API request to approximate a remote endpoint.
+"""
+
+import gzip
+import json
+import re
+import ssl
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+JSON = "application/json; charset=utf-8"
+
+
+def now():
+    return datetime.now(tz=timezone.utc).isoformat()
+
+
+class MockState:
+    def __init__(self, team="bench"):
+        self.team = team
+        self.lock = threading.RLock()
+        self.device_collections = {}
+        self.collections = {}
+        self.instances = {}
+        self.workloads = {}
+        self.requests = Counter()
+        self.statuses = Counter()
+
+    def authorities(self):
+        return [
+            {
+                "id": "00000000-0000-0000-0000-000000000001",
+                "name": "Agents",
+                "type": "devops",
+                "domain": f"agents.{self.team}.ca.smallstep.com",
+                "fingerprint": "a" * 64,
+                "createdAt": "2023-01-01T00:00:00Z",
+            }
+        ]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+    latency = 0.0
+    # Like the API gateway, only bodies above this size are compressed.
+    compress_min = 256
+
+    # (method, pattern, handler name); patterns are matched below /api.
+    ROUTES = [
+        ("GET", r"/authorities", "list_authorities"),
+        ("GET", r"/collections", "list_collections"),
+        ("GET", r"/collections/(?P<slug>[^/]+)", "get_collection"),
+        ("PUT", r"/collections/(?P<slug>[^/]+)", "put_collection"),
+        ("DELETE", r"/collections/(?P<slug>[^/]+)", "delete_collection"),
+        ("GET", r"/collections/(?P<slug>[^/]+)/items", "list_instances"),
+        ("GET", r"/collections/(?P<slug>[^/]+)/instances/(?P<id>[^/]+)", "get_instance"),
+        ("PUT", r"/collections/(?P<slug>[^/]+)/instances/(?P<id>[^/]+)", "put_instance"),
+        ("PUT", r"/collections/(?P<slug>[^/]+)/instances/(?P<id>[^/]+)/data", "put_instance_data"),
+        ("DELETE", r"/collections/(?P<slug>[^/]+)/instances/(?P<id>[^/]+)", "delete_instance"),
+        ("GET", r"/device-collections/(?P<slug>[^/]+)", "get_device_collection"),
+        ("PUT", r"/device-collections/(?P<slug>[^/]+)", "put_device_collection"),
+        ("DELETE", r"/device-collections/(?P<slug>[^/]+)", "delete_device_collection"),
+        ("GET", r"/device-collections/(?P<slug>[^/]+)/workloads/(?P<workload>[^/]+)", "get_workload"),
+        ("PUT", r"/device-collections/(?P<slug>[^/]+)/workloads/(?P<workload>[^/]+)", "put_workload"),
+        ("DELETE", r"/device-collections/(?P<slug>[^/]+)/workloads/(?P<workload>[^/]+)", "delete_workload"),
+    ]
+    COMPILED = [(method, re.compile(f"^/api{pattern}$"), name) for method, pattern, name in ROUTES]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", JSON)
+            if len(payload) > self.compress_min and "gzip" in self.headers.get("Accept-Encoding", ""):
+                payload = gzip.compress(payload)
+                self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        with self.state.lock:
+            self.state.statuses[status] += 1
+
+    def _error(self, status, message):
+        self._send(status, {"message": message, "statusCode": status})
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null") if length else None
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        if method == "GET" and url.path == "/_stats":
+            with self.state.lock:
+                stats = {
+                    "requests": dict(self.state.requests),
+                    "statuses": {str(k): v for k, v in self.state.statuses.items()},
+                    "objects": {
+                        "collections": len(self.state.collections),
+                        "instances": len(self.state.instances),
+                        "workloads": len(self.state.workloads),
+                    },
+                }
+            return self._send(200, stats)
+
+        for route_method, pattern, name in self.COMPILED:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                with self.state.lock:
+                    self.state.requests[f"{method} {name}"] += 1
+                if self.latency:
+                    time.sleep(self.latency)
+                return getattr(self, name)(query=parse_qs(url.query), **match.groupdict())
+        return self._error(404, f"no route for {method} {url.path}")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def list_authorities(self, query):
+        self._send(200, self.state.authorities())
+
+    def _page(self, items, query):
+        """Cursor paging in the style of the API: ``first`` items after the ``after`` key"""
+        keys = sorted(items)
+        after = query.get("after", [None])[0]
+        first = int(query.get("first", [100])[0])
+        start = keys.index(after) + 1 if after in items else 0
+        page = keys[start : start + first]
+        headers = {}
+        if start + first < len(keys):
+            headers["X-Next-Cursor"] = page[-1]
+        return [items[k] for k in page], headers
+
+    def list_collections(self, query):
+        with self.state.lock:
+            page, headers = self._page(dict(self.state.collections), query)
+        self._send(200, page, headers)
+
+    def get_collection(self, query, slug):
+        collection = self.state.collections.get(slug)
+        if collection is None:
+            return self._error(404, "collection not found")
+        self._send(200, collection)
+
+    def put_collection(self, query, slug):
+        body = self._body() or {}
+        with self.state.lock:
+            collection = self.state.collections.get(slug)
+            if collection is None:
+                return self._error(404, "collection not found")
+            collection.update(displayName=body.get("displayName", collection["displayName"]), updatedAt=now())
+        self._send(200, collection)
+
+    def delete_collection(self, query, slug):
+        with self.state.lock:
+            self.state.collections.pop(slug, None)
+            self.state.device_collections.pop(slug, None)
+        self._send(204)
+
+    def list_instances(self, query, slug):
+        with self.state.lock:
+            if slug not in self.state.collections:
+                return self._error(404, "collection not found")
+            items = {i: v for (s, i), v in self.state.instances.items() if s == slug}
+            page, headers = self._page(items, query)
+        self._send(200, page, headers)
+
+    def get_instance(self, query, slug, id):
+        instance = self.state.instances.get((slug, id))
+        if instance is None:
+            return self._error(404, "instance not found")
+        self._send(200, instance)
+
+    def put_instance(self, query, slug, id):
+        body = self._body() or {}
+        with self.state.lock:
+            if slug not in self.state.collections:
+                return self._error(404, "collection not found")
+            timestamp = now()
+            previous = self.state.instances.get((slug, id))
+            instance = {
+                "id": id,
+                "data": body.get("data") or {},
+                "createdAt": previous["createdAt"] if previous else timestamp,
+                "updatedAt": timestamp,
+            }
+            self.state.instances[(slug, id)] = instance
+            self.state.collections[slug]["instanceCount"] = sum(1 for s, _ in self.state.instances if s == slug)
+        self._send(200, instance)
+
+    def put_instance_data(self, query, slug, id):
+        body = self._body() or {}
+        with self.state.lock:
+            instance = self.state.instances.get((slug, id))
+            if instance is None:
+                return self._error(404, "instance not found")
+            instance.update(data=body, updatedAt=now())
+        self._send(200, instance["data"])
+
+    def delete_instance(self, query, slug, id):
+        with self.state.lock:
+            self.state.instances.pop((slug, id), None)
+            if slug in self.state.collections:
+                self.state.collections[slug]["instanceCount"] = sum(1 for s, _ in self.state.instances if s == slug)
+        self._send(204)
+
+    def get_device_collection(self, query, slug):
+        collection = self.state.device_collections.get(slug)
+        if collection is None:
+            return self._error(404, "collection not found")
+        self._send(200, collection)
+
+    def put_device_collection(self, query, slug):
+        body = self._body() or {}
+        with self.state.lock:
+            if slug in self.state.device_collections:
+                return self._error(409, "collection already exists")
+            timestamp = now()
+            self.state.device_collections[slug] = body
+            previous = self.state.collections.get(slug)
+            self.state.collections[slug] = {
+                "slug": slug,
+                "displayName": body.get("displayName", slug),
+                "instanceCount": previous["instanceCount"] if previous else 0,
+                "createdAt": previous["createdAt"] if previous else timestamp,
+                "updatedAt": timestamp,
+            }
+        self._send(200, body)
+
+    def delete_device_collection(self, query, slug):
+        return self.delete_collection(query, slug)
+
+    def get_workload(self, query, slug, workload):
+        body = self.state.workloads.get((slug, workload))
+        if body is None:
+            return self._error(404, "workload not found")
+        self._send(200, body)
+
+    def put_workload(self, query, slug, workload):
+        body = self._body() or {}
+        with self.state.lock:
+            if slug not in self.state.device_collections:
+                return self._error(404, "collection not found")
+            # Admin emails are accepted but, like the real API, never returned;
+            # workloads without certificate info get the API's default.
+            body.pop("adminEmails", None)
+            body.setdefault("certificateInfo", {"type": "X509", "duration": "24h0m0s"})
+            self.state.workloads[(slug, workload)] = body
+        self._send(200, body)
+
+    def delete_workload(self, query, slug, workload):
+        with self.state.lock:
+            self.state.workloads.pop((slug, workload), None)
+        self._send(204)
+
+
+class TLSServer(ThreadingHTTPServer):
+    """Threaded server that runs the TLS handshake in the request thread"""
+
+    context = None
+
+    def finish_request(self, request, client_address):
+        if self.context is not None:
+            request = self.context.wrap_socket(request, server_side=True)
+        super().finish_request(request, client_address)
+
+
+def serve(host="127.0.0.1", port=0, certfile=None, keyfile=None, latency=0.0, team="bench"):
+    """Start the mock API in a daemon thread
+
+    :return: the running ``ThreadingHTTPServer``; its ``server_port`` is the bound port
+    """
+    handler = type("BoundHandler", (Handler,), {"state": MockState(team), "latency": latency})
+    server = TLSServer((host, port), handler)
+    server.daemon_threads = True
+    if certfile:
+        server.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server.context.load_cert_chain(certfile, keyfile)
+    threading.Thread(target=server.serve_forever, name="mock-api", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # Serves the mock API on its own, such as for the smallstep_changes event source:
+    # ./mock_api.py --port 8443, then SSL_CERT_FILE=<printed certificate>
+    import argparse
+    import tempfile
+
+    from bench import make_certificate
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to every API request")
+    args = parser.parse_args()
+
+    cert, key = make_certificate(tempfile.mkdtemp(prefix="mock-api"))
+    server = serve(port=args.port, certfile=cert, keyfile=key, latency=args.latency / 1000.0)
+    print(f"Serving https://127.0.0.1:{server.server_port}/api, trust it with SSL_CERT_FILE={cert}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,172 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import asyncio
+
+import httpx
+import pytest
+from ansible_collections.smallstep.agent.extensions.eda.plugins.event_source.smallstep_changes import (
+    ChangePoller,
+    SeenState,
+)
+from ansible_collections.smallstep.agent.tests.benchmark import mock_api
+
+
+@pytest.fixture
+def api():
+    server = mock_api.serve()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def admin(api):
+    """Client that changes the objects of the mock API"""
+    with httpx.Client(base_url=f"http://127.0.0.1:{api.server_port}/api") as client:
+        yield client
+
+
+def poll(api, state, **args):
+    async def run():
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api.server_port}/api") as client:
+            return await ChangePoller(client, args, state).poll()
+
+    return [event["smallstep"] for event in asyncio.run(run())]
+
+
+def changes(events):
+    return sorted(
+        (
+            event["change"],
+            event["type"],
+            event["collection_slug"],
+            event.get("instance_id") or event.get("workload_slug"),
+        )
+        for event in events
+    )
+
+
+def create_collection(admin, slug):
+    admin.put(f"/device-collections/{slug}", json={"displayName": slug}).raise_for_status()
+
+
+def test_created_updated_and_deleted(api, admin):
+    state = SeenState(None, "mock")
+    create_collection(admin, "hotdog")
+    admin.put("/collections/hotdog/instances/i-1", json={"data": {"name": "a"}}).raise_for_status()
+    admin.put("/device-collections/hotdog/workloads/nginx", json={"displayName": "Nginx"}).raise_for_status()
+    workloads = [{"collection_slug": "hotdog", "workload_slug": "nginx"}]
+
+    assert changes(poll(api, state, workloads=workloads)) == [
+        ("created", "collection", "hotdog", None),
+        ("created", "instance", "hotdog", "i-1"),
+        ("created", "workload", "hotdog", "nginx"),
+    ]
+    assert poll(api, state, workloads=workloads) == []
+
+    admin.put("/collections/hotdog", json={"displayName": "Hotdog"}).raise_for_status()
+    admin.put("/collections/hotdog/instances/i-1", json={"data": {"name": "b"}}).raise_for_status()
+    admin.put("/collections/hotdog/instances/i-2", json={"data": {"name": "c"}}).raise_for_status()
+    admin.put("/device-collections/hotdog/workloads/nginx", json={"displayName": "NGINX"}).raise_for_status()
+    events = poll(api, state, workloads=workloads)
+    assert changes(events) == [
+        ("created", "instance", "hotdog", "i-2"),
+        ("updated", "collection", "hotdog", None),
+        ("updated", "instance", "hotdog", "i-1"),
+        ("updated", "workload", "hotdog", "nginx"),
+    ]
+    updated = next(event for event in events if event.get("instance_id") == "i-1")
+    assert updated["object"]["data"] == {"name": "b"}
+
+    admin.delete("/collections/hotdog/instances/i-2").raise_for_status()
+    admin.delete("/device-collections/hotdog/workloads/nginx").raise_for_status()
+    assert changes(poll(api, state, workloads=workloads)) == [
+        ("deleted", "instance", "hotdog", "i-2"),
+        ("deleted", "workload", "hotdog", "nginx"),
+    ]
+
+    admin.delete("/collections/hotdog").raise_for_status()
+    assert changes(poll(api, state)) == [("deleted", "collection", "hotdog", None)]
+    assert state.collections == {} and state.instances == {}
+
+
+def test_unchanged_collections_wait_for_the_sweep(api, admin):
+    state = SeenState(None, "mock")
+    create_collection(admin, "hotdog")
+    admin.put("/collections/hotdog/instances/i-1", json={"data": {"name": "a"}}).raise_for_status()
+    poll(api, state, sweep_interval=3600)
+    requests = api.RequestHandlerClass.state.requests
+
+    # Instance metadata changes leave the collection as it was
+    admin.put("/collections/hotdog/instances/i-1/data", json={"name": "b"}).raise_for_status()
+    listed = requests["GET list_instances"]
+    assert poll(api, state, sweep_interval=3600) == []
+    assert requests["GET list_instances"] == listed
+
+    assert changes(poll(api, state, sweep_interval=0)) == [("updated", "instance", "hotdog", "i-1")]
+
+
+def test_checkpoint_reload(api, admin, tmp_path):
+    checkpoint = str(tmp_path / "changes.json")
+    state = SeenState(checkpoint, "mock")
+    assert not state.loaded
+    create_collection(admin, "hotdog")
+    admin.put("/collections/hotdog/instances/i-1", json={"data": {"name": "a"}}).raise_for_status()
+    poll(api, state)
+    state.save()
+
+    # What changed while the source was down is all that a restarted one reports
+    admin.put("/collections/hotdog/instances/i-2", json={"data": {"name": "b"}}).raise_for_status()
+    create_collection(admin, "burger")
+    restarted = SeenState(checkpoint, "mock")
+    assert restarted.loaded
+    assert changes(poll(api, restarted)) == [
+        ("created", "collection", "burger", None),
+        ("created", "instance", "hotdog", "i-2"),
+    ]
+
+    # A checkpoint of another API host is not used
+    assert not SeenState(checkpoint, "other").loaded
+
+
+def test_collection_deleted_during_a_poll(api, admin):
+    state = SeenState(None, "mock")
+    create_collection(admin, "hotdog")
+    admin.put("/collections/hotdog/instances/i-1", json={"data": {"name": "a"}}).raise_for_status()
+    poll(api, state)
+    admin.put("/collections/hotdog/instances/i-2", json={"data": {"name": "b"}}).raise_for_status()
+
+    class Racing(ChangePoller):
+        async def _poll_instances(self, slug):
+            admin.delete(f"/collections/{slug}").raise_for_status()
+            return await super()._poll_instances(slug)
+
+    async def run():
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api.server_port}/api") as client:
+            return await Racing(client, {}, state).poll()
+
+    assert changes(event["smallstep"] for event in asyncio.run(run())) == [("deleted", "collection", "hotdog", None)]
+    assert state.collections == {} and state.instances == {}
+
+
+def test_failed_poll_keeps_the_seen_state(api, admin):
+    state = SeenState(None, "mock")
+    create_collection(admin, "hotdog")
+    poll(api, state)
+    admin.put("/collections/hotdog", json={"displayName": "Hotdog"}).raise_for_status()
+    api.RequestHandlerClass.state.collections["hotdog"]["instanceCount"] = 1
+    before = state.snapshot()
+
+    class Failing(ChangePoller):
+        async def _poll_instances(self, slug):
+            raise httpx.ConnectError("reset")
+
+    async def run():
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api.server_port}/api") as client:
+            return await Failing(client, {}, state).poll()
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(run())
+    assert state.snapshot() == before
+    assert changes(poll(api, state)) == [("updated", "collection", "hotdog", None)]
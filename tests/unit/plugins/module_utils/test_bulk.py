@@ -0,0 +1,45 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+from ansible_collections.smallstep.agent.plugins.module_utils.bulk import BulkRunner
+from ansible_collections.smallstep.agent.plugins.module_utils.checkpoint import Checkpoint
+
+
+def key(item):
+    return item["id"]
+
+
+def describe(item):
+    return {"id": item["id"]}
+
+
+def test_resumed_items_are_unchanged(tmp_path):
+    path = str(tmp_path / "instances.journal")
+    items = [{"id": "i-1"}, {"id": "i-2"}]
+
+    def fail_second(item):
+        if item["id"] == "i-2":
+            raise RuntimeError("reset")
+        return dict(describe(item), changed=True, action="created")
+
+    checkpoint = Checkpoint(path, "api.test", "scope", resume=False)
+    first = BulkRunner(2, checkpoint=checkpoint, key=key).run(items, fail_second, describe)
+    checkpoint.close()
+    assert first[0] == {"id": "i-1", "changed": True, "action": "created"}
+    assert first[1]["failed"]
+
+    applied = []
+
+    def create(item):
+        applied.append(item["id"])
+        return dict(describe(item), changed=True, action="created")
+
+    checkpoint = Checkpoint(path, "api.test", "scope", resume=True)
+    second = BulkRunner(2, checkpoint=checkpoint, key=key).run(items, create, describe)
+    checkpoint.close()
+    assert applied == ["i-2"]
+    assert second == [
+        {"id": "i-1", "changed": False, "action": "unchanged", "resumed": True},
+        {"id": "i-2", "changed": True, "action": "created"},
+    ]
+    assert checkpoint.stats()["resumed"] == 1
@@ -0,0 +1,179 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import threading
+import time
+
+import httpx
+import pytest
+from ansible_collections.smallstep.agent.plugins.module_utils import telemetry as telemetry_module
+from ansible_collections.smallstep.agent.plugins.module_utils.concurrency import AdaptiveLimit
+from ansible_collections.smallstep.agent.plugins.module_utils.telemetry import Telemetry
+from smallstep.exceptions import StepException
+
+
+class Clock:
+    """Monotonic clock that SDK calls move forward by their duration"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        with self._lock:
+            self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(telemetry_module, "time", clock)
+    return clock
+
+
+def observe(limit, status_code=None, duration=0.01, error=None, operation="instance.put"):
+    """Make one SDK call through ``Telemetry`` and hand its call record to ``limit``
+
+    The call answers after ``duration``, raising ``StepException`` with
+    ``status_code`` for an API error, or ``error`` for a failure without
+    a response.
+    """
+    telemetry = Telemetry()
+    telemetry.observer = limit.observe
+
+    def sdk_call():
+        telemetry_module.time.advance(duration)
+        if status_code is not None:
+            raise StepException(status_code, {"message": "error"}, {})
+        if error is not None:
+            raise error
+
+    try:
+        telemetry.call(operation, sdk_call)
+    except (StepException, httpx.HTTPError):
+        pass
+    return telemetry.calls[-1]
+
+
+def grow(limit, n):
+    for _ in range(n):
+        observe(limit)
+
+
+def test_call_records_have_the_telemetry_shape():
+    limit = AdaptiveLimit(ceiling=32, initial=2)
+    assert observe(limit) == {"operation": "instance.put", "status_code": None, "duration": 0.01}
+    assert observe(limit, status_code=429)["status_code"] == 429
+    record = observe(limit, error=httpx.ConnectError("reset"))
+    assert record["status_code"] is None and record["error"] == "ConnectError"
+
+
+def test_slow_start_adds_one_per_successful_call():
+    limit = AdaptiveLimit(ceiling=32, initial=2)
+    grow(limit, 4)
+    assert limit.as_dict()["limit"] == 6
+    assert limit.slow_start
+
+
+@pytest.mark.parametrize("status_code", [429, 502, 503, 504])
+def test_overload_halves_the_limit_and_ends_slow_start(status_code):
+    limit = AdaptiveLimit(ceiling=32, initial=2)
+    grow(limit, 6)
+    observe(limit, status_code=status_code)
+    assert limit.as_dict() == {"ceiling": 32, "limit": 4, "peak": 0, "decreases": 1}
+    assert not limit.slow_start
+
+
+@pytest.mark.parametrize("status_code", [400, 404, 409, 500])
+def test_other_api_errors_do_not_decrease_the_limit(status_code):
+    limit = AdaptiveLimit(ceiling=32, initial=8)
+    observe(limit, status_code=status_code)
+    assert limit.decreases == 0
+    assert limit.as_dict()["limit"] == 9
+
+
+def test_error_without_response_halves_the_limit():
+    limit = AdaptiveLimit(ceiling=32, initial=8)
+    observe(limit, error=httpx.ConnectError("reset"))
+    assert limit.as_dict()["limit"] == 4
+
+
+def test_additive_increase_after_slow_start():
+    limit = AdaptiveLimit(ceiling=32, initial=8)
+    observe(limit, status_code=429)
+    # One more per round of ``limit`` calls
+    grow(limit, 4)
+    assert limit.as_dict()["limit"] == 4
+    grow(limit, 1)
+    assert limit.as_dict()["limit"] == 5
+
+
+def test_decreases_are_spaced_one_round_apart():
+    limit = AdaptiveLimit(ceiling=32, initial=16)
+    observe(limit, status_code=429)
+    assert limit.limit == 8
+    # The calls that were in flight with the first rejection count as the same signal
+    for _ in range(7):
+        observe(limit, status_code=429)
+    assert limit.limit == 8
+    assert limit.decreases == 1
+    # Once a round of ``limit`` calls finished, the next rejection counts
+    observe(limit, status_code=429)
+    assert limit.limit == 4
+    assert limit.decreases == 2
+
+
+def test_never_below_one():
+    limit = AdaptiveLimit(ceiling=4, initial=1)
+    for _ in range(10):
+        observe(limit, status_code=503)
+    assert limit.as_dict()["limit"] == 1
+    assert limit.decreases == 0
+
+
+def test_latency_above_tolerance_cuts_a_tenth():
+    limit = AdaptiveLimit(ceiling=32, initial=10, tolerance=2.0)
+    observe(limit, duration=0.01)
+    assert limit.limit == 11
+    for _ in range(3):
+        observe(limit, duration=0.1)
+    # The first slow call cuts the limit, the next ones wait for a round to pass
+    assert limit.decreases == 1
+    assert limit.limit == pytest.approx(11 * 0.9)
+
+
+def test_lookups_and_writes_have_their_own_baseline():
+    limit = AdaptiveLimit(ceiling=32, initial=4)
+    observe(limit, duration=0.01, operation="collection.get")
+    for _ in range(3):
+        observe(limit, duration=0.2, operation="instance.put")
+    assert limit.decreases == 0
+
+
+def test_never_exceeds_the_ceiling():
+    limit = AdaptiveLimit(ceiling=5, initial=2)
+    grow(limit, 100)
+    assert limit.as_dict()["limit"] == 5
+
+    def work():
+        limit.acquire()
+        try:
+            time.sleep(0.01)
+            observe(limit)
+        finally:
+            limit.release()
+
+    threads = [threading.Thread(target=work) for _ in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 1 < limit.peak <= 5
+    assert limit.in_flight == 0
+
+
+def test_initial_is_capped_by_the_ceiling():
+    assert AdaptiveLimit(ceiling=1, initial=2).as_dict()["limit"] == 1
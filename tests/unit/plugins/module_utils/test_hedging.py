@@ -0,0 +1,149 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import threading
+import time
+
+import httpx
+import pytest
+from ansible_collections.smallstep.agent.plugins.module_utils.hedging import HedgingPolicy, HedgingTransport
+from ansible_collections.smallstep.agent.plugins.module_utils.telemetry import Telemetry
+
+URL = "https://api.test/api/collections/hotdog"
+
+
+class FakeTransport(httpx.BaseTransport):
+    """Answers the n-th request after ``behaviors[n][0]`` seconds with ``behaviors[n][1]``
+
+    The answer is a status code, or an exception to raise.
+    """
+
+    def __init__(self, behaviors):
+        self.behaviors = list(behaviors)
+        self.calls = 0
+        self.closed = []
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        with self._lock:
+            delay, answer = self.behaviors[self.calls]
+            self.calls += 1
+            call = self.calls
+        time.sleep(delay)
+        if isinstance(answer, Exception):
+            raise answer
+        response = httpx.Response(answer, json={"call": call}, request=request)
+        response.close = lambda: self.closed.append(call)
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("SMALLSTEP_STATE_DIR", str(tmp_path))
+
+
+def trained_policy(latency=0.01, samples=20, max_ratio=0.1):
+    """A policy whose shared window already holds ``samples`` reads of ``latency``"""
+    policy = HedgingPolicy("api.test", percentile=95, max_ratio=max_ratio, min_samples=20)
+    for _ in range(samples):
+        policy.record(latency)
+    policy.flush()
+    return HedgingPolicy("api.test", percentile=95, max_ratio=max_ratio, min_samples=20)
+
+
+def get(transport):
+    return transport.handle_request(httpx.Request("GET", URL))
+
+
+def test_no_hedge_below_min_samples():
+    policy = trained_policy(samples=19)
+    fake = FakeTransport([(0.1, 200)])
+    telemetry = Telemetry()
+    response = get(HedgingTransport(fake, policy, telemetry))
+    assert policy.delay() is None
+    assert response.json() == {"call": 1}
+    assert fake.calls == 1
+    assert telemetry.transport["hedges"] == 0
+    assert policy.latencies and policy.latencies[0] >= 0.1
+
+
+def test_writes_are_never_hedged():
+    fake = FakeTransport([(0.1, 200)])
+    transport = HedgingTransport(fake, trained_policy(), Telemetry())
+    transport.handle_request(httpx.Request("PUT", URL, json={}))
+    assert fake.calls == 1
+
+
+def test_fast_primary_is_not_hedged():
+    fake = FakeTransport([(0.0, 200)])
+    telemetry = Telemetry()
+    response = get(HedgingTransport(fake, trained_policy(latency=0.2), telemetry))
+    assert response.json() == {"call": 1}
+    assert fake.calls == 1
+    assert telemetry.transport["hedges"] == 0
+
+
+def test_hedge_wins_and_the_loser_is_closed():
+    fake = FakeTransport([(0.3, 200), (0.0, 200)])
+    telemetry = Telemetry()
+    response = get(HedgingTransport(fake, trained_policy(), telemetry))
+    assert response.json() == {"call": 2}
+    assert telemetry.transport["hedges"] == 1
+    assert telemetry.transport["hedges_won"] == 1
+    deadline = time.monotonic() + 2
+    while not fake.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fake.closed == [1]
+
+
+def test_primary_that_answers_first_wins_after_hedging():
+    fake = FakeTransport([(0.1, 200), (0.5, 200)])
+    telemetry = Telemetry()
+    response = get(HedgingTransport(fake, trained_policy(), telemetry))
+    assert response.json() == {"call": 1}
+    assert telemetry.transport["hedges"] == 1
+    assert telemetry.transport["hedges_won"] == 0
+
+
+def test_hedge_budget_is_exhausted():
+    # One credit to start with, and no reads earn more
+    policy = trained_policy(max_ratio=0.0)
+    fake = FakeTransport([(0.1, 200), (0.1, 200), (0.1, 200)])
+    telemetry = Telemetry()
+    transport = HedgingTransport(fake, policy, telemetry)
+    get(transport)
+    assert telemetry.transport["hedges"] == 1
+    get(transport)
+    assert telemetry.transport["hedges"] == 1
+    assert fake.calls == 3
+
+
+def test_reads_earn_back_the_budget():
+    trained_policy(max_ratio=0.0)
+    policy = HedgingPolicy("api.test", percentile=95, max_ratio=0.5, min_samples=20)
+    assert policy.acquire()
+    assert not policy.acquire()
+    # Two reads at a ratio of one half earn one hedge
+    policy.record(0.01)
+    policy.record(0.01)
+    assert policy.acquire()
+
+
+def test_failed_primary_loses_to_the_hedge():
+    fake = FakeTransport([(0.1, httpx.ConnectError("reset")), (0.0, 200)])
+    telemetry = Telemetry()
+    response = get(HedgingTransport(fake, trained_policy(), telemetry))
+    assert response.json() == {"call": 2}
+    assert telemetry.transport["hedges_won"] == 1
+
+
+def test_both_failing_raises_the_primary_error():
+    fake = FakeTransport([(0.1, httpx.ConnectError("primary")), (0.0, httpx.ReadTimeout("hedge"))])
+    telemetry = Telemetry()
+    with pytest.raises(httpx.ConnectError, match="primary"):
+        get(HedgingTransport(fake, trained_policy(), telemetry))
+    assert telemetry.transport["hedges"] == 1
+    assert telemetry.transport["hedges_won"] == 0
@@ -0,0 +1,34 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import time
+
+import pytest
+from ansible_collections.smallstep.agent.plugins.module_utils.ratelimit import RateLimiter, RateLimitTimeout
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("SMALLSTEP_STATE_DIR", str(tmp_path))
+
+
+def test_burst_is_not_limited():
+    limiter = RateLimiter("api.test", rate=1, burst=3)
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_wait_past_max_wait_raises_without_taking_a_token():
+    limiter = RateLimiter("api.test", rate=10, burst=1)
+    limiter.acquire()
+    start = time.monotonic()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(max_wait=0.01)
+    assert time.monotonic() - start < 0.05
+    # The refused caller left no debt behind, so the next one waits one token, not two
+    assert limiter.acquire() == pytest.approx(0.1, abs=0.02)
+
+
+def test_wait_within_max_wait_sleeps():
+    limiter = RateLimiter("api.test", rate=20, burst=1)
+    limiter.acquire()
+    assert limiter.acquire(max_wait=1) == pytest.approx(0.05, abs=0.02)
@@ -0,0 +1,64 @@
+# Copyright: (c) 2023, Smallstep Labs, Inc. <techadmin@smallstep.com>
+# Apache-2.0 (see LICENSE or https://opensource.org/license/apache-2-0/)
+
+import datetime
+import json
+import time
+
+import pytest
+from ansible.module_utils.testing import patch_module_args
+from ansible_collections.smallstep.agent.plugins.modules import wait_for_certificate
+
+x509 = pytest.importorskip("cryptography.x509")
+hashes = pytest.importorskip("cryptography.hazmat.primitives.hashes")
+serialization = pytest.importorskip("cryptography.hazmat.primitives.serialization")
+ec = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.ec")
+
+
+def write_certificate(path, sans):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, sans[0])])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(san) for san in sans]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+
+
+def run(capsys, **args):
+    with patch_module_args(args), pytest.raises(SystemExit):
+        wait_for_certificate.main()
+    return json.loads(capsys.readouterr().out)
+
+
+def test_check_mode_does_not_wait_for_a_missing_certificate(tmp_path, capsys):
+    start = time.monotonic()
+    result = run(capsys, path=str(tmp_path / "redis.crt"), timeout=30, service="", _ansible_check_mode=True)
+    assert time.monotonic() - start < 5
+    assert not result.get("failed")
+    assert not result["changed"]
+    assert result["waited"] == 0.0
+    assert "check mode" in result["msg"]
+
+
+def test_check_mode_reports_an_issued_certificate(tmp_path, capsys):
+    path = tmp_path / "redis.crt"
+    write_certificate(path, ["staging.redis.hotdog.app"])
+    result = run(capsys, path=str(path), sans=["staging.redis.hotdog.app"], service="", _ansible_check_mode=True)
+    assert not result.get("failed")
+    assert result["sans"] == ["staging.redis.hotdog.app"]
+    assert "msg" not in result
+
+
+def test_missing_certificate_times_out(tmp_path, capsys):
+    result = run(capsys, path=str(tmp_path / "redis.crt"), timeout=1, service="")
+    assert result["failed"]
+    assert result["msg"].startswith("Timed out after 1s")